@@ -0,0 +1,27 @@
+"""add task info hash index
+
+Revision ID: 3b6a2f0d9c41
+Revises: 6e3f9c5c31d2
+Create Date: 2018-06-11 09:40:12.318204
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3b6a2f0d9c41'
+down_revision = '6e3f9c5c31d2'
+
+from alembic import op
+
+
+def upgrade():
+    # jsonb renders its text in a canonical form, so equal infos get the
+    # same hash regardless of the key order they were imported with.
+    # Building the index here locks the task table, so on large installs
+    # build it first with `python cli.py create_task_info_index`, which
+    # builds it concurrently, and this is a no-op.
+    op.execute('''CREATE INDEX IF NOT EXISTS task_project_id_info_md5_idx
+                  ON task (project_id, md5(info::text))''')
+
+
+def downgrade():
+    op.execute('DROP INDEX IF EXISTS task_project_id_info_md5_idx')
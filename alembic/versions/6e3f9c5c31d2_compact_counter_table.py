@@ -0,0 +1,31 @@
+"""compact counter table
+
+Revision ID: 6e3f9c5c31d2
+Revises: 174eb928136a
+Create Date: 2018-06-04 10:12:31.482107
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '6e3f9c5c31d2'
+down_revision = '174eb928136a'
+
+from alembic import op
+
+
+def upgrade():
+    # Fold the history of every task into a single row
+    sql = '''WITH folded AS (
+             DELETE FROM counter WHERE task_id IN
+             (SELECT task_id FROM counter GROUP BY task_id
+             HAVING COUNT(*) > 1)
+             RETURNING project_id, task_id, n_task_runs)
+             INSERT INTO counter (created, project_id, task_id, n_task_runs)
+             SELECT NOW(), project_id, task_id, SUM(n_task_runs)
+             FROM folded GROUP BY project_id, task_id'''
+    op.execute(sql)
+    op.create_unique_constraint('counter_task_id_key', 'counter', ['task_id'])
+
+
+def downgrade():
+    op.drop_constraint('counter_task_id_key', 'counter')
@@ -0,0 +1,73 @@
+"""add timestamptz columns
+
+Revision ID: a5d1c7e3b2f8
+Revises: 3b6a2f0d9c41
+Create Date: 2018-06-25 10:12:40.512337
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'a5d1c7e3b2f8'
+down_revision = '3b6a2f0d9c41'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+COLUMNS = dict(task_run=dict(created='created_at', finish_time='finished_at'),
+               task=dict(created='created_at'),
+               result=dict(created='created_at'))
+
+# Materialized views of the dashboard that are now built from the new
+# columns; the dashboard jobs create them again
+VIEWS = ['dashboard_week_users', 'dashboard_week_anon',
+         'dashboard_week_new_task', 'dashboard_week_new_task_run',
+         'dashboard_week_returning_users']
+
+
+def upgrade():
+    # The columns are NULL until they are set by the trigger for new rows
+    # and backfilled for the old ones with `python cli.py
+    # backfill_timestamps`, which builds their indexes concurrently too.
+    for table, columns in COLUMNS.items():
+        for copy in columns.values():
+            op.add_column(table, sa.Column(copy,
+                                           postgresql.TIMESTAMP(timezone=True)))
+    op.execute('''
+        CREATE OR REPLACE FUNCTION text_to_timestamptz(value TEXT)
+        RETURNS TIMESTAMPTZ AS $$
+        BEGIN
+            RETURN value::TIMESTAMP AT TIME ZONE 'UTC';
+        EXCEPTION WHEN others THEN
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql STABLE;''')
+    for table, columns in COLUMNS.items():
+        name = '%s_set_timestamptz' % table
+        assignments = ' '.join('NEW.%s := text_to_timestamptz(NEW.%s);' %
+                               (copy, column)
+                               for column, copy in sorted(columns.items()))
+        op.execute('''CREATE OR REPLACE FUNCTION %s() RETURNS TRIGGER AS $$
+                      BEGIN %s RETURN NEW; END;
+                      $$ LANGUAGE plpgsql;''' % (name, assignments))
+        op.execute('''CREATE TRIGGER %s BEFORE INSERT OR UPDATE ON %s
+                      FOR EACH ROW EXECUTE PROCEDURE %s();''' % (name, table,
+                                                                 name))
+    for view in VIEWS:
+        op.execute('DROP MATERIALIZED VIEW IF EXISTS %s' % view)
+
+
+def downgrade():
+    for view in VIEWS:
+        op.execute('DROP MATERIALIZED VIEW IF EXISTS %s' % view)
+    op.execute('DROP INDEX IF EXISTS task_run_project_id_finished_at_idx')
+    op.execute('DROP INDEX IF EXISTS task_run_finished_at_brin_idx')
+    op.execute('DROP INDEX IF EXISTS task_created_at_brin_idx')
+    for table, columns in COLUMNS.items():
+        name = '%s_set_timestamptz' % table
+        op.execute('DROP TRIGGER IF EXISTS %s ON %s' % (name, table))
+        op.execute('DROP FUNCTION IF EXISTS %s()' % name)
+        for copy in columns.values():
+            op.drop_column(table, copy)
+    op.execute('DROP FUNCTION IF EXISTS text_to_timestamptz(TEXT)')
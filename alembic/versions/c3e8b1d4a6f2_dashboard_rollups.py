@@ -0,0 +1,39 @@
+"""dashboard rollups
+
+Revision ID: c3e8b1d4a6f2
+Revises: a5d1c7e3b2f8
+Create Date: 2018-07-02 11:20:15.204518
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'c3e8b1d4a6f2'
+down_revision = 'a5d1c7e3b2f8'
+
+from alembic import op
+
+
+# Task and task run views are now plain views of the daily rollup tables
+ROLLUP_VIEWS = ['dashboard_week_users', 'dashboard_week_anon',
+                'dashboard_week_new_task', 'dashboard_week_new_task_run',
+                'dashboard_week_returning_users']
+
+# Views that now get a unique index to be refreshed concurrently
+VIEWS = ['dashboard_week_project_draft', 'dashboard_week_project_published',
+         'dashboard_week_project_update', 'dashboard_week_new_users']
+
+TABLES = ['dashboard_day_users', 'dashboard_day_anon', 'dashboard_day_tasks',
+          'dashboard_day_task_runs']
+
+
+def upgrade():
+    # The dashboard jobs create them again
+    for view in ROLLUP_VIEWS + VIEWS:
+        op.execute('DROP MATERIALIZED VIEW IF EXISTS %s' % view)
+
+
+def downgrade():
+    for view in ROLLUP_VIEWS:
+        op.execute('DROP VIEW IF EXISTS %s' % view)
+    for table in TABLES:
+        op.execute('DROP TABLE IF EXISTS %s' % table)
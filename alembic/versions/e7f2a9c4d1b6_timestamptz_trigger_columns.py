@@ -0,0 +1,58 @@
+"""timestamptz triggers only on timestamp updates
+
+Revision ID: e7f2a9c4d1b6
+Revises: c3e8b1d4a6f2
+Create Date: 2018-07-09 09:31:52.118406
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'e7f2a9c4d1b6'
+down_revision = 'c3e8b1d4a6f2'
+
+from alembic import op
+
+
+COLUMNS = dict(task_run=dict(created='created_at', finish_time='finished_at'),
+               task=dict(created='created_at'),
+               result=dict(created='created_at'))
+
+TIMESTAMP_FORMAT = ('^[0-9]{4}-(0[1-9]|1[0-2])-(0[1-9]|[12][0-9]|3[01])'
+                    '([T ]([01][0-9]|2[0-3]):[0-5][0-9]'
+                    '(:[0-5][0-9]([.][0-9]{1,6})?)?)?$')
+
+
+def upgrade():
+    # The function no longer catches errors, which opened a subtransaction
+    # for every row, and the triggers only fire on updates of the text
+    # timestamps instead of on every UPDATE
+    op.execute('''
+        CREATE OR REPLACE FUNCTION text_to_timestamptz(value TEXT)
+        RETURNS TIMESTAMPTZ AS $$
+            SELECT CASE WHEN value ~ '%s'
+                   THEN value::TIMESTAMP AT TIME ZONE 'UTC' END;
+        $$ LANGUAGE sql STABLE;''' % TIMESTAMP_FORMAT)
+    for table, columns in COLUMNS.items():
+        name = '%s_set_timestamptz' % table
+        op.execute('DROP TRIGGER IF EXISTS %s ON %s' % (name, table))
+        op.execute('''CREATE TRIGGER %s BEFORE INSERT OR UPDATE OF %s ON %s
+                      FOR EACH ROW EXECUTE PROCEDURE %s();''' % (
+            name, ', '.join(sorted(columns)), table, name))
+
+
+def downgrade():
+    op.execute('''
+        CREATE OR REPLACE FUNCTION text_to_timestamptz(value TEXT)
+        RETURNS TIMESTAMPTZ AS $$
+        BEGIN
+            RETURN value::TIMESTAMP AT TIME ZONE 'UTC';
+        EXCEPTION WHEN others THEN
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql STABLE;''')
+    for table in COLUMNS:
+        name = '%s_set_timestamptz' % table
+        op.execute('DROP TRIGGER IF EXISTS %s ON %s' % (name, table))
+        op.execute('''CREATE TRIGGER %s BEFORE INSERT OR UPDATE ON %s
+                      FOR EACH ROW EXECUTE PROCEDURE %s();''' % (name, table,
+                                                                 name))
@@ -656,6 +656,20 @@ def update_counters():
                                    n_task_runs=result.n_task_runs))
         db.session.commit()
 
+def compact_counters():
+    """Enqueue jobs folding the counter rows of every project into one per task."""
+    from pybossa.core import project_repo
+    from pybossa.jobs import enqueue_job, compact_task_counters
+
+    with app.app_context():
+        for project in project_repo.get_all():
+            job = dict(name=compact_task_counters,
+                       args=[project.id],
+                       kwargs={},
+                       timeout=app.config.get('TIMEOUT'),
+                       queue='low')
+            enqueue_job(job)
+
 def update_project_stats():
     """Update project stats for draft projects."""
     from pybossa.core import db
@@ -677,6 +691,76 @@ def update_project_stats():
         db.engine.execute(sql_query)
 
 
+def clear_memoized_cache():
+    """Delete every memoized value, including the ones memoized before
+    their keys were indexed."""
+    from pybossa.cache import delete_all_memoized
+    with app.app_context():
+        print "%s memoized values deleted" % delete_all_memoized()
+
+def create_task_info_index():
+    """Build the index used to find tasks with the same info on import."""
+    # CREATE INDEX CONCURRENTLY does not lock the task table while the index
+    # is built, but it cannot run in a transaction
+    sql = '''CREATE INDEX CONCURRENTLY IF NOT EXISTS
+             task_project_id_info_md5_idx
+             ON task (project_id, md5(info::text))'''
+    with app.app_context():
+        conn = db.engine.connect().execution_options(
+            isolation_level='AUTOCOMMIT')
+        try:
+            conn.execute(sql)
+        finally:
+            conn.close()
+
+def backfill_timestamps(batch_size=10000):
+    """Backfill the timestamptz columns of task runs, tasks and results."""
+    columns = [('task_run', dict(created='created_at',
+                                 finish_time='finished_at')),
+               ('task', dict(created='created_at')),
+               ('result', dict(created='created_at'))]
+    indexes = ['''CREATE INDEX CONCURRENTLY IF NOT EXISTS
+                  task_run_project_id_finished_at_idx
+                  ON task_run (project_id, finished_at)''',
+               '''CREATE INDEX CONCURRENTLY IF NOT EXISTS
+                  task_run_finished_at_brin_idx
+                  ON task_run USING brin (finished_at)''',
+               '''CREATE INDEX CONCURRENTLY IF NOT EXISTS
+                  task_created_at_brin_idx
+                  ON task USING brin (created_at)''']
+    from pybossa.core import json_exporter
+    with app.app_context():
+        project_ids = set()
+        for table, copies in columns:
+            sets = ', '.join('%s=text_to_timestamptz(%s)' % (copy, column)
+                             for column, copy in sorted(copies.items()))
+            # Newest rows first, so the stats of the last days are right as
+            # soon as possible
+            sql = text('''UPDATE %s SET %s WHERE id IN
+                       (SELECT id FROM %s WHERE id<:before
+                       ORDER BY id DESC LIMIT :limit)
+                       RETURNING id, project_id''' % (table, sets, table))
+            before = db.engine.execute(
+                text('SELECT MAX(id) + 1 FROM %s' % table)).scalar()
+            while before:
+                rows = db.engine.execute(sql, before=before,
+                                         limit=int(batch_size)).fetchall()
+                project_ids.update(row.project_id for row in rows)
+                before = min(row.id for row in rows) if rows else None
+                print "%s: backfilled %s rows" % (table, len(rows))
+        # The task runs exported before have the columns empty
+        for project_id in project_ids:
+            json_exporter.reset_spools(project_id)
+        # CREATE INDEX CONCURRENTLY does not lock the tables while the
+        # indexes are built, but it cannot run in a transaction
+        conn = db.engine.connect().execution_options(
+            isolation_level='AUTOCOMMIT')
+        try:
+            for sql in indexes:
+                conn.execute(sql)
+        finally:
+            conn.close()
+
 def anonymize_ips():
     """Anonymize all the IPs of the server."""
     from pybossa.core import anonymizer, task_repo
@@ -31,6 +31,7 @@ This package adds GET, POST, PUT and DELETE methods for:
 
 import json
 import jwt
+from datetime import datetime
 from flask import Blueprint, request, abort, Response, make_response
 from flask import current_app
 from flask.ext.login import current_user
@@ -41,6 +42,9 @@ import pybossa.model as model
 from pybossa.core import csrf, ratelimits, sentinel, anonymizer
 from pybossa.ratelimit import ratelimit
 from pybossa.cache.projects import n_tasks
+from pybossa.cache import users as cached_users
+from pybossa.leaderboard.data import get_scoped_rank
+from pybossa.leaderboard.scores import WindowedScores
 import pybossa.sched as sched
 from pybossa.error import ErrorStatus
 from global_stats import GlobalStatsAPI
@@ -59,13 +63,17 @@ from project_stats import ProjectStatsAPI
 from helpingmaterial import HelpingMaterialAPI
 from pybossa.core import project_repo, task_repo
 from pybossa.contributions_guard import ContributionsGuard
-from pybossa.auth import jwt_authorize_project
-from werkzeug.exceptions import MethodNotAllowed
+from pybossa.auth import jwt_authorize_project, ensure_authorized_to
+from pybossa.model.task import Task
+from werkzeug.exceptions import MethodNotAllowed, BadRequest
 
 blueprint = Blueprint('api', __name__)
 
 error = ErrorStatus()
 
+PREFETCH_LIMIT = 20
+LEADERBOARD_LIMIT = 20
+
 
 @blueprint.route('/')
 @ratelimit(limit=ratelimits.get('LIMIT'), per=ratelimits.get('PER'))
@@ -127,8 +135,7 @@ def new_task(project_id):
         # If there is a task for the user, return it
         if tasks is not None:
             guard = ContributionsGuard(sentinel.master)
-            for task in tasks:
-                guard.stamp(task, get_user_id_or_ip())
+            guard.stamp_many(tasks, get_user_id_or_ip())
             data = [task.dictize() for task in tasks]
             if len(data) == 0:
                 response = make_response(json.dumps({}))
@@ -143,7 +150,36 @@ def new_task(project_id):
         return error.format_exception(e, target='project', action='GET')
 
 
-def _retrieve_new_task(project_id):
+@jsonpify
+@blueprint.route('/project/<project_id>/newtask/prefetch')
+@ratelimit(limit=ratelimits.get('LIMIT'), per=ratelimits.get('PER'))
+def prefetch_tasks(project_id):
+    """Return a batch of new tasks for a project leased to the user.
+
+    Every task includes a lease_expires timestamp, the moment after which
+    the task can be handed out to other volunteers.
+    """
+    try:
+        tasks = _retrieve_new_task(project_id, default_limit=PREFETCH_LIMIT)
+
+        if type(tasks) is Response:
+            return tasks
+
+        tasks = tasks or []
+        guard = ContributionsGuard(sentinel.master)
+        expirations = guard.stamp_many(tasks, get_user_id_or_ip())
+        data = []
+        for task, expiration in zip(tasks, expirations):
+            datum = task.dictize()
+            datum['lease_expires'] = \
+                datetime.utcfromtimestamp(expiration).isoformat()
+            data.append(datum)
+        return Response(json.dumps(data), mimetype="application/json")
+    except Exception as e:
+        return error.format_exception(e, target='project', action='GET')
+
+
+def _retrieve_new_task(project_id, default_limit=1):
 
     project = project_repo.get(project_id)
 
@@ -165,7 +201,7 @@ def _retrieve_new_task(project_id):
     if request.args.get('limit'):
         limit = int(request.args.get('limit'))
     else:
-        limit = 1
+        limit = default_limit
 
     if limit > 100:
         limit = 100
@@ -241,6 +277,52 @@ def user_progress(project_id=None, short_name=None):
         return abort(404)
 
 
+@jsonpify
+@blueprint.route('/project/<int:project_id>/leaderboard')
+@blueprint.route('/category/<int:category_id>/leaderboard')
+@ratelimit(limit=ratelimits.get('LIMIT'), per=ratelimits.get('PER'))
+def scoped_leaderboard(project_id=None, category_id=None):
+    """API endpoint for the leaderboard of a project or category.
+
+    The window argument is day, week or all, the default, and limit the
+    number of users returned, from 1 to 100. The position of the current user
+    is returned too, or null if the user has not contributed in the window:
+        { 'window': 'week',
+          'top_users': [{'rank': 1, 'score': 10, 'name': ...}, ...],
+          'user': {'rank': 25, 'score': 2, 'name': ...}
+        }
+
+    """
+    scope = 'project' if project_id is not None else 'category'
+    try:
+        if project_id is not None:
+            scope_id = project_id
+            obj = project_repo.get(project_id)
+        else:
+            scope_id = category_id
+            obj = project_repo.get_category(category_id)
+        if obj is None:
+            raise NotFound
+        window = request.args.get('window', 'all')
+        if window not in WindowedScores.WINDOWS:
+            raise BadRequest('window must be one of %s'
+                             % ', '.join(sorted(WindowedScores.WINDOWS)))
+        try:
+            limit = int(request.args.get('limit', LEADERBOARD_LIMIT))
+        except ValueError:
+            raise BadRequest('limit must be an integer')
+        limit = max(1, min(limit, 100))
+        top_users = cached_users.get_scoped_leaderboard(scope, scope_id,
+                                                        window, limit)
+        user = None
+        if current_user.is_authenticated():
+            user = get_scoped_rank(scope, scope_id, current_user.id, window)
+        tmp = dict(window=window, top_users=top_users, user=user)
+        return Response(json.dumps(tmp), mimetype="application/json")
+    except Exception as e:
+        return error.format_exception(e, target=scope, action='GET')
+
+
 @jsonpify
 @blueprint.route('/auth/project/<short_name>/token')
 @ratelimit(limit=ratelimits.get('LIMIT'), per=ratelimits.get('PER'))
@@ -282,3 +364,44 @@ def get_disqus_sso_api():
     except MethodNotAllowed as e:
         e.message = "Disqus keys are missing"
         return error.format_exception(e, target='DISQUS_SSO', action='GET')
+
+
+@csrf.exempt
+@blueprint.route('/project/<int:project_id>/tasks/bulk', methods=['POST'])
+@ratelimit(limit=ratelimits.get('LIMIT'), per=ratelimits.get('PER'))
+def bulk_create_tasks(project_id):
+    """Create many tasks of a project in a single request.
+
+    The body is a JSON array of tasks or, with the application/x-ndjson
+    content type, one JSON task per line, which is read as a stream. Tasks
+    are inserted in chunks and committed all together.
+    """
+    try:
+        project = project_repo.get(project_id)
+        if project is None:
+            raise NotFound
+        ensure_authorized_to('create', Task(project_id=project.id))
+        chunks = []
+        created = task_repo.bulk_save(project.id, _read_bulk_tasks(),
+                                      progress=chunks.append)
+        tmp = dict(project_id=project.id, created=created,
+                   chunks=len(chunks))
+        return Response(json.dumps(tmp), mimetype='application/json')
+    except Exception as e:
+        return error.format_exception(e, target='task', action='POST')
+
+
+def _read_bulk_tasks():
+    if request.mimetype == 'application/x-ndjson':
+        tasks = (json.loads(line) for line in request.stream
+                 if line.strip())
+    else:
+        tasks = json.loads(request.data)
+        if not isinstance(tasks, list):
+            raise BadRequest('Expected a JSON array of tasks')
+    allowed = set(task_repo.BULK_COLUMNS) - TaskAPI.reserved_keys
+    for task in tasks:
+        if not isinstance(task, dict) or set(task.keys()) - allowed:
+            raise BadRequest('Invalid task: only %s can be set'
+                             % ', '.join(sorted(allowed)))
+        yield task
@@ -27,11 +27,14 @@ This package adds GET, POST, PUT and DELETE methods for any class:
 
 """
 import json
+import base64
 from flask import request, abort, Response, current_app
+from flask import stream_with_context
 from flask.ext.login import current_user
 from flask.views import MethodView
 from werkzeug.exceptions import NotFound, Unauthorized, Forbidden
-from werkzeug.exceptions import MethodNotAllowed
+from werkzeug.exceptions import MethodNotAllowed, BadRequest
+from werkzeug.urls import url_encode
 from pybossa.util import jsonpify, fuzzyboolean, get_avatar_url
 from pybossa.util import get_user_id_or_ip
 from pybossa.core import ratelimits, uploader
@@ -89,6 +92,12 @@ class APIBase(MethodView):
 
     allowed_classes_upload = ['blogpost', 'helpingmaterial', 'announcement']
 
+    # Opaque cursor to the next page of the current GET request, if any
+    _next_cursor = None
+
+    # Number of items whose related objects are loaded together
+    RELATED_BATCH = 100
+
     def refresh_cache(self, cls_name, oid):
         """Refresh the cache."""
         if caching.get(cls_name):
@@ -119,84 +128,171 @@ class APIBase(MethodView):
         """
         try:
             ensure_authorized_to('read', self.__class__)
+            self._next_cursor = None
+            stream_format = self._stream_format(oid)
+            if stream_format:
+                query = self._db_query(oid, yielded=True)
+                return self._create_stream_response(query, stream_format)
             query = self._db_query(oid)
             json_response = self._create_json_response(query, oid)
-            return Response(json_response, mimetype='application/json')
+            response = Response(json_response, mimetype='application/json')
+            if self._next_cursor:
+                args = request.args.copy()
+                args.pop('offset', None)
+                args.pop('last_id', None)
+                args['cursor'] = self._next_cursor
+                href = request.base_url + '?' + url_encode(args)
+                response.headers['Link'] = self.hateoas.link_header('next',
+                                                                    href)
+            return response
         except Exception as e:
             return error.format_exception(
                 e,
                 target=self.__class__.__name__.lower(),
                 action='GET')
 
-    def _create_json_response(self, query_result, oid):
-        if len(query_result) == 1 and query_result[0] is None:
-            raise abort(404)
-        items = []
+    def _stream_format(self, oid):
+        """Return the mimetype to stream a collection in, or None."""
+        if oid is not None or request.args.get('callback'):
+            return None
+        best = request.accept_mimetypes.best_match(['application/json',
+                                                    'application/x-ndjson'])
+        if best == 'application/x-ndjson':
+            return best
+        if fuzzyboolean(request.args.get('stream') or False):
+            return 'application/json'
+        return None
+
+    def _create_stream_response(self, query_result, mimetype):
+        """Return a response writing the items one by one as they are read.
+
+        application/json streams a JSON array and application/x-ndjson one
+        JSON object per line.
+        """
+        def generate():
+            if mimetype == 'application/x-ndjson':
+                for datum in self._iter_items(query_result):
+                    yield json.dumps(datum) + '\n'
+            else:
+                yield '['
+                separator = ''
+                for datum in self._iter_items(query_result):
+                    yield separator + json.dumps(datum)
+                    separator = ', '
+                yield ']'
+        return Response(stream_with_context(generate()), mimetype=mimetype)
+
+    def _iter_items(self, query_result):
+        """Yield the dict of every item of query_result the user can read.
+
+        Items belonging to a project are authorized once per project.
+        """
+        readable = {}
+        batch = []
         for result in query_result:
             # This is for n_favs orderby case
             if not isinstance(result, DomainObject):
                 if 'n_favs' in result.keys():
                     result = result[0]
-            try:
-                if (result.__class__ != self.__class__):
-                    (item, headline, rank) = result
-                else:
-                    item = result
-                    headline = None
-                    rank = None
-                datum = self._create_dict_from_model(item)
-                if headline:
-                    datum['headline'] = headline
-                if rank:
-                    datum['rank'] = rank
-                ensure_authorized_to('read', item)
-                items.append(datum)
-            except (Forbidden, Unauthorized):
-                # Remove last added item, as it is 401 or 403
-                if len(items) > 0:
-                    items.pop()
-            except Exception:  # pragma: no cover
-                raise
+            if (result.__class__ != self.__class__):
+                (item, headline, rank) = result
+            else:
+                item = result
+                headline = None
+                rank = None
+            if not self._can_read(item, readable):
+                continue
+            batch.append((item, headline, rank))
+            if len(batch) == self.RELATED_BATCH:
+                for datum in self._dictize_batch(batch):
+                    yield datum
+                batch = []
+        for datum in self._dictize_batch(batch):
+            yield datum
+
+    def _dictize_batch(self, batch):
+        related = self._load_related([item for item, _, _ in batch])
+        for item, headline, rank in batch:
+            datum = self._create_dict_from_model(item, related)
+            if headline:
+                datum['headline'] = headline
+            if rank:
+                datum['rank'] = rank
+            yield datum
+
+    def _load_related(self, items):
+        """Load the related objects of items with one query per kind.
+
+        It returns None unless the related objects have been requested.
+        """
+        if not items or not request.args.get('related'):
+            return None
+        name = self.__class__.__name__
+        if name == 'Task':
+            task_ids = set(item.id for item in items)
+        elif name in ('TaskRun', 'Result'):
+            task_ids = set(item.task_id for item in items)
+        else:
+            return None
+        task_ids = list(task_ids)
+        related = dict(tasks={}, task_runs={}, results={})
+        if name != 'Task':
+            for task in task_repo.get_tasks_by_ids(task_ids):
+                related['tasks'][task.id] = task.dictize()
+        if name != 'TaskRun':
+            for tr in task_repo.filter_task_runs_by_task_ids(task_ids):
+                related['task_runs'].setdefault(tr.task_id, [])\
+                                    .append(tr.dictize())
+        if name != 'Result':
+            for r in result_repo.filter_last_versions_by_task_ids(task_ids):
+                related['results'][r.task_id] = r.dictize()
+        return related
+
+    def _can_read(self, item, readable):
+        project_id = getattr(item, 'project_id', None)
+        if project_id is not None and project_id in readable:
+            return readable[project_id]
+        try:
+            ensure_authorized_to('read', item)
+            allowed = True
+        except (Forbidden, Unauthorized):
+            allowed = False
+        if project_id is not None:
+            readable[project_id] = allowed
+        return allowed
+
+    def _create_json_response(self, query_result, oid):
+        if len(query_result) == 1 and query_result[0] is None:
+            raise abort(404)
         if oid is not None:
             ensure_authorized_to('read', query_result[0])
+        items = list(self._iter_items(query_result))
+        if oid is not None:
             items = items[0]
         return json.dumps(items)
 
-    def _create_dict_from_model(self, model):
-        return self._select_attributes(self._add_hateoas_links(model))
+    def _create_dict_from_model(self, model, related=None):
+        return self._select_attributes(self._add_hateoas_links(model,
+                                                               related))
 
-    def _add_hateoas_links(self, item):
+    def _add_hateoas_links(self, item, related=None):
         obj = item.dictize()
-        related = request.args.get('related')
-        if related:
+        if request.args.get('related'):
+            if related is None:
+                related = self._load_related([item])
             if item.__class__.__name__ == 'Task':
-                obj['task_runs'] = []
-                obj['result'] = None
-                task_runs = task_repo.filter_task_runs_by(task_id=item.id)
-                results = result_repo.filter_by(task_id=item.id, last_version=True)
-                for tr in task_runs:
-                    obj['task_runs'].append(tr.dictize())
-                for r in results:
-                    obj['result'] = r.dictize()
+                obj['task_runs'] = related['task_runs'].get(item.id, [])
+                obj['result'] = related['results'].get(item.id)
 
             if item.__class__.__name__ == 'TaskRun':
-                tasks = task_repo.filter_tasks_by(id=item.task_id)
-                results = result_repo.filter_by(task_id=item.task_id, last_version=True)
-                obj['task'] = None
-                obj['result'] = None
-                for t in tasks:
-                    obj['task'] = t.dictize()
-                for r in results:
-                    obj['result'] = r.dictize()
+                obj['task'] = related['tasks'].get(item.task_id)
+                obj['result'] = related['results'].get(item.task_id)
 
             if item.__class__.__name__ == 'Result':
-                tasks = task_repo.filter_tasks_by(id=item.task_id)
-                task_runs = task_repo.filter_task_runs_by(task_id=item.task_id)
-                obj['task_runs'] = []
-                for t in tasks:
-                    obj['task'] = t.dictize()
-                for tr in task_runs:
-                    obj['task_runs'].append(tr.dictize())
+                task = related['tasks'].get(item.task_id)
+                if task is not None:
+                    obj['task'] = task
+                obj['task_runs'] = related['task_runs'].get(item.task_id, [])
 
         stats = request.args.get('stats')
         if stats:
@@ -211,12 +307,15 @@ class APIBase(MethodView):
             obj['link'] = link
         return obj
 
-    def _db_query(self, oid):
-        """Returns a list with the results of the query"""
+    def _db_query(self, oid, yielded=False):
+        """Returns a list with the results of the query, or an iterable
+        over them if yielded is True"""
         repo_info = repos[self.__class__.__name__]
         if oid is None:
-            limit, offset, orderby = self._set_limit_and_offset()
-            results = self._filter_query(repo_info, limit, offset, orderby)
+            limit, offset, orderby = self._set_limit_and_offset(
+                max_limit=self._max_limit(yielded))
+            results = self._filter_query(repo_info, limit, offset, orderby,
+                                         yielded=yielded)
         else:
             repo = repo_info['repo']
             query_func = repo_info['get']
@@ -230,12 +329,18 @@ class APIBase(MethodView):
             del filters['owner_id']
         return filters
 
-    def _filter_query(self, repo_info, limit, offset, orderby):
+    def _max_limit(self, yielded):
+        if yielded:
+            return current_app.config.get('API_STREAM_LIMIT', 10000)
+        return 100
+
+    def _filter_query(self, repo_info, limit, offset, orderby, yielded=False):
         filters = {}
         for k in request.args.keys():
             if k not in ['limit', 'offset', 'api_key', 'last_id', 'all',
                          'fulltextsearch', 'desc', 'orderby', 'related',
-                         'participated', 'full', 'stats']:
+                         'participated', 'full', 'stats', 'cursor',
+                         'stream']:
                 # Raise an error if the k arg is not a column
                 if self.__class__ == Task and k == 'external_uid':
                     pass
@@ -252,23 +357,57 @@ class APIBase(MethodView):
         fulltextsearch = request.args.get('fulltextsearch')
         desc = request.args.get('desc') if request.args.get('desc') else False
         desc = fuzzyboolean(desc)
-        if last_id:
+        cursor = request.args.get('cursor')
+        if cursor:
+            orderby, desc, last_id = self._decode_cursor(cursor)
+            results = getattr(repo, query_func)(limit=limit, last_id=last_id,
+                                                fulltextsearch=fulltextsearch,
+                                                desc=desc,
+                                                orderby=orderby,
+                                                yielded=yielded,
+                                                **filters)
+        elif last_id:
             results = getattr(repo, query_func)(limit=limit, last_id=last_id,
                                                 fulltextsearch=fulltextsearch,
                                                 desc=False,
                                                 orderby=orderby,
+                                                yielded=yielded,
                                                 **filters)
         else:
             results = getattr(repo, query_func)(limit=limit, offset=offset,
                                                 fulltextsearch=fulltextsearch,
                                                 desc=desc,
                                                 orderby=orderby,
+                                                yielded=yielded,
                                                 **filters)
+        if (not yielded and len(results) == limit and not fulltextsearch and
+                orderby != 'fav_user_ids'):
+            self._next_cursor = self._encode_cursor(results[-1], orderby, desc)
         return results
 
-    def _set_limit_and_offset(self):
+    def _encode_cursor(self, item, orderby, desc):
+        """Return an opaque cursor pointing to the rows after item."""
+        value = getattr(item, orderby)
+        if not isinstance(value, (basestring, int, long, float, type(None))):
+            return None
+        data = json.dumps([orderby, desc, value, item.id])
+        return base64.urlsafe_b64encode(data)
+
+    def _decode_cursor(self, cursor):
+        """Return the orderby, desc and last_id encoded in cursor."""
+        try:
+            data = base64.urlsafe_b64decode(cursor.encode('ascii'))
+            orderby, desc, value, item_id = json.loads(data)
+            getattr(self.__class__, orderby)
+            if orderby == 'fav_user_ids':
+                raise ValueError(orderby)
+            return orderby, bool(desc), (value, int(item_id))
+        except (TypeError, ValueError, AttributeError):
+            raise BadRequest('Invalid cursor')
+
+    def _set_limit_and_offset(self, max_limit=100):
         try:
-            limit = min(100, int(request.args.get('limit')))
+            limit = min(max_limit, int(request.args.get('limit')))
         except (ValueError, TypeError):
             limit = 20
         try:
@@ -32,7 +32,7 @@ class ResultAPI(APIBase):
     """Class for domain object Result."""
 
     __class__ = Result
-    reserved_keys = set(['id', 'created', 'project_id',
+    reserved_keys = set(['id', 'created', 'created_at', 'project_id',
                          'task_id', 'task_run_ids', 'last_version'])
 
     def _forbidden_attributes(self, data):
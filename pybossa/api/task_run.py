@@ -40,7 +40,8 @@ class TaskRunAPI(APIBase):
     """Class API for domain object TaskRun."""
 
     __class__ = TaskRun
-    reserved_keys = set(['id', 'created', 'finish_time'])
+    reserved_keys = set(['id', 'created', 'finish_time', 'created_at',
+                         'finished_at'])
 
     def _update_object(self, taskrun):
         """Update task_run object with user id or ip."""
@@ -70,7 +71,8 @@ class TaskRunAPI(APIBase):
                 raise Forbidden(msg)
 
     def _ensure_task_was_requested(self, task, guard):
-        if not guard.check_task_stamped(task, get_user_id_or_ip()):
+        user = get_user_id_or_ip()
+        if not guard.check_task_stamped(task, user):
             raise Forbidden('You must request a task first!')
 
     def _add_user_info(self, taskrun):
@@ -22,14 +22,30 @@ This module exports a set of decorators for caching functions.
 It exports:
     * cache: for caching functions without parameters
     * memoize: for caching functions using its arguments as part of the key
+    * memoize_many: for resolving many calls of a memoized function at once
     * delete_cached: to remove a cached value
     * delete_memoized: to remove a cached value from the memoize decorator
+    * delete_all_memoized: to remove every memoized value
+
+Values are stored in Redis. The keys memoized for each function are indexed
+in a Redis set, so they can be deleted without scanning the keyspace. When
+CACHE_LOCAL_SIZE is set, every process also keeps the most recently used
+values in memory for up to CACHE_LOCAL_TIMEOUT seconds. Deletions are
+broadcast over Redis pub/sub so they reach the in-memory cache of every
+process.
 
 """
 import os
 import hashlib
+import threading
+from collections import OrderedDict
 from functools import wraps
+from math import log
+from random import random
+from time import time, sleep
+from redis.exceptions import ConnectionError
 from pybossa.core import sentinel
+from pybossa.redis_lock import RedisLock
 
 try:
     import cPickle as pickle
@@ -47,6 +63,27 @@ ONE_HOUR = 60 * 60
 HALF_HOUR = 30 * 60
 FIVE_MINUTES = 5 * 60
 
+INVALIDATION_CHANNEL = '%s:invalidate' % settings.REDIS_KEYPREFIX
+# Number of memoized keys deleted per DEL command
+INDEX_BATCH = 1000
+# Seconds a worker may hold the lock to recompute a value kept with grace
+LOCK_TIMEOUT = 5 * 60
+# Seconds other workers wait for that value before computing it themselves
+LOCK_WAIT = 10
+LOCK_POLL = 0.1
+# Larger values refresh entries kept with grace earlier before they expire
+EARLY_EXPIRATION_BETA = 1.0
+
+
+# KEYS: key. ARGV: timeout. Sets the timeout of the key unless it already
+# expires later.
+EXTEND_TTL_SCRIPT = """
+if redis.call('TTL', KEYS[1]) < tonumber(ARGV[1]) then
+    return redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+return 0
+"""
+
 
 def get_key_to_hash(*args, **kwargs):
     """Return key to hash for *args and **kwargs."""
@@ -60,6 +97,11 @@ def get_key_to_hash(*args, **kwargs):
     return key_to_hash
 
 
+def get_index_key(function_name):
+    """Return the key of the set indexing the memoized keys of a function."""
+    return "%s:%s_index" % (settings.REDIS_KEYPREFIX, function_name)
+
+
 def get_hash_key(prefix, key_to_hash):
     """Return hash for a prefix and a key to hash."""
     key_to_hash = key_to_hash.encode('utf-8')
@@ -67,12 +109,226 @@ def get_hash_key(prefix, key_to_hash):
     return key
 
 
-def cache(key_prefix, timeout=300):
+class LocalCache(object):
+
+    """Thread safe in-memory LRU cache with a per entry timeout.
+
+    Its generation is bumped by every deletion, so a value read from Redis
+    before a deletion is not stored after it.
+    """
+
+    def __init__(self, max_size, timeout):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.generation = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is None or item[0] < time():
+                return None
+            self._data[key] = item
+            return item[1]
+
+    def set(self, key, value, timeout, generation=None):
+        """Store value, unless generation is given and there have been
+        deletions since."""
+        expires = time() + min(timeout, self.timeout)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._data.pop(key, None)
+            self._data[key] = (expires, value)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self.generation += 1
+            return self._data.pop(key, None) is not None
+
+    def delete_prefix(self, prefix):
+        with self._lock:
+            self.generation += 1
+            for key in [k for k in self._data if k.startswith(prefix)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._data.clear()
+
+
+_local = dict(pid=None, cache=None)
+
+
+def get_local_cache():
+    """Return the in-memory cache of this process, or None if disabled.
+
+    The cache and the thread listening for invalidations are created the
+    first time they are needed in each process, so forked workers do not
+    share them.
+    """
+    max_size = getattr(settings, 'CACHE_LOCAL_SIZE', 0)
+    if not max_size:
+        return None
+    if _local['pid'] != os.getpid():
+        local = LocalCache(max_size, getattr(settings, 'CACHE_LOCAL_TIMEOUT',
+                                             60))
+        listener = threading.Thread(target=_listen_invalidations,
+                                    args=(local,))
+        listener.daemon = True
+        listener.start()
+        _local.update(pid=os.getpid(), cache=local)
+    return _local['cache']
+
+
+def invalidate_local(local, message):
+    """Apply an invalidation message to the local cache."""
+    if message.endswith('*'):
+        local.delete_prefix(message[:-1])
+    else:
+        local.delete(message)
+
+
+def _listen_invalidations(local):
+    while True:
+        try:
+            pubsub = sentinel.master.pubsub()
+            pubsub.subscribe(INVALIDATION_CHANNEL)
+            for message in pubsub.listen():
+                if message['type'] == 'message':
+                    invalidate_local(local, message['data'])
+        except ConnectionError:
+            pass
+        # Invalidations may have been missed while disconnected
+        local.clear()
+        sleep(1)
+
+
+def _get_cached(key):
+    local = get_local_cache()
+    if local is None:
+        return sentinel.slave.get(key)
+    output = local.get(key)
+    if output is None:
+        generation = local.generation
+        pipeline = sentinel.slave.pipeline()
+        pipeline.get(key)
+        pipeline.ttl(key)
+        output, ttl = pipeline.execute()
+        if output and ttl > 0:
+            local.set(key, output, ttl, generation)
+    return output
+
+
+def _set_cached(key, timeout, output, index=None):
+    value = pickle.dumps(output)
+    pipeline = sentinel.master.pipeline()
+    pipeline.setex(key, timeout, value)
+    if index is not None:
+        pipeline.sadd(index, key)
+        _extend_ttl(pipeline, index, timeout)
+    pipeline.execute()
+    local = get_local_cache()
+    if local is not None:
+        local.set(key, value, timeout)
+
+
+def _extend_ttl(pipeline, index, timeout):
+    """Make the index of a function outlive an entry stored with timeout.
+
+    Its entries may be stored with different timeouts, e.g. by memoize and
+    memoize_many, so the timeout of the index is only ever extended.
+    """
+    script = sentinel.master.register_script(EXTEND_TTL_SCRIPT)
+    script(keys=[index], args=[timeout], client=pipeline)
+
+
+def _invalidate(key):
+    """Remove key, or every key starting with it if it ends in *, from the
+    in-memory cache of every process."""
+    local = get_local_cache()
+    if local is not None:
+        invalidate_local(local, key)
+        sentinel.master.publish(INVALIDATION_CHANNEL, key)
+
+
+class CachedEntry(object):
+
+    """Value stored by the decorators when a grace period is used.
+
+    It keeps how long the value took to compute, used to refresh it early.
+    """
+
+    def __init__(self, value, delta):
+        self.value = value
+        self.delta = delta
+
+
+def _compute_with_grace(key, timeout, grace, index, f, args, kwargs):
+    start = time()
+    output = f(*args, **kwargs)
+    entry = CachedEntry(output, time() - start)
+    _set_cached(key, timeout + grace, entry, index=index)
+    return output
+
+
+def _call_with_grace(key, timeout, grace, index, f, args, kwargs):
+    """Return the cached value of f, recomputing it in one worker only.
+
+    Values are kept grace seconds after they expire. Meanwhile, the worker
+    that gets the lock recomputes the value and the rest keep serving the
+    stale one. Values are also recomputed before they expire, with a
+    probability that grows as the expiration approaches and with the time
+    the value took to compute, so expirations do not pile up.
+    """
+    lock = RedisLock(sentinel.master, key + ':lock', LOCK_TIMEOUT)
+    pipeline = sentinel.slave.pipeline()
+    pipeline.get(key)
+    pipeline.ttl(key)
+    output, ttl = pipeline.execute()
+    if output:
+        entry = pickle.loads(output)
+        if not isinstance(entry, CachedEntry):
+            return entry
+        fresh_for = ttl - grace
+        early = -entry.delta * EARLY_EXPIRATION_BETA * log(1 - random())
+        if fresh_for > early:
+            return entry.value
+        if not lock.acquire():
+            return entry.value
+    elif not lock.acquire():
+        waited = 0
+        while waited < LOCK_WAIT:
+            sleep(LOCK_POLL)
+            waited += LOCK_POLL
+            output = sentinel.slave.get(key)
+            if output:
+                entry = pickle.loads(output)
+                if isinstance(entry, CachedEntry):
+                    return entry.value
+                return entry
+        return _compute_with_grace(key, timeout, grace, index, f, args,
+                                   kwargs)
+    try:
+        return _compute_with_grace(key, timeout, grace, index, f, args,
+                                   kwargs)
+    finally:
+        lock.release()
+
+
+def cache(key_prefix, timeout=300, grace=None):
     """
     Decorator for caching functions.
 
     Returns the function value from cache, or the function if cache disabled
 
+    When grace is given, expired values are served for grace more seconds
+    while a single worker recomputes them.
+
     """
     if timeout is None:
         timeout = 300
@@ -81,11 +337,14 @@ def cache(key_prefix, timeout=300):
         def wrapper(*args, **kwargs):
             key = "%s::%s" % (settings.REDIS_KEYPREFIX, key_prefix)
             if os.environ.get('PYBOSSA_REDIS_CACHE_DISABLED') is None:
-                output = sentinel.slave.get(key)
+                if grace:
+                    return _call_with_grace(key, timeout, grace, None, f,
+                                            args, kwargs)
+                output = _get_cached(key)
                 if output:
                     return pickle.loads(output)
                 output = f(*args, **kwargs)
-                sentinel.master.setex(key, timeout, pickle.dumps(output))
+                _set_cached(key, timeout, output)
                 return output
             output = f(*args, **kwargs)
             sentinel.master.setex(key, timeout, pickle.dumps(output))
@@ -94,12 +353,15 @@ def cache(key_prefix, timeout=300):
     return decorator
 
 
-def memoize(timeout=300):
+def memoize(timeout=300, grace=None):
     """
     Decorator for caching functions using its arguments as part of the key.
 
     Returns the cached value, or the function if the cache is disabled
 
+    When grace is given, expired values are served for grace more seconds
+    while a single worker recomputes them.
+
     """
     if timeout is None:
         timeout = 300
@@ -110,11 +372,16 @@ def memoize(timeout=300):
             key_to_hash = get_key_to_hash(*args, **kwargs)
             key = get_hash_key(key, key_to_hash)
             if os.environ.get('PYBOSSA_REDIS_CACHE_DISABLED') is None:
-                output = sentinel.slave.get(key)
+                if grace:
+                    return _call_with_grace(key, timeout, grace,
+                                            get_index_key(f.__name__), f,
+                                            args, kwargs)
+                output = _get_cached(key)
                 if output:
                     return pickle.loads(output)
                 output = f(*args, **kwargs)
-                sentinel.master.setex(key, timeout, pickle.dumps(output))
+                _set_cached(key, timeout, output,
+                            index=get_index_key(f.__name__))
                 return output
             output = f(*args, **kwargs)
             sentinel.master.setex(key, timeout, pickle.dumps(output))
@@ -123,6 +390,55 @@ def memoize(timeout=300):
     return decorator
 
 
+def memoize_many(function, timeout=300):
+    """
+    Decorator for resolving many calls of a memoized function at once.
+
+    The decorated function takes a list with the single argument of each
+    call of function and returns a dict mapping each of them to its value.
+    Cached values are read with a single MGET and only the misses are passed
+    to the decorated function, whose values are stored in a single pipeline
+    under the same keys function uses, so delete_memoized(function, arg)
+    keeps working for both.
+
+    Values are read from and stored in Redis only, bypassing the in-memory
+    cache of the process and the grace period of function.
+
+    """
+    if timeout is None:
+        timeout = 300
+    prefix = "%s:%s_args:" % (settings.REDIS_KEYPREFIX, function.__name__)
+    index = get_index_key(function.__name__)
+    def decorator(f):
+        @wraps(f)
+        def wrapper(args):
+            args = list(OrderedDict.fromkeys(args))
+            if not args:
+                return dict()
+            if os.environ.get('PYBOSSA_REDIS_CACHE_DISABLED') is not None:
+                return f(args)
+            keys = [get_hash_key(prefix, get_key_to_hash(arg)) for arg in args]
+            output = dict()
+            misses = []
+            for arg, key, value in zip(args, keys, sentinel.slave.mget(keys)):
+                if value:
+                    output[arg] = pickle.loads(value)
+                else:
+                    misses.append((arg, key))
+            if misses:
+                values = f([arg for arg, _ in misses])
+                pipeline = sentinel.master.pipeline()
+                for arg, key in misses:
+                    output[arg] = values[arg]
+                    pipeline.setex(key, timeout, pickle.dumps(values[arg]))
+                    pipeline.sadd(index, key)
+                _extend_ttl(pipeline, index, timeout)
+                pipeline.execute()
+            return output
+        return wrapper
+    return decorator
+
+
 def delete_cached(key):
     """
     Delete a cached value from the cache.
@@ -132,7 +448,9 @@ def delete_cached(key):
     """
     if os.environ.get('PYBOSSA_REDIS_CACHE_DISABLED') is None:
         key = "%s::%s" % (settings.REDIS_KEYPREFIX, key)
-        return bool(sentinel.master.delete(key))
+        deleted = bool(sentinel.master.delete(key))
+        _invalidate(key)
+        return deleted
     return True
 
 
@@ -145,12 +463,51 @@ def delete_memoized(function, *args, **kwargs):
     """
     if os.environ.get('PYBOSSA_REDIS_CACHE_DISABLED') is None:
         key = "%s:%s_args:" % (settings.REDIS_KEYPREFIX, function.__name__)
+        index = get_index_key(function.__name__)
         if args or kwargs:
             key_to_hash = get_key_to_hash(*args, **kwargs)
             key = get_hash_key(key, key_to_hash)
-            return bool(sentinel.master.delete(key))
-        keys_to_delete = sentinel.slave.keys(pattern=key + '*')
-        if not keys_to_delete:
-            return False
-        return bool(sentinel.master.delete(*keys_to_delete))
+            pipeline = sentinel.master.pipeline()
+            pipeline.delete(key)
+            pipeline.srem(index, key)
+            deleted = bool(pipeline.execute()[0])
+            _invalidate(key)
+            return deleted
+        # Read and drop the index atomically, so keys memoized meanwhile
+        # land in a new index instead of being lost
+        pipeline = sentinel.master.pipeline()
+        pipeline.smembers(index)
+        pipeline.delete(index)
+        keys_to_delete = list(pipeline.execute()[0])
+        pipeline = sentinel.master.pipeline()
+        for i in range(0, len(keys_to_delete), INDEX_BATCH):
+            pipeline.delete(*keys_to_delete[i:i + INDEX_BATCH])
+        deleted = sum(pipeline.execute())
+        _invalidate(key + '*')
+        return bool(deleted)
     return True
+
+
+def delete_all_memoized():
+    """
+    Delete every memoized value from the cache, scanning the keyspace.
+
+    Values memoized before their keys were indexed are not deleted by
+    delete_memoized without arguments, so run it once after upgrading with
+    `python cli.py clear_memoized_cache`. Returns the number of deleted
+    values.
+
+    """
+    if os.environ.get('PYBOSSA_REDIS_CACHE_DISABLED') is not None:
+        return 0
+    pattern = "%s:*_args:*" % settings.REDIS_KEYPREFIX
+    deleted = 0
+    keys_to_delete = []
+    for key in sentinel.master.scan_iter(match=pattern, count=INDEX_BATCH):
+        keys_to_delete.append(key)
+        if len(keys_to_delete) == INDEX_BATCH:
+            deleted += sentinel.master.delete(*keys_to_delete)
+            keys_to_delete = []
+    if keys_to_delete:
+        deleted += sentinel.master.delete(*keys_to_delete)
+    return deleted
@@ -18,10 +18,12 @@
 """Cache module for project stats."""
 from flask import current_app
 from sqlalchemy.sql import text
-from pybossa.core import db
-from pybossa.cache import memoize, ONE_DAY, FIVE_MINUTES
+from pybossa.core import db, sentinel
+from pybossa.cache import memoize, ONE_DAY, ONE_HOUR, FIVE_MINUTES
 import pybossa.cache.projects as cached_projects
+from pybossa.model import timestamptz_sql, timestamptz_compare_sql
 from pybossa.model.project_stats import ProjectStats
+from pybossa.stats_rollup import StatsRollup
 from flask.ext.babel import gettext
 
 import operator
@@ -32,6 +34,13 @@ import os
 
 session = db.slave_session
 
+# Task runs finished from the day after the start of the period on
+PERIOD_SQL = dict(
+    finished_at=timestamptz_sql('task_run', 'finish_time', 'finished_at'),
+    finished_since=timestamptz_compare_sql(
+        'task_run', 'finish_time', 'finished_at', '>=',
+        "DATE_TRUNC('day', NOW() - :period ::INTERVAL) + INTERVAL '1 day'"))
+
 
 @memoize(timeout=ONE_DAY)
 def n_tasks(project_id):
@@ -43,7 +52,7 @@ def n_tasks(project_id):
     return projects.n_tasks(project_id)
 
 
-@memoize(timeout=ONE_DAY)
+@memoize(timeout=ONE_DAY, grace=ONE_HOUR)
 def stats_users(project_id, period=None):
     """Return users's stats for a given project_id."""
     users = {}
@@ -66,10 +75,9 @@ def stats_users(project_id, period=None):
                    WHERE task_run.user_id IS NOT NULL AND
                    task_run.user_ip IS NULL AND
                    task_run.project_id=:project_id AND
-                   TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                   >= NOW() - :period ::INTERVAL
+                   %(finished_since)s
                    GROUP BY task_run.user_id ORDER BY n_tasks DESC
-                   LIMIT 5;''')\
+                   LIMIT 5;''' % PERIOD_SQL)\
             .execution_options(stream=True)
         params['period'] = period
 
@@ -87,9 +95,8 @@ def stats_users(project_id, period=None):
                    FROM task_run WHERE task_run.user_id IS NOT NULL AND
                    task_run.user_ip IS NULL AND
                    task_run.project_id=:project_id AND
-                   TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                   >= NOW() - :period ::INTERVAL
-                   ;''')
+                   %(finished_since)s
+                   ;''' % PERIOD_SQL)
 
     results = session.execute(sql, params)
     for row in results:
@@ -110,9 +117,8 @@ def stats_users(project_id, period=None):
                    WHERE task_run.user_ip IS NOT NULL AND
                    task_run.user_id IS NULL AND
                    task_run.project_id=:project_id AND
-                   TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                   >= NOW() - :period ::INTERVAL
-                   GROUP BY task_run.user_ip ORDER BY n_tasks DESC;''')\
+                   %(finished_since)s
+                   GROUP BY task_run.user_ip ORDER BY n_tasks DESC;''' % PERIOD_SQL)\
             .execution_options(stream=True)
 
     results = session.execute(sql, params)
@@ -129,9 +135,8 @@ def stats_users(project_id, period=None):
                    FROM task_run WHERE task_run.user_ip IS NOT NULL AND
                    task_run.user_id IS NULL AND
                    task_run.project_id=:project_id AND
-                   TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                   >= NOW() - :period ::INTERVAL
-                   ;''')
+                   %(finished_since)s
+                   ;''' % PERIOD_SQL)
 
     results = session.execute(sql, params)
 
@@ -159,7 +164,7 @@ def convert_period_to_days(period):
     return int_period
 
 
-@memoize(timeout=ONE_DAY)
+@memoize(timeout=ONE_DAY, grace=ONE_HOUR)
 def stats_dates(project_id, period='15 day'):
     """Return statistics with dates for a project."""
     dates = {}
@@ -177,18 +182,16 @@ def stats_dates(project_id, period='15 day'):
                FROM task LEFT OUTER JOIN
                (SELECT task_id, COUNT(id) AS ct FROM task_run
                WHERE project_id=:project_id AND
-               TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-               >= NOW() - :period :: INTERVAL
+               %(finished_since)s
                GROUP BY task_id) AS log_counts
                ON task.id=log_counts.task_id
                WHERE task.project_id=:project_id ORDER BY id ASC)
                select myquery.id, max(task_run.finish_time) as day
                from task_run, myquery where task_run.task_id=myquery.id
                and
-               TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-               >= NOW() - :period :: INTERVAL
+               %(finished_since)s
                group by myquery.id order by day;
-               ''').execution_options(stream=True)
+               ''' % PERIOD_SQL).execution_options(stream=True)
 
     results = session.execute(sql, params)
     for row in results:
@@ -213,15 +216,14 @@ def stats_dates(project_id, period='15 day'):
     # Get all answers per date for auth
     sql = text('''
                 WITH myquery AS (
-                    SELECT TO_DATE(finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
+                    SELECT DATE(%(finished_at)s AT TIME ZONE 'UTC')
                     as d, COUNT(id)
                     FROM task_run WHERE project_id=:project_id
                     AND user_ip IS NULL AND
-                    TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                    >= NOW() - :period :: INTERVAL
+                    %(finished_since)s
                     GROUP BY d)
                 SELECT to_char(d, 'YYYY-MM-DD') as d, count from myquery;
-               ''').execution_options(stream=True)
+               ''' % PERIOD_SQL).execution_options(stream=True)
 
     results = session.execute(sql, params)
     for row in results:
@@ -232,15 +234,14 @@ def stats_dates(project_id, period='15 day'):
     # Get all answers per date for anon
     sql = text('''
                 WITH myquery AS (
-                    SELECT TO_DATE(finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
+                    SELECT DATE(%(finished_at)s AT TIME ZONE 'UTC')
                     as d, COUNT(id)
                     FROM task_run WHERE project_id=:project_id
                     AND user_id IS NULL AND
-                    TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                    >= NOW() - :period :: INTERVAL
+                    %(finished_since)s
                     GROUP BY d)
                SELECT to_char(d, 'YYYY-MM-DD') as d, count  from myquery;
-               ''').execution_options(stream=True)
+               ''' % PERIOD_SQL).execution_options(stream=True)
 
     results = session.execute(sql, params)
     for row in results:
@@ -251,7 +252,7 @@ def stats_dates(project_id, period='15 day'):
     return dates, dates_anon, dates_auth
 
 
-@memoize(timeout=ONE_DAY)
+@memoize(timeout=ONE_DAY, grace=ONE_HOUR)
 def stats_hours(project_id, period='2 week'):
     """Return statistics of a project per hours."""
     hours = {}
@@ -271,17 +272,12 @@ def stats_hours(project_id, period='2 week'):
     # Get hour stats for all users
     sql = text('''
                WITH myquery AS
-                (SELECT to_char(
-                    DATE_TRUNC('hour',
-                        TO_TIMESTAMP(finish_time, 'YYYY-MM-DD"T"HH24:MI:SS.US')
-                    ),
-                    'HH24') AS h, COUNT(id)
+                (SELECT to_char(%(finished_at)s AT TIME ZONE 'UTC', 'HH24') AS h, COUNT(id)
                     FROM task_run WHERE project_id=:project_id AND
-                    TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                    >= NOW() - :period :: INTERVAL
+                    %(finished_since)s
                     GROUP BY h)
                SELECT h, count from myquery;
-               ''').execution_options(stream=True)
+               ''' % PERIOD_SQL).execution_options(stream=True)
 
     results = session.execute(sql, params)
 
@@ -291,17 +287,12 @@ def stats_hours(project_id, period='2 week'):
     # Get maximum stats for all users
     sql = text('''
                WITH myquery AS
-                (SELECT to_char(
-                    DATE_TRUNC('hour',
-                        TO_TIMESTAMP(finish_time, 'YYYY-MM-DD"T"HH24:MI:SS.US')
-                    ),
-                    'HH24') AS h, COUNT(id)
+                (SELECT to_char(%(finished_at)s AT TIME ZONE 'UTC', 'HH24') AS h, COUNT(id)
                     FROM task_run WHERE project_id=:project_id  AND
-                    TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                    >= NOW() - :period :: INTERVAL
+                    %(finished_since)s
                     GROUP BY h)
                SELECT max(count) from myquery;
-               ''').execution_options(stream=True)
+               ''' % PERIOD_SQL).execution_options(stream=True)
 
     results = session.execute(sql, params)
     for row in results:
@@ -310,18 +301,13 @@ def stats_hours(project_id, period='2 week'):
     # Get hour stats for Anonymous users
     sql = text('''
                WITH myquery AS
-                (SELECT to_char(
-                    DATE_TRUNC('hour',
-                        TO_TIMESTAMP(finish_time, 'YYYY-MM-DD"T"HH24:MI:SS.US')
-                    ),
-                    'HH24') AS h, COUNT(id)
+                (SELECT to_char(%(finished_at)s AT TIME ZONE 'UTC', 'HH24') AS h, COUNT(id)
                     FROM task_run WHERE project_id=:project_id
                     AND user_id IS NULL AND
-                    TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                    >= NOW() - :period :: INTERVAL
+                    %(finished_since)s
                     GROUP BY h)
                SELECT h, count from myquery;
-               ''').execution_options(stream=True)
+               ''' % PERIOD_SQL).execution_options(stream=True)
 
     results = session.execute(sql, params)
 
@@ -331,18 +317,13 @@ def stats_hours(project_id, period='2 week'):
     # Get maximum stats for Anonymous users
     sql = text('''
                WITH myquery AS
-                (SELECT to_char(
-                    DATE_TRUNC('hour',
-                        TO_TIMESTAMP(finish_time, 'YYYY-MM-DD"T"HH24:MI:SS.US')
-                    ),
-                    'HH24') AS h, COUNT(id)
+                (SELECT to_char(%(finished_at)s AT TIME ZONE 'UTC', 'HH24') AS h, COUNT(id)
                     FROM task_run WHERE project_id=:project_id
                     AND user_id IS NULL AND
-                    TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                    >= NOW() - :period :: INTERVAL
+                    %(finished_since)s
                     GROUP BY h)
                SELECT max(count) from myquery;
-               ''').execution_options(stream=True)
+               ''' % PERIOD_SQL).execution_options(stream=True)
 
     results = session.execute(sql, params)
     for row in results:
@@ -351,18 +332,13 @@ def stats_hours(project_id, period='2 week'):
     # Get hour stats for Auth users
     sql = text('''
                WITH myquery AS
-                (SELECT to_char(
-                    DATE_TRUNC('hour',
-                        TO_TIMESTAMP(finish_time, 'YYYY-MM-DD"T"HH24:MI:SS.US')
-                    ),
-                    'HH24') AS h, COUNT(id)
+                (SELECT to_char(%(finished_at)s AT TIME ZONE 'UTC', 'HH24') AS h, COUNT(id)
                     FROM task_run WHERE project_id=:project_id
                     AND user_ip IS NULL AND
-                    TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                    >= NOW() - :period :: INTERVAL
+                    %(finished_since)s
                     GROUP BY h)
                SELECT h, count from myquery;
-               ''').execution_options(stream=True)
+               ''' % PERIOD_SQL).execution_options(stream=True)
 
     results = session.execute(sql, params)
 
@@ -372,18 +348,13 @@ def stats_hours(project_id, period='2 week'):
     # Get hour stats for Anon users
     sql = text('''
                WITH myquery AS
-                (SELECT to_char(
-                    DATE_TRUNC('hour',
-                        TO_TIMESTAMP(finish_time, 'YYYY-MM-DD"T"HH24:MI:SS.US')
-                    ),
-                    'HH24') AS h, COUNT(id)
+                (SELECT to_char(%(finished_at)s AT TIME ZONE 'UTC', 'HH24') AS h, COUNT(id)
                     FROM task_run WHERE project_id=:project_id
                     AND user_ip IS NULL AND
-                    TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                    >= NOW() - :period :: INTERVAL
+                    %(finished_since)s
                     GROUP BY h)
                SELECT max(count) from myquery;
-               ''').execution_options(stream=True)
+               ''' % PERIOD_SQL).execution_options(stream=True)
 
     results = session.execute(sql, params)
     for row in results:
@@ -520,11 +491,24 @@ def stats_format_users(project_id, users, anon_users, auth_users):
 
 
 def update_stats(project_id, period='2 week'):
-    """Update the stats of a given project."""
-    hours, hours_anon, hours_auth, max_hours, \
-        max_hours_anon, max_hours_auth = stats_hours(project_id, period)
-    users, anon_users, auth_users = stats_users(project_id, period)
-    dates, dates_anon, dates_auth = stats_dates(project_id, period)
+    """Update the stats of a given project.
+
+    Periods of up to StatsRollup.DAYS days are assembled from the Redis
+    rollups of the project, after adding to them its latest task runs.
+    """
+    n_days = convert_period_to_days(period)
+    if 0 < n_days <= StatsRollup.DAYS:
+        rollup = StatsRollup(sentinel.master, session)
+        rollup.sync(project_id)
+        hours, hours_anon, hours_auth, max_hours, \
+            max_hours_anon, max_hours_auth = rollup.hours(project_id, n_days)
+        users, anon_users, auth_users = rollup.users(project_id, n_days)
+        dates, dates_anon, dates_auth = rollup.dates(project_id, n_days)
+    else:
+        hours, hours_anon, hours_auth, max_hours, \
+            max_hours_anon, max_hours_auth = stats_hours(project_id, period)
+        users, anon_users, auth_users = stats_users(project_id, period)
+        dates, dates_anon, dates_auth = stats_dates(project_id, period)
 
 
     sum(dates.values())
@@ -19,8 +19,10 @@
 from sqlalchemy.sql import text
 from pybossa.core import db, timeouts
 from pybossa.model.project import Project
+from pybossa.model.counter import counters_are_compacted
 from pybossa.util import pretty_date
-from pybossa.cache import memoize, cache, delete_memoized, delete_cached
+from pybossa.cache import memoize, memoize_many, cache, delete_memoized
+from pybossa.cache import delete_cached
 
 
 session = db.slave_session
@@ -38,14 +40,17 @@ def get_top(n=4):
                AND project.id=project_id
                AND (project.info->>'passwd_hash') IS NULL
                GROUP BY project.id ORDER BY total DESC LIMIT :limit;''')
-    results = session.execute(sql, dict(limit=n))
+    results = session.execute(sql, dict(limit=n)).fetchall()
+    project_ids = [row.id for row in results]
+    volunteers = n_volunteers_many(project_ids)
+    completed_tasks = n_completed_tasks_many(project_ids)
     top_projects = []
     for row in results:
         project = dict(id=row.id, name=row.name, short_name=row.short_name,
                        description=row.description,
                        info=row.info,
-                       n_volunteers=n_volunteers(row.id),
-                       n_completed_tasks=n_completed_tasks(row.id))
+                       n_volunteers=volunteers[row.id],
+                       n_completed_tasks=completed_tasks[row.id])
 
         top_projects.append(Project().to_public_json(project))
     return top_projects
@@ -53,13 +58,21 @@ def get_top(n=4):
 
 def browse_tasks(project_id, limit=10, offset=0):
     """Cache browse tasks view for a project."""
-    sql = text('''
-               SELECT task.id, task.n_answers, sum(counter.n_task_runs) as n_task_runs
-               FROM task, counter
-               WHERE task.id=counter.task_id and task.project_id=:project_id
-               GROUP BY task.id
-               ORDER BY task.id ASC LIMIT :limit OFFSET :offset
-               ''')
+    if counters_are_compacted(session):
+        sql = text('''
+                   SELECT task.id, task.n_answers, counter.n_task_runs
+                   FROM task, counter
+                   WHERE task.id=counter.task_id and task.project_id=:project_id
+                   ORDER BY task.id ASC LIMIT :limit OFFSET :offset
+                   ''')
+    else:
+        sql = text('''
+                   SELECT task.id, task.n_answers, sum(counter.n_task_runs) as n_task_runs
+                   FROM task, counter
+                   WHERE task.id=counter.task_id and task.project_id=:project_id
+                   GROUP BY task.id
+                   ORDER BY task.id ASC LIMIT :limit OFFSET :offset
+                   ''')
     results = session.execute(sql, dict(project_id=project_id,
                                         limit=limit,
                                         offset=offset))
@@ -94,6 +107,19 @@ def n_tasks(project_id):
     return n_tasks
 
 
+@memoize_many(n_tasks, timeout=timeouts.get('APP_TIMEOUT'))
+def n_tasks_many(project_ids):
+    """Return number of tasks of each project."""
+    sql = text('''SELECT project_id, COUNT(id) AS n_tasks FROM task
+                  WHERE project_id=ANY(:project_ids)
+                  GROUP BY project_id;''')
+    results = session.execute(sql, dict(project_ids=project_ids))
+    n_tasks = dict.fromkeys(project_ids, 0)
+    for row in results:
+        n_tasks[row.project_id] = row.n_tasks
+    return n_tasks
+
+
 @memoize(timeout=timeouts.get('APP_TIMEOUT'))
 def n_completed_tasks(project_id):
     """Return number of completed tasks of a project."""
@@ -108,6 +134,20 @@ def n_completed_tasks(project_id):
     return n_completed_tasks
 
 
+@memoize_many(n_completed_tasks, timeout=timeouts.get('APP_TIMEOUT'))
+def n_completed_tasks_many(project_ids):
+    """Return number of completed tasks of each project."""
+    sql = text('''SELECT project_id, COUNT(id) AS n_completed_tasks FROM task
+                  WHERE project_id=ANY(:project_ids)
+                  AND state=\'completed\'
+                  GROUP BY project_id;''')
+    results = session.execute(sql, dict(project_ids=project_ids))
+    n_completed_tasks = dict.fromkeys(project_ids, 0)
+    for row in results:
+        n_completed_tasks[row.project_id] = row.n_completed_tasks
+    return n_completed_tasks
+
+
 @memoize(timeout=timeouts.get('APP_TIMEOUT'))
 def n_results(project_id):
     """Return number of results of a project."""
@@ -141,6 +181,24 @@ def n_registered_volunteers(project_id):
     return n_registered_volunteers
 
 
+@memoize_many(n_registered_volunteers,
+              timeout=timeouts.get('REGISTERED_USERS_TIMEOUT'))
+def n_registered_volunteers_many(project_ids):
+    """Return number of registered users that have participated in each
+    project."""
+    sql = text('''SELECT project_id,
+               COUNT(DISTINCT(user_id)) AS n_registered_volunteers
+               FROM task_run
+               WHERE user_id IS NOT NULL AND user_ip IS NULL
+               AND project_id=ANY(:project_ids)
+               GROUP BY project_id;''')
+    results = session.execute(sql, dict(project_ids=project_ids))
+    n_registered_volunteers = dict.fromkeys(project_ids, 0)
+    for row in results:
+        n_registered_volunteers[row.project_id] = row.n_registered_volunteers
+    return n_registered_volunteers
+
+
 @memoize(timeout=timeouts.get('ANON_USERS_TIMEOUT'))
 def n_anonymous_volunteers(project_id):
     """Return number of anonymous users that have participated in a project."""
@@ -157,6 +215,24 @@ def n_anonymous_volunteers(project_id):
     return n_anonymous_volunteers
 
 
+@memoize_many(n_anonymous_volunteers,
+              timeout=timeouts.get('ANON_USERS_TIMEOUT'))
+def n_anonymous_volunteers_many(project_ids):
+    """Return number of anonymous users that have participated in each
+    project."""
+    sql = text('''SELECT project_id,
+               COUNT(DISTINCT(user_ip)) AS n_anonymous_volunteers
+               FROM task_run
+               WHERE user_ip IS NOT NULL AND user_id IS NULL
+               AND project_id=ANY(:project_ids)
+               GROUP BY project_id;''')
+    results = session.execute(sql, dict(project_ids=project_ids))
+    n_anonymous_volunteers = dict.fromkeys(project_ids, 0)
+    for row in results:
+        n_anonymous_volunteers[row.project_id] = row.n_anonymous_volunteers
+    return n_anonymous_volunteers
+
+
 def n_volunteers(project_id):
     """Return total number of volunteers of a project."""
     total = (n_anonymous_volunteers(project_id) +
@@ -164,6 +240,14 @@ def n_volunteers(project_id):
     return total
 
 
+def n_volunteers_many(project_ids):
+    """Return total number of volunteers of each project."""
+    anonymous = n_anonymous_volunteers_many(project_ids)
+    registered = n_registered_volunteers_many(project_ids)
+    return dict((project_id, anonymous[project_id] + registered[project_id])
+                for project_id in anonymous)
+
+
 @memoize(timeout=timeouts.get('APP_TIMEOUT'))
 def n_task_runs(project_id):
     """Return number of task_runs of a project."""
@@ -186,6 +270,21 @@ def overall_progress(project_id):
         return 0
 
 
+@memoize_many(overall_progress, timeout=timeouts.get('APP_TIMEOUT'))
+def overall_progress_many(project_ids):
+    """Return the percentage of completed tasks for each project."""
+    n_tasks = n_tasks_many(project_ids)
+    n_completed_tasks = n_completed_tasks_many(project_ids)
+    progress = dict()
+    for project_id in project_ids:
+        if n_tasks[project_id] != 0:
+            progress[project_id] = ((n_completed_tasks[project_id] * 100) /
+                                    n_tasks[project_id])
+        else:
+            progress[project_id] = 0
+    return progress
+
+
 @memoize(timeout=timeouts.get('APP_TIMEOUT'))
 def last_activity(project_id):
     """Return last activity, date, from a project."""
@@ -200,6 +299,19 @@ def last_activity(project_id):
             return None
 
 
+@memoize_many(last_activity, timeout=timeouts.get('APP_TIMEOUT'))
+def last_activity_many(project_ids):
+    """Return last activity, date, from each project."""
+    sql = text('''SELECT project_id, MAX(finish_time) AS finish_time
+               FROM task_run WHERE project_id=ANY(:project_ids)
+               GROUP BY project_id;''')
+    results = session.execute(sql, dict(project_ids=project_ids))
+    last_activity = dict.fromkeys(project_ids)
+    for row in results:
+        last_activity[row.project_id] = row.finish_time
+    return last_activity
+
+
 @memoize(timeout=timeouts.get('APP_TIMEOUT'))
 def average_contribution_time(project_id):
     sql = text('''SELECT
@@ -257,18 +369,23 @@ def get_all_featured(category=None):
            AND "user".restrict=false
            GROUP BY project.id, "user".id;''')
 
-    results = session.execute(sql)
+    results = session.execute(sql).fetchall()
+    project_ids = [row.id for row in results]
+    activity = last_activity_many(project_ids)
+    progress = overall_progress_many(project_ids)
+    tasks = n_tasks_many(project_ids)
+    volunteers = n_volunteers_many(project_ids)
     projects = []
     for row in results:
         project = dict(id=row.id, name=row.name, short_name=row.short_name,
                        created=row.created, description=row.description,
                        updated=row.updated,
-                       last_activity=pretty_date(last_activity(row.id)),
-                       last_activity_raw=last_activity(row.id),
+                       last_activity=pretty_date(activity[row.id]),
+                       last_activity_raw=activity[row.id],
                        owner=row.owner,
-                       overall_progress=overall_progress(row.id),
-                       n_tasks=n_tasks(row.id),
-                       n_volunteers=n_volunteers(row.id),
+                       overall_progress=progress[row.id],
+                       n_tasks=tasks[row.id],
+                       n_volunteers=volunteers[row.id],
                        info=row.info)
         projects.append(Project().to_public_json(project))
     return projects
@@ -317,7 +434,12 @@ def get_all_draft(category=None):
            AND "user".restrict=false
            AND project.published=false;''')
 
-    results = session.execute(sql)
+    results = session.execute(sql).fetchall()
+    project_ids = [row.id for row in results]
+    activity = last_activity_many(project_ids)
+    progress = overall_progress_many(project_ids)
+    tasks = n_tasks_many(project_ids)
+    volunteers = n_volunteers_many(project_ids)
     projects = []
     for row in results:
         project = dict(id=row.id, name=row.name, short_name=row.short_name,
@@ -325,11 +447,11 @@ def get_all_draft(category=None):
                        updated=row.updated,
                        description=row.description,
                        owner=row.owner,
-                       last_activity=pretty_date(last_activity(row.id)),
-                       last_activity_raw=last_activity(row.id),
-                       overall_progress=overall_progress(row.id),
-                       n_tasks=n_tasks(row.id),
-                       n_volunteers=n_volunteers(row.id),
+                       last_activity=pretty_date(activity[row.id]),
+                       last_activity_raw=activity[row.id],
+                       overall_progress=progress[row.id],
+                       n_tasks=tasks[row.id],
+                       n_volunteers=volunteers[row.id],
                        info=row.info)
         projects.append(Project().to_public_json(project))
     return projects
@@ -385,7 +507,12 @@ def get_all(category):
            AND (project.info->>'passwd_hash') IS NULL
            GROUP BY project.id, "user".id ORDER BY project.name;''')
 
-    results = session.execute(sql, dict(category=category))
+    results = session.execute(sql, dict(category=category)).fetchall()
+    project_ids = [row.id for row in results]
+    activity = last_activity_many(project_ids)
+    progress = overall_progress_many(project_ids)
+    tasks = n_tasks_many(project_ids)
+    volunteers = n_volunteers_many(project_ids)
     projects = []
     for row in results:
         project = dict(id=row.id,
@@ -395,11 +522,11 @@ def get_all(category):
                        description=row.description,
                        owner=row.owner,
                        featured=row.featured,
-                       last_activity=pretty_date(last_activity(row.id)),
-                       last_activity_raw=last_activity(row.id),
-                       overall_progress=overall_progress(row.id),
-                       n_tasks=n_tasks(row.id),
-                       n_volunteers=n_volunteers(row.id),
+                       last_activity=pretty_date(activity[row.id]),
+                       last_activity_raw=activity[row.id],
+                       overall_progress=progress[row.id],
+                       n_tasks=tasks[row.id],
+                       n_volunteers=volunteers[row.id],
                        info=row.info)
         projects.append(Project().to_public_json(project))
     return projects
@@ -21,9 +21,15 @@ from flask import current_app
 
 from pybossa.core import db
 from pybossa.cache import cache, ONE_DAY
+from pybossa.model import timestamptz_compare_sql
 
 session = db.slave_session
 
+# Task runs finished in the last 24 hours
+LAST_DAY_SQL = timestamptz_compare_sql('task_run', 'finish_time',
+                                       'finished_at', '>',
+                                       "NOW() - INTERVAL '24 hour'")
+
 
 @cache(timeout=ONE_DAY, key_prefix="site_n_auth_users")
 def n_auth_users():
@@ -99,10 +105,9 @@ def get_top5_projects_24_hours():
     sql = text('''SELECT project.id, project.name, project.short_name, project.info,
                COUNT(task_run.project_id) AS n_answers FROM project, task_run
                WHERE project.id=task_run.project_id
-               AND DATE(task_run.finish_time) > NOW() - INTERVAL '24 hour'
-               AND DATE(task_run.finish_time) <= NOW()
+               AND %s
                GROUP BY project.id
-               ORDER BY n_answers DESC LIMIT 5;''')
+               ORDER BY n_answers DESC LIMIT 5;''' % LAST_DAY_SQL)
 
     results = session.execute(sql, dict(limit=5))
     top5_apps_24_hours = []
@@ -121,10 +126,9 @@ def get_top5_users_24_hours():
                "user".restrict,
                COUNT(task_run.project_id) AS n_answers FROM "user", task_run
                WHERE "user".restrict=false AND "user".id=task_run.user_id
-               AND DATE(task_run.finish_time) > NOW() - INTERVAL '24 hour'
-               AND DATE(task_run.finish_time) <= NOW()
+               AND %s
                GROUP BY "user".id
-               ORDER BY n_answers DESC LIMIT 5;''')
+               ORDER BY n_answers DESC LIMIT 5;''' % LAST_DAY_SQL)
 
     results = session.execute(sql, dict(limit=5))
     top5_users_24_hours = []
@@ -24,7 +24,8 @@ from pybossa.util import pretty_date, exists_materialized_view
 from pybossa.model.user import User
 from pybossa.cache.projects import overall_progress, n_tasks, n_volunteers
 from pybossa.model.project import Project
-from pybossa.leaderboard.data import get_leaderboard as gl
+from pybossa.leaderboard.data import get_leaderboard as gl, get_rank
+from pybossa.leaderboard.data import get_scoped_leaderboard as gsl
 from pybossa.leaderboard.jobs import leaderboard as lb
 
 
@@ -41,6 +42,12 @@ def get_leaderboard(n, user_id=None, window=0, info=None):
         return gl(top_users=n, user_id=user_id, window=window, info=info)
 
 
+@memoize(timeout=timeouts.get('LEADERBOARD_TIMEOUT'))
+def get_scoped_leaderboard(scope, scope_id, window, n):
+    """Return the top n users of a project or category in a time window."""
+    return gsl(scope, scope_id, window=window, top_users=n)
+
+
 @memoize(timeout=timeouts.get('USER_TIMEOUT'))
 def get_user_summary(name, current_user=None):
     """Return user summary."""
@@ -106,13 +113,7 @@ def rank_and_score(user_id):
     """Return rank and score for a user."""
     if exists_materialized_view(db, 'users_rank') is False:
         lb()
-    sql = text('''SELECT * from users_rank WHERE id=:user_id''')
-    results = session.execute(sql, dict(user_id=user_id))
-    rank_and_score = dict(rank=None, score=None)
-    for row in results:
-        rank_and_score['rank'] = row.rank
-        rank_and_score['score'] = row.score
-    return rank_and_score
+    return get_rank(user_id)
 
 
 def projects_contributed(user_id, order_by='name'):
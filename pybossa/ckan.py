@@ -31,7 +31,8 @@ class Ckan(object):
                       'n_answers', 'timeout', 'calibration', 'quorum']
         text_fields = ['state', 'user_ip']
         float_fields = ['priority_0']
-        timestamp_fields = ['created', 'finish_time']
+        timestamp_fields = ['created', 'finish_time', 'created_at',
+                            'finished_at']
         json_fields = ['info']
         # Backrefs and functions
         sqlalchemy_refs = ['project', 'task_runs', 'pct_status']
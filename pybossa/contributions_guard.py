@@ -16,16 +16,43 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
 
+from time import time
 from pybossa.model import make_timestamp
 
 
 class ContributionsGuard(object):
 
     KEY_PREFIX = 'pybossa:task_requested:user:%s:task:%s'
+    LEASE_KEY_PREFIX = 'pybossa:task_leases:task:%s'
     STAMP_TTL = 60 * 60
+    LEASE_TTL = 10 * 60
+    # KEYS: lease sorted sets. ARGV: user, now, ttl, limit and then the
+    # number of leases available for every key.
+    RESERVE_SCRIPT = """
+    local member, now = ARGV[1], tonumber(ARGV[2])
+    local ttl, limit = tonumber(ARGV[3]), tonumber(ARGV[4])
+    local granted, n_granted = {}, 0
+    for i, key in ipairs(KEYS) do
+        granted[i] = 0
+        if n_granted < limit then
+            redis.call('ZREMRANGEBYSCORE', key, '-inf', now)
+            local held = redis.call('ZSCORE', key, member)
+            local n_leases = redis.call('ZCARD', key)
+            if held or n_leases < tonumber(ARGV[4 + i]) then
+                redis.call('ZADD', key, now + ttl, member)
+                redis.call('EXPIRE', key, ttl)
+                granted[i] = 1
+                n_granted = n_granted + 1
+            end
+        end
+    end
+    return granted
+    """
 
-    def __init__(self, redis_conn):
+    def __init__(self, redis_conn, lease_ttl=None):
         self.conn = redis_conn
+        if lease_ttl is not None:
+            self.LEASE_TTL = lease_ttl
 
     def stamp(self, task, user):
         key = self._create_key(task, user)
@@ -40,11 +67,55 @@ class ContributionsGuard(object):
         key = self._create_key(task, user)
         return self.conn.get(key)
 
-    def _create_key(self, task, user):
+    def reserve_many(self, tasks, user, n_available, limit=None):
+        """Lease up to limit of tasks to user in a single round-trip.
+
+        n_available holds, for each task, the number of leases that can be
+        open at once. Expired leases are dropped first and a user that
+        already holds a lease for a task gets it renewed. Returns a list with
+        a boolean per task telling whether its lease was granted.
+        """
+        if not tasks:
+            return []
+        if limit is None:
+            limit = len(tasks)
+        keys = [self.LEASE_KEY_PREFIX % task.id for task in tasks]
+        args = [self._user_id(user), time(), self.LEASE_TTL, limit]
+        script = self.conn.register_script(self.RESERVE_SCRIPT)
+        granted = script(keys=keys, args=args + list(n_available))
+        return [bool(value) for value in granted]
+
+    def stamp_many(self, tasks, user):
+        """Stamp tasks for user and return when each of them expires.
+
+        Stamps and lease lookups are sent in one pipeline. A task expires
+        with its lease or, if it was not leased, with its stamp. Expirations
+        are UNIX timestamps.
+        """
+        now = time()
+        timestamp = make_timestamp()
+        member = self._user_id(user)
+        pipeline = self.conn.pipeline()
+        for task in tasks:
+            pipeline.setex(self._create_key(task, user), self.STAMP_TTL,
+                           timestamp)
+            pipeline.zscore(self.LEASE_KEY_PREFIX % task.id, member)
+        scores = pipeline.execute()[1::2]
+        return [score or now + self.STAMP_TTL for score in scores]
+
+    def release(self, task_id, user):
+        """Release the lease that user holds for a task."""
+        key = self.LEASE_KEY_PREFIX % task_id
+        return self.conn.zrem(key, self._user_id(user))
+
+    def _user_id(self, user):
         user_id = user['user_id'] or user['user_ip']
         if user.get('external_uid'):
             user_id = user['external_uid']
-        return self.KEY_PREFIX % (user_id, task.id)
+        return user_id
+
+    def _create_key(self, task, user):
+        return self.KEY_PREFIX % (self._user_id(user), task.id)
 
     def _remove_task_stamped(self, task, user):
         key = self._create_key(task, user)
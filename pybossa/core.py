@@ -151,10 +151,13 @@ def setup_exporter(app):
     """Setup exporter."""
     global csv_exporter
     global json_exporter
+    global parquet_exporter
     from pybossa.exporter.csv_export import CsvExporter
     from pybossa.exporter.json_export import JsonExporter
+    from pybossa.exporter.parquet_export import ParquetExporter
     csv_exporter = CsvExporter()
     json_exporter = JsonExporter()
+    parquet_exporter = ParquetExporter()
 
 
 def setup_markdown(app):
@@ -650,6 +653,7 @@ def setup_cache_timeouts(app):
     timeouts['USER_TIMEOUT'] = app.config['USER_TIMEOUT']
     timeouts['USER_TOP_TIMEOUT'] = app.config['USER_TOP_TIMEOUT']
     timeouts['USER_TOTAL_TIMEOUT'] = app.config['USER_TOTAL_TIMEOUT']
+    timeouts['LEADERBOARD_TIMEOUT'] = app.config['LEADERBOARD_TIMEOUT']
 
 
 def setup_scheduled_jobs(app):  # pragma: no cover
@@ -18,6 +18,55 @@
 """Dashboard Jobs module for running background tasks in PYBOSSA server."""
 from sqlalchemy import text
 from pybossa.core import db
+from pybossa.model import timestamptz_sql, timestamptz_compare_sql
+
+
+# First day, in UTC, of the week shown in the dashboard
+WEEK_START = "(NOW() AT TIME ZONE 'UTC')::DATE - 6"
+
+FINISHED_AT = timestamptz_sql('task_run', 'finish_time', 'finished_at')
+FINISHED_SINCE = timestamptz_compare_sql('task_run', 'finish_time',
+                                         'finished_at', '>=', '%(start)s')
+CREATED_AT = timestamptz_sql('task', 'created', 'created_at')
+CREATED_SINCE = timestamptz_compare_sql('task', 'created', 'created_at', '>=',
+                                        '%(start)s')
+
+# Daily rollup tables of the task and task run stats. Every job upserts the
+# rows of its table from the last day in it, which may have been rolled up
+# before it was over, so it reads about a day of data instead of a week.
+ROLLUPS = dict(
+    dashboard_day_users=dict(
+        columns='''day DATE, user_id INTEGER, n_task_runs INTEGER,
+                   PRIMARY KEY (day, user_id)''',
+        key='day, user_id',
+        value='n_task_runs',
+        select='''SELECT DATE(%s AT TIME ZONE 'UTC') AS day,
+                  user_id, COUNT(id) FROM task_run
+                  WHERE %s AND user_id IS NOT NULL
+                  GROUP BY day, user_id''' % (FINISHED_AT, FINISHED_SINCE)),
+    dashboard_day_anon=dict(
+        columns='''day DATE, user_ip TEXT, n_task_runs INTEGER,
+                   PRIMARY KEY (day, user_ip)''',
+        key='day, user_ip',
+        value='n_task_runs',
+        select='''SELECT DATE(%s AT TIME ZONE 'UTC') AS day,
+                  user_ip, COUNT(id) FROM task_run
+                  WHERE %s AND user_ip IS NOT NULL
+                  GROUP BY day, user_ip''' % (FINISHED_AT, FINISHED_SINCE)),
+    dashboard_day_tasks=dict(
+        columns='day DATE PRIMARY KEY, n_tasks INTEGER',
+        key='day',
+        value='n_tasks',
+        select='''SELECT DATE(%s AT TIME ZONE 'UTC') AS day,
+                  COUNT(id) FROM task WHERE %s
+                  GROUP BY day''' % (CREATED_AT, CREATED_SINCE)),
+    dashboard_day_task_runs=dict(
+        columns='day DATE PRIMARY KEY, n_task_runs INTEGER',
+        key='day',
+        value='n_task_runs',
+        select='''SELECT DATE(%s AT TIME ZONE 'UTC') AS day,
+                  COUNT(id) FROM task_run WHERE %s
+                  GROUP BY day''' % (FINISHED_AT, FINISHED_SINCE)))
 
 
 def _exists_materialized_view(view):
@@ -29,55 +78,78 @@ def _exists_materialized_view(view):
     return False
 
 
+def _has_unique_index(view):
+    sql = text('''SELECT EXISTS (SELECT 1 FROM pg_index
+               JOIN pg_class ON pg_class.oid = pg_index.indrelid
+               WHERE pg_class.relname = :view AND pg_index.indisunique);''')
+    results = db.slave_session.execute(sql, dict(view=view))
+    for result in results:
+        return result.exists
+    return False
+
+
 def _refresh_materialized_view(view):
-    sql = text('REFRESH MATERIALIZED VIEW %s' % view)
+    # Views created before they had a unique index can only be refreshed
+    # blocking their readers
+    if _has_unique_index(view):
+        sql = text('REFRESH MATERIALIZED VIEW CONCURRENTLY %s' % view)
+    else:
+        sql = text('REFRESH MATERIALIZED VIEW %s' % view)
     db.session.execute(sql)
     db.session.commit()
     return "Materialized view refreshed"
 
 
+def _create_materialized_view(view, sql, key):
+    db.session.execute(text('CREATE MATERIALIZED VIEW %s AS %s' %
+                            (view, sql)))
+    db.session.execute(text('CREATE UNIQUE INDEX %s_key_idx ON %s (%s);' %
+                            (view, view, key)))
+    db.session.commit()
+    return "Materialized view created"
+
+
+def _rollup(table):
+    """Upsert the rows of a rollup table from its last day on."""
+    rollup = ROLLUPS[table]
+    start = '''(SELECT GREATEST(MAX(day), %s) FROM %s)::TIMESTAMP
+               AT TIME ZONE 'UTC' ''' % (WEEK_START, table)
+    sql = '''INSERT INTO %s %s
+             ON CONFLICT (%s) DO UPDATE SET %s = EXCLUDED.%s;''' % (
+        table, rollup['select'] % dict(start=start), rollup['key'], rollup['value'],
+        rollup['value'])
+    db.session.execute(text('CREATE TABLE IF NOT EXISTS %s (%s);' %
+                            (table, rollup['columns'])))
+    db.session.execute(text('DELETE FROM %s WHERE day < %s;' %
+                            (table, WEEK_START)))
+    db.session.execute(text(sql))
+    db.session.commit()
+
+
+def _rollup_view(view, table, sql):
+    """Update a rollup table and create its view of the last week."""
+    _rollup(table)
+    if _exists_materialized_view(view):
+        return "Rollup updated"
+    db.session.execute(text('CREATE VIEW %s AS %s' % (view, sql)))
+    db.session.commit()
+    return "Rollup view created"
+
+
 def active_users_week():
-    """Create or update active users last week materialized view."""
-    if _exists_materialized_view('dashboard_week_users'):
-        return _refresh_materialized_view('dashboard_week_users')
-    else:
-        sql = text('''CREATE MATERIALIZED VIEW dashboard_week_users AS
-                   WITH crafters_per_day AS
-                        (select to_date(task_run.finish_time,
-                                        'YYYY-MM-DD\THH24:MI:SS.US') AS day,
-                                user_id, COUNT(task_run.user_id) AS day_crafters
-                        FROM task_run
-                        WHERE to_date(task_run.finish_time,
-                                      'YYYY-MM-DD\THH24:MI:SS.US')
-                            >= NOW() - ('1 week'):: INTERVAL
-                        GROUP BY day, task_run.user_id)
-                   SELECT day, COUNT(crafters_per_day.user_id) AS n_users
-                   FROM crafters_per_day GROUP BY day ORDER BY day;''')
-        db.session.execute(sql)
-        db.session.commit()
-        return "Materialized view created"
+    """Update active users last week rollup."""
+    sql = '''SELECT day, COUNT(user_id) AS n_users
+             FROM dashboard_day_users WHERE day >= %s
+             GROUP BY day ORDER BY day;''' % WEEK_START
+    return _rollup_view('dashboard_week_users', 'dashboard_day_users', sql)
 
 
 def active_anon_week():
-    """Create or update active anon last week materialized view."""
-    if _exists_materialized_view('dashboard_week_anon'):
-        return _refresh_materialized_view('dashboard_week_anon')
-    else:
-        sql = text('''CREATE MATERIALIZED VIEW dashboard_week_anon AS
-                   WITH crafters_per_day AS
-                        (select to_date(task_run.finish_time,
-                                        'YYYY-MM-DD\THH24:MI:SS.US') AS day,
-                                user_ip, COUNT(task_run.user_ip) AS day_crafters
-                        FROM task_run
-                        WHERE to_date(task_run.finish_time,
-                                      'YYYY-MM-DD\THH24:MI:SS.US')
-                            >= NOW() - ('1 week'):: INTERVAL
-                        GROUP BY day, task_run.user_ip)
-                   SELECT day, COUNT(crafters_per_day.user_ip) AS n_users
-                   FROM crafters_per_day GROUP BY day ORDER BY day;''')
-        db.session.execute(sql)
-        db.session.commit()
-        return "Materialized view created"
+    """Update active anon last week rollup."""
+    sql = '''SELECT day, COUNT(user_ip) AS n_users
+             FROM dashboard_day_anon WHERE day >= %s
+             GROUP BY day ORDER BY day;''' % WEEK_START
+    return _rollup_view('dashboard_week_anon', 'dashboard_day_anon', sql)
 
 
 def draft_projects_week():
@@ -85,21 +157,19 @@ def draft_projects_week():
     if _exists_materialized_view('dashboard_week_project_draft'):
         return _refresh_materialized_view('dashboard_week_project_draft')
     else:
-        sql = text('''CREATE MATERIALIZED VIEW dashboard_week_project_draft AS
-                   SELECT TO_DATE(project.created, 'YYYY-MM-DD\THH24:MI:SS.US') AS day,
-                   project.id, short_name, project.name,
-                   owner_id, "user".name AS u_name, "user".email_addr
-                   FROM project, "user"
-                   WHERE TO_DATE(project.created,
-                                'YYYY-MM-DD\THH24:MI:SS.US') >= now() -
-                                ('1 week')::INTERVAL
-                   AND "user".id = project.owner_id
-                   AND "user".restrict = false
-                   AND project.published = false
-                   GROUP BY project.id, "user".name, "user".email_addr;''')
-        db.session.execute(sql)
-        db.session.commit()
-        return "Materialized view created"
+        sql = '''SELECT TO_DATE(project.created, 'YYYY-MM-DD\THH24:MI:SS.US') AS day,
+                 project.id, short_name, project.name,
+                 owner_id, "user".name AS u_name, "user".email_addr
+                 FROM project, "user"
+                 WHERE TO_DATE(project.created,
+                              'YYYY-MM-DD\THH24:MI:SS.US') >= now() -
+                              ('1 week')::INTERVAL
+                 AND "user".id = project.owner_id
+                 AND "user".restrict = false
+                 AND project.published = false
+                 GROUP BY project.id, "user".name, "user".email_addr;'''
+        return _create_materialized_view('dashboard_week_project_draft',
+                                         sql, 'id')
 
 
 def published_projects_week():
@@ -107,23 +177,22 @@ def published_projects_week():
     if _exists_materialized_view('dashboard_week_project_published'):
         return _refresh_materialized_view('dashboard_week_project_published')
     else:
-        sql = text('''CREATE MATERIALIZED VIEW dashboard_week_project_published AS
-                   SELECT TO_DATE(auditlog.created, 'YYYY-MM-DD\THH24:MI:SS.US') AS day,
-                   project.id, project.short_name, project.name,
-                   owner_id, "user".name AS u_name, "user".email_addr
-                   FROM auditlog, project, "user"
-                   WHERE TO_DATE(auditlog.created,
-                                'YYYY-MM-DD\THH24:MI:SS.US') >= now() -
-                                ('1 week')::INTERVAL
-                   AND "user".id = project.owner_id
-                   AND "user".restrict = false
-                   AND project.owner_id = auditlog.user_id
-                   AND auditlog.project_id = project.id
-                   AND auditlog.attribute = 'published'
-                   GROUP BY auditlog.id, "user".name, "user".email_addr, project.id;''')
-        db.session.execute(sql)
-        db.session.commit()
-        return "Materialized view created"
+        sql = '''SELECT TO_DATE(auditlog.created, 'YYYY-MM-DD\THH24:MI:SS.US') AS day,
+                 project.id, project.short_name, project.name,
+                 owner_id, "user".name AS u_name, "user".email_addr,
+                 auditlog.id AS auditlog_id
+                 FROM auditlog, project, "user"
+                 WHERE TO_DATE(auditlog.created,
+                              'YYYY-MM-DD\THH24:MI:SS.US') >= now() -
+                              ('1 week')::INTERVAL
+                 AND "user".id = project.owner_id
+                 AND "user".restrict = false
+                 AND project.owner_id = auditlog.user_id
+                 AND auditlog.project_id = project.id
+                 AND auditlog.attribute = 'published'
+                 GROUP BY auditlog.id, "user".name, "user".email_addr, project.id;'''
+        return _create_materialized_view('dashboard_week_project_published',
+                                         sql, 'auditlog_id')
 
 
 def update_projects_week():
@@ -131,56 +200,35 @@ def update_projects_week():
     if _exists_materialized_view('dashboard_week_project_update'):
         return _refresh_materialized_view('dashboard_week_project_update')
     else:
-        sql = text('''CREATE MATERIALIZED VIEW dashboard_week_project_update AS
-                   SELECT TO_DATE(project.updated, 'YYYY-MM-DD\THH24:MI:SS.US') AS day,
-                   project.id, short_name, project.name,
-                   owner_id, "user".name AS u_name, "user".email_addr
-                   FROM project, "user"
-                   WHERE TO_DATE(project.updated,
-                                'YYYY-MM-DD\THH24:MI:SS.US') >= now() -
-                                ('1 week')::INTERVAL
-                   AND "user".id = project.owner_id
-                   AND "user".restrict = false
-                   GROUP BY project.id, "user".name, "user".email_addr;''')
-        db.session.execute(sql)
-        db.session.commit()
-        return "Materialized view created"
+        sql = '''SELECT TO_DATE(project.updated, 'YYYY-MM-DD\THH24:MI:SS.US') AS day,
+                 project.id, short_name, project.name,
+                 owner_id, "user".name AS u_name, "user".email_addr
+                 FROM project, "user"
+                 WHERE TO_DATE(project.updated,
+                              'YYYY-MM-DD\THH24:MI:SS.US') >= now() -
+                              ('1 week')::INTERVAL
+                 AND "user".id = project.owner_id
+                 AND "user".restrict = false
+                 GROUP BY project.id, "user".name, "user".email_addr;'''
+        return _create_materialized_view('dashboard_week_project_update',
+                                         sql, 'id')
 
 
 def new_tasks_week():
-    """Create or update new tasks last week materialized view."""
-    if _exists_materialized_view('dashboard_week_new_task'):
-        return _refresh_materialized_view('dashboard_week_new_task')
-    else:
-        sql = text('''CREATE MATERIALIZED VIEW dashboard_week_new_task AS
-                      SELECT TO_DATE(task.created,
-                                     'YYYY-MM-DD\THH24:MI:SS.US') AS day,
-                      COUNT(task.id) AS day_tasks
-                      FROM task WHERE TO_DATE(task.created,
-                                              'YYYY-MM-DD\THH24:MI:SS.US')
-                                          >= now() - ('1 week'):: INTERVAL
-                      GROUP BY day ORDER BY day ASC;''')
-        db.session.execute(sql)
-        db.session.commit()
-        return "Materialized view created"
+    """Update new tasks last week rollup."""
+    sql = '''SELECT day, n_tasks AS day_tasks
+             FROM dashboard_day_tasks WHERE day >= %s
+             ORDER BY day ASC;''' % WEEK_START
+    return _rollup_view('dashboard_week_new_task', 'dashboard_day_tasks', sql)
 
 
 def new_task_runs_week():
-    """Create or update new task_runs last week materialized view."""
-    if _exists_materialized_view('dashboard_week_new_task_run'):
-        return _refresh_materialized_view('dashboard_week_new_task_run')
-    else:
-        sql = text('''CREATE MATERIALIZED VIEW dashboard_week_new_task_run AS
-                      SELECT TO_DATE(task_run.finish_time,
-                                     'YYYY-MM-DD\THH24:MI:SS.US') AS day,
-                      COUNT(task_run.id) AS day_task_runs
-                      FROM task_run WHERE TO_DATE(task_run.finish_time,
-                                              'YYYY-MM-DD\THH24:MI:SS.US')
-                                          >= now() - ('1 week'):: INTERVAL
-                      GROUP BY day;''')
-        db.session.execute(sql)
-        db.session.commit()
-        return "Materialized view created"
+    """Update new task_runs last week rollup."""
+    sql = '''SELECT day, n_task_runs AS day_task_runs
+             FROM dashboard_day_task_runs WHERE day >= %s
+             ORDER BY day ASC;''' % WEEK_START
+    return _rollup_view('dashboard_week_new_task_run',
+                        'dashboard_day_task_runs', sql)
 
 
 def new_users_week():
@@ -188,37 +236,23 @@ def new_users_week():
     if _exists_materialized_view('dashboard_week_new_users'):
         return _refresh_materialized_view('dashboard_week_new_users')
     else:
-        sql = text('''CREATE MATERIALIZED VIEW dashboard_week_new_users AS
-                      SELECT TO_DATE("user".created,
-                                     'YYYY-MM-DD\THH24:MI:SS.US') AS day,
-                      COUNT("user".id) AS day_users
-                      FROM "user" WHERE TO_DATE("user".created,
-                                              'YYYY-MM-DD\THH24:MI:SS.US')
-                                          >= now() - ('1 week'):: INTERVAL
-                      AND "user".restrict=false
-                      GROUP BY day;''')
-        db.session.execute(sql)
-        db.session.commit()
-        return "Materialized view created"
+        sql = '''SELECT TO_DATE("user".created,
+                                'YYYY-MM-DD\THH24:MI:SS.US') AS day,
+                 COUNT("user".id) AS day_users
+                 FROM "user" WHERE TO_DATE("user".created,
+                                         'YYYY-MM-DD\THH24:MI:SS.US')
+                                     >= now() - ('1 week'):: INTERVAL
+                 AND "user".restrict=false
+                 GROUP BY day;'''
+        return _create_materialized_view('dashboard_week_new_users', sql,
+                                         'day')
 
 
 def returning_users_week():
-    """Create or update returning users last week materialized view."""
-    if _exists_materialized_view('dashboard_week_returning_users'):
-        return _refresh_materialized_view('dashboard_week_returning_users')
-    else:
-        sql = text('''CREATE MATERIALIZED VIEW dashboard_week_returning_users AS
-                   WITH data AS (
-                    SELECT user_id, TO_DATE(task_run.finish_time,
-                    'YYYY-MM-DD\THH24:MI:SS.US') AS day
-                   FROM task_run
-                   WHERE TO_DATE(task_run.finish_time,
-                   'YYYY-MM-DD\THH24:MI:SS.US') >= NOW()
-                   - ('1 week')::INTERVAL GROUP BY day, task_run.user_id)
-                   SELECT user_id, COUNT(user_id) AS n_days
-                   FROM data GROUP BY user_id HAVING(count(user_id) > 1)
-                   ORDER by n_days;
-                      ''')
-        db.session.execute(sql)
-        db.session.commit()
-        return "Materialized view created"
+    """Update returning users last week rollup."""
+    sql = '''SELECT user_id, COUNT(day) AS n_days
+             FROM dashboard_day_users WHERE day >= %s
+             GROUP BY user_id HAVING(COUNT(day) > 1)
+             ORDER BY n_days;''' % WEEK_START
+    return _rollup_view('dashboard_week_returning_users',
+                        'dashboard_day_users', sql)
@@ -63,6 +63,10 @@ REDIS_DB = 0
 
 REDIS_KEYPREFIX = 'pybossa_cache'
 
+# In-memory cache in front of Redis, per worker process (0 disables it)
+CACHE_LOCAL_SIZE = 0
+CACHE_LOCAL_TIMEOUT = 60
+
 ## Default cache timeouts
 # Project cache
 AVATAR_TIMEOUT = 30 * 24 * 60 * 60
@@ -80,6 +84,8 @@ CATEGORY_TIMEOUT = 24 * 60 * 60
 USER_TIMEOUT = 15 * 60
 USER_TOP_TIMEOUT = 24 * 60 * 60
 USER_TOTAL_TIMEOUT = 24 * 60 * 60
+# Project and category leaderboards
+LEADERBOARD_TIMEOUT = 60
 
 # Project Presenters
 PRESENTERS = ["basic", "image", "sound", "video", "map", "pdf"]
@@ -95,6 +101,10 @@ TEMPLATE_TASKS = {
 LIMIT = 300
 PER = 15 * 60
 
+# Maximum limit of API collection reads streamed with ?stream=1 or
+# Accept: application/x-ndjson
+API_STREAM_LIMIT = 10000
+
 # Expiration time for password protected project cookies
 PASSWD_COOKIE_TIMEOUT = 60 * 30
 
@@ -150,6 +160,9 @@ GCM_SENDER_ID = "482941778795"
 # Unpublish inactive projects
 UNPUBLISH_PROJECTS = True
 
+# Seconds a task handed out by the scheduler stays reserved for a volunteer
+TASK_LEASE_TIMEOUT = 10 * 60
+
 # TTL for ZIP files of personal data
 TTL_ZIP_SEC_FILES = 3
 
@@ -20,12 +20,12 @@
 Exporter module for exporting tasks and tasks results out of PYBOSSA
 """
 
-import copy
 import os
 import zipfile
 import tempfile
 import json
-from pybossa.core import uploader, task_repo, result_repo
+from pybossa.core import uploader, task_repo, result_repo, sentinel
+from pybossa.exporter.spool import ExportSpool
 from pybossa.uploader import local
 from unidecode import unidecode
 from flask import url_for, safe_join, send_file, redirect, current_app
@@ -40,11 +40,26 @@ class Exporter(object):
     repositories = dict(task=[task_repo, 'filter_tasks_by'],
                         task_run=[task_repo, 'filter_task_runs_by'],
                         result=[result_repo, 'filter_by'])
+    # Tables whose rows are never updated, so they are exported
+    # incrementally from an ExportSpool
+    incremental = ('task_run',)
 
     def _get_data(self, table, project_id, flat=False, info_only=False):
         """Get the data for a given table."""
-        repo, query = self.repositories[table]
-        data = getattr(repo, query)(project_id=project_id)
+        return list(self._iter_data(table, project_id, flat, info_only))
+
+    def _iter_data(self, table, project_id, flat=False, info_only=False,
+                   spool=None):
+        """Yield the data for a given table one row at a time.
+
+        The rows are read from the spool, if given, or from the DB in
+        batches with a server side cursor, so exporting a big table does
+        not load it in memory.
+        """
+        if spool is not None:
+            data = spool.rows()
+        else:
+            data = (row.dictize() for row in self._iter_rows(table, project_id))
         ignore_keys = current_app.config.get('IGNORE_FLAT_KEYS') or []
         if table == 'task':
             csv_export_key = current_app.config.get('TASK_CSV_EXPORT_INFO_KEY')
@@ -52,44 +67,36 @@ class Exporter(object):
             csv_export_key = current_app.config.get('TASK_RUN_CSV_EXPORT_INFO_KEY')
         if table == 'result':
             csv_export_key = current_app.config.get('RESULT_CSV_EXPORT_INFO_KEY')
-        if info_only:
-            if flat:
-                tmp = []
-                for row in data:
-                    inf = copy.deepcopy(row.dictize()['info'])
+        for row in data:
+            if info_only:
+                inf = row['info']
+                if flat:
                     if inf and type(inf) == dict and csv_export_key and inf.get(csv_export_key):
                         inf = inf[csv_export_key]
                     new_key = '%s_id' % table
                     if inf and type(inf) == dict:
-                        inf[new_key] = row.id
-                        tmp.append(flatten(inf,
-                                           root_keys_to_ignore=ignore_keys))
+                        # Copy the dict so the row itself is left untouched
+                        inf = dict(inf)
+                        inf[new_key] = row['id']
+                        yield flatten(inf, root_keys_to_ignore=ignore_keys)
                     elif inf and type(inf) == list:
                         for datum in inf:
                             if type(datum) == dict:
-                                datum[new_key] = row.id
-                                tmp.append(flatten(datum,
-                                                   root_keys_to_ignore=ignore_keys))
+                                datum = dict(datum)
+                                datum[new_key] = row['id']
+                                yield flatten(datum,
+                                              root_keys_to_ignore=ignore_keys)
+                else:
+                    yield inf or {}
             else:
-                tmp = []
-                for row in data:
-                    if row.dictize()['info']:
-                        tmp.append(row.dictize()['info'])
-                    else:
-                        tmp.append({})
-        else:
-            if flat:
-                tmp = []
-                for row in data:
-                    cleaned = row.dictize()
+                cleaned = row
+                if flat:
                     fav_user_ids = None
                     task_run_ids = None
                     if cleaned.get('fav_user_ids'):
-                        fav_user_ids = cleaned['fav_user_ids']
-                        cleaned.pop('fav_user_ids')
+                        fav_user_ids = cleaned.pop('fav_user_ids')
                     if cleaned.get('task_run_ids'):
-                        task_run_ids = cleaned['task_run_ids']
-                        cleaned.pop('task_run_ids')
+                        task_run_ids = cleaned.pop('task_run_ids')
 
                     cleaned = flatten(cleaned,
                                       root_keys_to_ignore=ignore_keys)
@@ -98,11 +105,49 @@ class Exporter(object):
                         cleaned['fav_user_ids'] = fav_user_ids
                     if task_run_ids:
                         cleaned['task_run_ids'] = task_run_ids
+                yield cleaned
 
-                    tmp.append(cleaned)
-            else:
-                tmp = [row.dictize() for row in data]
-        return tmp
+    def _iter_rows(self, table, project_id, last_id=None):
+        """Yield the rows of a given table sorted by id, only the ones
+        after last_id if given."""
+        repo, query = self.repositories[table]
+        return getattr(repo, query)(project_id=project_id, last_id=last_id,
+                                    yielded=True)
+
+    def _spool(self, project_id, table):
+        folder = (current_app.config.get('EXPORT_SPOOL_FOLDER') or
+                  os.path.join(tempfile.gettempdir(), 'pybossa_exports'))
+        return ExportSpool(sentinel.master, folder, project_id, table)
+
+    def _sync_spool(self, project, table):
+        """Return the spool of the table with the rows saved since the last
+        export appended, or None if the table is not exported
+        incrementally."""
+        if table not in self.incremental:
+            return None
+        spool = self._spool(project.id, table)
+
+        def read_rows(last_id):
+            return (row.dictize()
+                    for row in self._iter_rows(table, project.id, last_id))
+
+        spool.sync(read_rows)
+        return spool
+
+    def reset_spools(self, project_id):
+        """Rebuild the incremental exports of a project from scratch next
+        time, e.g. because some of its rows have been deleted."""
+        for table in self.incremental:
+            self._spool(project_id, table).reset()
+
+    def _write_json(self, datafile, rows):
+        """Write rows to datafile as a JSON array, one row at a time."""
+        datafile.write('[')
+        for i, row in enumerate(rows):
+            if i:
+                datafile.write(', ')
+            datafile.write(json.dumps(row))
+        datafile.write(']')
 
     def _project_name_latin_encoded(self, project):
         """project short name for later HTML header usage"""
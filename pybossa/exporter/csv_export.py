@@ -20,6 +20,7 @@
 CSV Exporter module for exporting tasks and tasks results out of PYBOSSA
 """
 
+import json
 import tempfile
 from pybossa.exporter import Exporter
 from pybossa.core import uploader, task_repo
@@ -28,47 +29,71 @@ from pybossa.model.task_run import TaskRun
 from pybossa.util import UnicodeWriter
 from werkzeug.datastructures import FileStorage
 from werkzeug.utils import secure_filename
-import pandas as pd
 
 
 class CsvExporter(Exporter):
 
-    def _respond_csv(self, table, project_id, info_only=False):
-        flat_data = self._get_data(table, project_id,
-                                   flat=True, info_only=info_only)
-        return pd.DataFrame(flat_data)
+    def _write_csv(self, datafile, rows):
+        """Write rows to datafile as CSV, with the union of their keys as
+        header.
+
+        The rows are spilled to a temporary file while the header is
+        collected, so only one of them is kept in memory at a time.
+        """
+        keys = set()
+        spill = tempfile.TemporaryFile()
+        try:
+            for row in rows:
+                keys.update(row.keys())
+                spill.write(json.dumps(row))
+                spill.write('\n')
+            header = sorted(keys)
+            writer = UnicodeWriter(datafile)
+            writer.writerow(header)
+            spill.seek(0)
+            for line in spill:
+                row = json.loads(line)
+                writer.writerow([u'' if row.get(key) is None else row[key]
+                                 for key in header])
+        finally:
+            spill.close()
 
     def _make_zip(self, project, ty):
+        spool = self._sync_spool(project, ty)
+        if (spool is not None and spool.is_exported('csv') and
+                self.zip_existing(project, ty)):
+            return
         name = self._project_name_latin_encoded(project)
-        dataframe = self._respond_csv(ty, project.id)
-        if dataframe is not None:
-            info_dataframe = self._respond_csv(ty, project.id, info_only=True)
-            datafile = tempfile.NamedTemporaryFile()
-            info_datafile = tempfile.NamedTemporaryFile()
+        datafile = tempfile.NamedTemporaryFile()
+        info_datafile = tempfile.NamedTemporaryFile()
+        try:
+            self._write_csv(datafile,
+                            self._iter_data(ty, project.id, flat=True,
+                                            spool=spool))
+            self._write_csv(info_datafile,
+                            self._iter_data(ty, project.id, flat=True,
+                                            info_only=True, spool=spool))
+            datafile.flush()
+            info_datafile.flush()
+            zipped_datafile = tempfile.NamedTemporaryFile()
             try:
-                dataframe.to_csv(datafile, index=False,
-                                 encoding='utf-8')
-                info_dataframe.to_csv(
-                    info_datafile, index=False, encoding='utf-8')
-                datafile.flush()
-                info_datafile.flush()
-                zipped_datafile = tempfile.NamedTemporaryFile()
-                try:
-                    _zip = self._zip_factory(zipped_datafile.name)
-                    _zip.write(
-                        datafile.name, secure_filename('%s_%s.csv' % (name, ty)))
-                    _zip.write(
-                        info_datafile.name, secure_filename('%s_%s_info_only.csv' % (name, ty)))
-                    _zip.close()
-                    container = "user_%d" % project.owner_id
-                    _file = FileStorage(
-                        filename=self.download_name(project, ty), stream=zipped_datafile)
-                    uploader.upload_file(_file, container=container)
-                finally:
-                    zipped_datafile.close()
+                _zip = self._zip_factory(zipped_datafile.name)
+                _zip.write(
+                    datafile.name, secure_filename('%s_%s.csv' % (name, ty)))
+                _zip.write(
+                    info_datafile.name, secure_filename('%s_%s_info_only.csv' % (name, ty)))
+                _zip.close()
+                container = "user_%d" % project.owner_id
+                _file = FileStorage(
+                    filename=self.download_name(project, ty), stream=zipped_datafile)
+                uploader.upload_file(_file, container=container)
             finally:
-                datafile.close()
-                info_datafile.close()
+                zipped_datafile.close()
+        finally:
+            datafile.close()
+            info_datafile.close()
+        if spool is not None:
+            spool.mark_exported('csv')
 
     def download_name(self, project, ty):
         return super(CsvExporter, self).download_name(project, ty, 'csv')
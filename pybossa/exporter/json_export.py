@@ -51,11 +51,18 @@ class JsonExporter(Exporter):
                                    user_id, project,
                                    'json', zipname)
         else:
+            spool = self._sync_spool(project, ty)
+            if (spool is not None and spool.is_exported('json') and
+                    self.zip_existing(project, ty)):
+                return zipname
             name = self._project_name_latin_encoded(project)
-            json_task_generator = self._respond_json(ty, project.id)
-            if json_task_generator is not None:
-                return self.handle_zip(name, json_task_generator,
-                                       ty, user_id, project, 'json', zipname)
+            zipname = self.handle_zip(name,
+                                      self._iter_data(ty, project.id,
+                                                      spool=spool),
+                                      ty, user_id, project, 'json', zipname)
+            if spool is not None:
+                spool.mark_exported('json')
+            return zipname
 
     def download_name(self, project, ty):
         return super(JsonExporter, self).download_name(project, ty, 'json')
@@ -72,7 +79,10 @@ class JsonExporter(Exporter):
         try:
             datafile = tempfile.NamedTemporaryFile()
             try:
-                datafile.write(json.dumps(data))
+                if isinstance(data, dict):
+                    datafile.write(json.dumps(data))
+                else:
+                    self._write_json(datafile, data)
                 datafile.flush()
                 _zip.write(datafile.name,
                            secure_filename('%s_%s.%s' % (name, ty, ext)))
@@ -0,0 +1,150 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Parquet Exporter module for exporting tasks and tasks results out of PYBOSSA
+"""
+
+import json
+import tempfile
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pybossa.exporter import Exporter
+from pybossa.core import uploader
+from werkzeug.datastructures import FileStorage
+from werkzeug.utils import secure_filename
+
+
+class ParquetExporter(Exporter):
+
+    # Rows written to the Parquet file at a time
+    ROW_GROUP = 10000
+    INT64_RANGE = (-2 ** 63, 2 ** 63)
+
+    def _write_parquet(self, filename, rows):
+        """Write rows to filename as Parquet, with a column per key.
+
+        Columns with numbers or booleans only keep their type, any other
+        column is stored as text, with lists and dicts encoded as JSON. The
+        rows are spilled to a temporary file while the types of the columns
+        are found, and then written in row groups of ROW_GROUP rows.
+        """
+        kinds = {}
+        spill = tempfile.TemporaryFile()
+        try:
+            for row in rows:
+                for key, value in row.iteritems():
+                    kind = kinds.setdefault(key, set())
+                    if value is not None:
+                        kind.add(self._kind(value))
+                spill.write(json.dumps(row))
+                spill.write('\n')
+            if not kinds:
+                kinds['id'] = set(['int'])
+            schema = pa.schema([pa.field(key, self._arrow_type(kinds[key]))
+                                for key in sorted(kinds)])
+            writer = pq.ParquetWriter(filename, schema, compression='snappy')
+            try:
+                spill.seek(0)
+                batch = []
+                for line in spill:
+                    batch.append(json.loads(line))
+                    if len(batch) == self.ROW_GROUP:
+                        writer.write_table(self._table(schema, batch))
+                        batch = []
+                if batch:
+                    writer.write_table(self._table(schema, batch))
+            finally:
+                writer.close()
+        finally:
+            spill.close()
+
+    def _kind(self, value):
+        if isinstance(value, bool):
+            return 'bool'
+        if isinstance(value, (int, long)):
+            low, high = self.INT64_RANGE
+            return 'int' if low <= value < high else 'text'
+        if isinstance(value, float):
+            return 'float'
+        return 'text'
+
+    def _arrow_type(self, kinds):
+        if kinds == set(['bool']):
+            return pa.bool_()
+        if kinds == set(['int']):
+            return pa.int64()
+        if kinds and kinds <= set(['int', 'float']):
+            return pa.float64()
+        return pa.string()
+
+    def _table(self, schema, rows):
+        arrays = []
+        for field in schema:
+            values = [self._value(row.get(field.name), field.type)
+                      for row in rows]
+            arrays.append(pa.array(values, type=field.type))
+        return pa.Table.from_arrays(arrays, names=schema.names)
+
+    def _value(self, value, arrow_type):
+        if value is None:
+            return None
+        if arrow_type == pa.float64():
+            return float(value)
+        if arrow_type == pa.string() and not isinstance(value, basestring):
+            return json.dumps(value)
+        return value
+
+    def _make_zip(self, project, ty):
+        spool = self._sync_spool(project, ty)
+        if (spool is not None and spool.is_exported('parquet') and
+                self.zip_existing(project, ty)):
+            return
+        name = self._project_name_latin_encoded(project)
+        datafile = tempfile.NamedTemporaryFile()
+        try:
+            self._write_parquet(datafile.name,
+                                self._iter_data(ty, project.id, flat=True,
+                                                spool=spool))
+            zipped_datafile = tempfile.NamedTemporaryFile()
+            try:
+                _zip = self._zip_factory(zipped_datafile.name)
+                _zip.write(
+                    datafile.name,
+                    secure_filename('%s_%s.parquet' % (name, ty)))
+                _zip.close()
+                container = "user_%d" % project.owner_id
+                _file = FileStorage(
+                    filename=self.download_name(project, ty),
+                    stream=zipped_datafile)
+                uploader.upload_file(_file, container=container)
+            finally:
+                zipped_datafile.close()
+        finally:
+            datafile.close()
+        if spool is not None:
+            spool.mark_exported('parquet')
+
+    def download_name(self, project, ty):
+        return super(ParquetExporter, self).download_name(project, ty,
+                                                          'parquet')
+
+    def pregenerate_zip_files(self, project):
+        print "%d (parquet)" % project.id
+        self._make_zip(project, "task")
+        self._make_zip(project, "task_run")
+        self._make_zip(project, "result")
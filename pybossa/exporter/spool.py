@@ -0,0 +1,153 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+"""Append only copy of the rows of a project exported incrementally.
+
+Task runs are seldom modified once they are saved, so instead of reading
+all of them every time a project is exported, the exporter keeps them in a
+local file, one JSON row per line, and only reads from the DB the rows
+saved after the last export. Whatever modifies saved task runs, like
+updating them or anonymizing the ones of a deleted user, has to reset the
+spools of their projects.
+
+The manifest of the file (the last id read, the number of rows, the size
+of the file and a digest of its last row) is kept in Redis, so every worker
+can tell whether its own copy is up to date. If it is not, or the manifest
+has been deleted because rows of the project were deleted or modified, the
+file is rebuilt from the DB.
+
+"""
+import json
+import os
+from collections import deque
+from hashlib import sha1
+
+
+class ExportSpool(object):
+
+    KEY = 'pybossa:export:project:%s:%s'
+    # Ids are assigned before the rows are committed, so the rows with an
+    # id up to OVERLAP below the last one read are read again in case one
+    # of them was committed after it.
+    OVERLAP = 10000
+    TTL = 30 * 24 * 60 * 60
+
+    def __init__(self, redis_conn, folder, project_id, table):
+        self.conn = redis_conn
+        self.key = self.KEY % (project_id, table)
+        self.folder = folder
+        self.path = os.path.join(folder, '%s_%s.json' % (project_id, table))
+        self.manifest = None
+
+    def get(self):
+        """Return the manifest of the file or None if there is none."""
+        record = self.conn.hgetall(self.key)
+        if not record:
+            return None
+        return dict(last_id=int(record['last_id']),
+                    n_rows=int(record['n_rows']),
+                    size=int(record['size']),
+                    tail=int(record.get('tail', -1)),
+                    digest=record.get('digest'),
+                    recent=json.loads(record['recent']))
+
+    def sync(self, read_rows):
+        """Append the rows saved since the last sync and return how many.
+
+        read_rows is called with the id after which rows have to be read,
+        or 0 to read them all, and has to return the rows as dicts sorted
+        by id.
+        """
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+        manifest = self.get()
+        if manifest is None or not self._is_local(manifest):
+            manifest = dict(last_id=0, n_rows=0, size=0, tail=0,
+                            digest=sha1().hexdigest(), recent=[])
+            self.conn.delete(self.key)
+        last_id = manifest['last_id']
+        tail, digest = manifest['tail'], manifest['digest']
+        recent = deque(manifest['recent'])
+        known = set(recent)
+        n_new = 0
+        with open(self.path, 'r+b' if manifest['size'] else 'wb') as spool:
+            spool.truncate(manifest['size'])
+            spool.seek(manifest['size'])
+            for row in read_rows(max(last_id - self.OVERLAP, 0)):
+                if row['id'] in known:
+                    continue
+                line = json.dumps(row) + '\n'
+                tail = spool.tell()
+                digest = sha1(line).hexdigest()
+                spool.write(line)
+                n_new += 1
+                recent.append(row['id'])
+                last_id = max(last_id, row['id'])
+                while recent[0] <= last_id - self.OVERLAP:
+                    recent.popleft()
+            size = spool.tell()
+        self.manifest = dict(last_id=last_id,
+                             n_rows=manifest['n_rows'] + n_new,
+                             size=size, tail=tail, digest=digest,
+                             recent=list(recent))
+        record = dict(self.manifest, recent=json.dumps(list(recent)))
+        pipeline = self.conn.pipeline()
+        pipeline.hmset(self.key, record)
+        pipeline.expire(self.key, self.TTL)
+        pipeline.execute()
+        return n_new
+
+    def rows(self):
+        """Yield the rows in the file."""
+        with open(self.path, 'rb') as spool:
+            for line in spool:
+                yield json.loads(line)
+
+    def is_exported(self, _format):
+        """Return True if the last export in _format has every row read by
+        the last sync."""
+        exported = self.conn.hget(self.key, 'exported:%s' % _format)
+        return exported == str(self.manifest['last_id'])
+
+    def mark_exported(self, _format):
+        """Record that the export in _format has every row read by the last
+        sync."""
+        self.conn.hset(self.key, 'exported:%s' % _format,
+                       self.manifest['last_id'])
+
+    def reset(self):
+        """Drop the manifest so the file is rebuilt on the next sync."""
+        self.conn.delete(self.key)
+
+    def _is_local(self, manifest):
+        """Return True if the local file has, at least, the rows in the
+        manifest.
+
+        A longer file has rows written by a sync that did not finish, which
+        are discarded. The last row in the manifest has to match its digest,
+        so a file as long as the one of the manifest but written by another
+        worker is not taken for it.
+        """
+        size, tail = manifest['size'], manifest['tail']
+        if tail < 0 or not os.path.isfile(self.path):
+            return False
+        if os.path.getsize(self.path) < size:
+            return False
+        with open(self.path, 'rb') as spool:
+            spool.seek(tail)
+            line = spool.read(size - tail)
+        return sha1(line).hexdigest() == manifest['digest']
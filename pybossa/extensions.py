@@ -106,6 +106,7 @@ uploader = None
 # Exporters
 json_exporter = None
 csv_exporter = None
+parquet_exporter = None
 
 # CSRF protection
 from flask_wtf.csrf import CsrfProtect
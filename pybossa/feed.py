@@ -16,6 +16,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
 import json
+from datetime import datetime
 from time import time
 from pybossa.core import sentinel
 try:
@@ -25,20 +26,53 @@ except ImportError:  # pragma: no cover
 
 
 FEED_KEY = 'pybossa_feed'
+FEED_MAX_SIZE = 1000
+# Score gap keeping the order of the objects written in the same batch
+FEED_SCORE_STEP = 1e-6
 
-def update_feed(obj):
-    """Add domain object to update feed in Redis."""
+
+def _json_default(obj):
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError(repr(obj) + " is not JSON serializable")
+
+
+def _dumps(obj):
+    return json.dumps(obj, separators=(',', ':'), default=_json_default)
+
+
+def _loads(data):
+    try:
+        return json.loads(data)
+    except ValueError:
+        # Entries written before the feed was stored as JSON
+        return pickle.loads(data)
+
+
+def update_feed(*objs):
+    """Add domain objects to update feed in Redis.
+
+    All the objects are written with a single pipeline that also trims the
+    feed to its FEED_MAX_SIZE most recent entries.
+    """
+    if not objs:
+        return
+    now = time()
+    args = []
+    for i, obj in enumerate(objs):
+        args.extend([now + i * FEED_SCORE_STEP, _dumps(obj)])
     pipeline = sentinel.master.pipeline()
-    serialized_object = pickle.dumps(obj)
-    pipeline.zadd(FEED_KEY, time(), serialized_object)
+    pipeline.zadd(FEED_KEY, *args)
+    pipeline.zremrangebyrank(FEED_KEY, 0, -FEED_MAX_SIZE - 1)
     pipeline.execute()
 
+
 def get_update_feed():
     """Return update feed list."""
     data = sentinel.slave.zrevrange(FEED_KEY, 0, 99, withscores=True)
     feed = []
     for u in data:
-        tmp = pickle.loads(u[0])
+        tmp = _loads(u[0])
         tmp['updated'] = u[1]
         if tmp.get('info') and type(tmp.get('info')) == unicode:
             tmp['info'] = json.loads(tmp['info'])
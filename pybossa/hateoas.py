@@ -27,6 +27,10 @@ class Hateoas(object):
         """Return hateoas link."""
         return "<link rel='%s' title='%s' href='%s'/>" % (rel, title, href)
 
+    def link_header(self, rel, href):
+        """Return the value of an HTTP Link header."""
+        return '<%s>; rel="%s"' % (href, rel)
+
     def create_link(self, item_id, title, rel='self'):
         """Create hateoas link."""
         # title = item.__class__.__name__.lower()
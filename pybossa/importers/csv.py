@@ -17,12 +17,10 @@
 # along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
 
 import requests
-from StringIO import StringIO
 from flask.ext.babel import gettext
-from pybossa.util import unicode_csv_reader
+from pybossa.util import unicode_csv_reader, iter_decoded_lines
 
 from .base import BulkTaskImport, BulkImportException
-from werkzeug.datastructures import FileStorage
 import io, time
 
 class BulkTaskCSVImport(BulkTaskImport):
@@ -30,6 +28,8 @@ class BulkTaskCSVImport(BulkTaskImport):
     """Class to import CSV tasks in bulk."""
 
     importer_id = "csv"
+    # Bytes of the remote file read at a time
+    chunk_size = 64 * 1024
 
     def __init__(self, csv_url, last_import_meta=None):
         self.url = csv_url
@@ -38,9 +38,14 @@ class BulkTaskCSVImport(BulkTaskImport):
     def tasks(self):
         """Get tasks from a given URL."""
         dataurl = self._get_data_url()
-        r = requests.get(dataurl)
+        r = requests.get(dataurl, stream=True)
         return self._get_csv_data_from_request(r)
 
+    def count_tasks(self):
+        """Count the rows of the CSV file without building the tasks."""
+        r = requests.get(self._get_data_url(), stream=True)
+        return self._count_csv_rows(self._get_csv_reader(r))
+
     def _get_data_url(self):
         """Get data from URL."""
         return self.url
@@ -71,6 +76,15 @@ class BulkTaskCSVImport(BulkTaskImport):
                         task_data["info"][headers[idx]] = cell
                 yield task_data
 
+    def _count_csv_rows(self, csvreader):
+        """Count CSV rows."""
+        headers = next(csvreader, None)
+        if headers is None:
+            return 0
+        self._check_no_duplicated_headers(headers)
+        self._check_no_empty_headers(headers)
+        return sum(1 for row in csvreader)
+
     def _check_no_duplicated_headers(self, headers):
         if len(headers) != len(set(headers)):
             msg = gettext('The file you uploaded has '
@@ -93,6 +107,10 @@ class BulkTaskCSVImport(BulkTaskImport):
 
     def _get_csv_data_from_request(self, r):
         """Get CSV data from a request."""
+        return self._import_csv_tasks(self._get_csv_reader(r))
+
+    def _get_csv_reader(self, r):
+        """Get a CSV reader streaming the content of a request."""
         if r.status_code == 403:
             msg = ("Oops! It looks like you don't have permission to access"
                    " that file")
@@ -103,9 +121,9 @@ class BulkTaskCSVImport(BulkTaskImport):
             raise BulkImportException(msg, 'error')
 
         r.encoding = 'utf-8'
-        csvcontent = StringIO(r.text)
-        csvreader = unicode_csv_reader(csvcontent)
-        return self._import_csv_tasks(csvreader)
+        lines = iter_decoded_lines(r.iter_content(self.chunk_size),
+                                   r.encoding)
+        return unicode_csv_reader(lines)
 
 
 class BulkTaskGDImport(BulkTaskCSVImport):
@@ -143,9 +161,13 @@ class BulkTaskLocalCSVImport(BulkTaskCSVImport):
         return self.form_data['csv_filename']
 
     def count_tasks(self):
-        return len([task for task in self.tasks()])
+        """Count the rows of the CSV file without building the tasks."""
+        return self._count_csv_rows(self._get_csv_reader(self._get_data()))
 
     def _get_csv_data_from_request(self, csv_filename):
+        return self._import_csv_tasks(self._get_csv_reader(csv_filename))
+
+    def _get_csv_reader(self, csv_filename):
         if csv_filename is None:
             msg = ("Not a valid csv file for import")
             raise BulkImportException(gettext(msg), 'error')
@@ -154,20 +176,23 @@ class BulkTaskLocalCSVImport(BulkTaskCSVImport):
         csv_file = None
         while retry < 10:
             try:
-                csv_file = FileStorage(io.open(csv_filename, encoding='utf-8-sig'))
+                csv_file = io.open(csv_filename, encoding='utf-8-sig')
                 break
             except IOError, e:
                 time.sleep(2)
                 retry += 1
 
-        if csv_file is None or csv_file.stream is None:
+        if csv_file is None:
             msg = ("Unable to load csv file for import, file {0}".format(csv_filename))
             raise BulkImportException(gettext(msg), 'error')
 
-        csv_file.stream.seek(0)
-        csvcontent = io.StringIO(csv_file.stream.read())
-        csvreader = unicode_csv_reader(csvcontent)
-        return list(self._import_csv_tasks(csvreader))
+        return unicode_csv_reader(self._read_lines(csv_file))
+
+    def _read_lines(self, csv_file):
+        """Read the file line by line and close it when done."""
+        with csv_file:
+            for line in csv_file:
+                yield line
 
     def tasks(self):
         """Get tasks from a given URL."""
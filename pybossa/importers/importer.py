@@ -16,6 +16,9 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
 
+import json
+from hashlib import md5
+from itertools import islice
 from flask.ext.babel import gettext
 from .csv import BulkTaskCSVImport, BulkTaskGDImport, BulkTaskLocalCSVImport
 from .dropbox import BulkTaskDropboxImport
@@ -57,22 +60,19 @@ class Importer(object):
         self._importers['youtube'] = BulkTaskYoutubeImport
         self._importer_constructor_params['youtube'] = youtube_params
 
-    def create_tasks(self, task_repo, project_id, **form_data):
-        """Create tasks."""
-        from pybossa.model.task import Task
+    def create_tasks(self, task_repo, project_id, progress=None, **form_data):
         """Create tasks from a remote source using an importer object and
-        avoiding the creation of repeated tasks"""
-        empty = True
-        n = 0
+        avoiding the creation of repeated tasks.
+
+        The tasks are inserted in bulk; progress, if given, is called with
+        the number of tasks inserted so far after every chunk.
+        """
         importer = self._create_importer_for(**form_data)
-        for task_data in importer.tasks():
-            task = Task(project_id=project_id)
-            [setattr(task, k, v) for k, v in task_data.iteritems()]
-            found = task_repo.get_task_by(project_id=project_id, info=task.info)
-            if found is None:
-                task_repo.save(task)
-                n += 1
-                empty = False
+        n = task_repo.bulk_save(project_id,
+                                self._new_tasks(task_repo, project_id,
+                                                importer.tasks()),
+                                progress=progress)
+        empty = n == 0
         if empty:
             msg = gettext('It looks like there were no new records to import')
             return ImportReport(message=msg, metadata=None, total=n)
@@ -83,6 +83,57 @@ class Importer(object):
         report = ImportReport(message=msg, metadata=metadata, total=n)
         return report
 
+    def stage_tasks(self, stage, chunk_size, skip=0, **form_data):
+        """Read the tasks of a source in chunks without creating them.
+
+        stage is called with every chunk of tasks not repeated within the
+        source. The first skip tasks, staged by a previous run, are read
+        again but not staged. Returns the import metadata.
+        """
+        importer = self._create_importer_for(**form_data)
+        tasks = self._unique_tasks(importer.tasks())
+        for task_data in islice(tasks, skip):
+            pass
+        while True:
+            chunk = list(islice(tasks, chunk_size))
+            if not chunk:
+                break
+            stage(chunk)
+        return importer.import_metadata()
+
+    def create_staged_tasks(self, task_repo, project_id, tasks):
+        """Create the tasks of a staged chunk that are not in the project."""
+        return task_repo.bulk_save(project_id,
+                                   self._new_tasks(task_repo, project_id,
+                                                   tasks))
+
+    def _new_tasks(self, task_repo, project_id, tasks):
+        """Yield the tasks whose info is not in the project nor repeated.
+
+        The project is checked with one hash lookup per chunk of tasks.
+        """
+        tasks = self._unique_tasks(tasks)
+        while True:
+            chunk = list(islice(tasks, task_repo.BULK_CHUNK))
+            if not chunk:
+                break
+            existing = task_repo.find_existing_infos(
+                project_id, [task_data.get('info') for task_data in chunk])
+            for i, task_data in enumerate(chunk):
+                if i not in existing:
+                    yield dict((k, v) for k, v in task_data.iteritems()
+                               if k in task_repo.BULK_COLUMNS)
+
+    def _unique_tasks(self, tasks):
+        """Yield the tasks whose info has not been yielded before."""
+        seen = set()
+        for task_data in tasks:
+            info = task_data.get('info')
+            digest = md5(json.dumps(info, sort_keys=True)).digest()
+            if digest not in seen:
+                seen.add(digest)
+                yield task_data
+
     def count_tasks_to_import(self, **form_data):
         """Count tasks to import."""
         return self._create_importer_for(**form_data).count_tasks()
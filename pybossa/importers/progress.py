@@ -0,0 +1,158 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+"""Redis record of the chunked import of tasks into a project.
+
+An import goes through these states:
+    * staging: the source is being read and stored in Redis in chunks,
+    * staged: every chunk has been stored and is being, or has been,
+      enqueued to be imported,
+    * finished: every chunk has been imported,
+    * failed: the source could not be read.
+
+Every chunk is deleted once its tasks are committed, so a failed or
+interrupted import can be resumed by importing the chunks left and, if
+the import was still staging, by reading the rest of the source.
+
+"""
+import json
+from datetime import datetime
+
+
+class ImportProgress(object):
+
+    KEY = 'pybossa:import:project:%s'
+    CHUNK_KEY = 'pybossa:import:project:%s:chunk:%s'
+    DONE_KEY = 'pybossa:import:project:%s:done'
+    LOCK_KEY = 'pybossa:import:project:%s:chunk:%s:lock'
+    TTL = 7 * 24 * 60 * 60
+
+    def __init__(self, redis_conn, project_id):
+        self.conn = redis_conn
+        self.project_id = project_id
+        self.key = self.KEY % project_id
+        self.done_key = self.DONE_KEY % project_id
+
+    def get(self):
+        """Return the progress of the import or None if there is none."""
+        record = self.conn.hgetall(self.key)
+        if not record:
+            return None
+        n_chunks = int(record.get('n_chunks', 0))
+        n_done = self.conn.scard(self.done_key)
+        return dict(state=record['state'],
+                    form_data=json.loads(record['form_data']),
+                    from_auto=record.get('from_auto') == '1',
+                    started=record['started'],
+                    n_staged=int(record.get('n_staged', 0)),
+                    n_chunks=n_chunks,
+                    n_done_chunks=n_done,
+                    n_created=int(record.get('n_created', 0)),
+                    error=record.get('error'))
+
+    def start(self, form_data, from_auto=False):
+        """Discard any previous record and start a new one."""
+        pipeline = self.conn.pipeline()
+        self._delete_chunks(pipeline)
+        pipeline.delete(self.key, self.done_key)
+        pipeline.hmset(self.key, dict(state='staging',
+                                      form_data=json.dumps(form_data),
+                                      from_auto=int(from_auto),
+                                      started=datetime.utcnow().isoformat(),
+                                      n_staged=0, n_chunks=0, n_created=0))
+        pipeline.expire(self.key, self.TTL)
+        pipeline.execute()
+
+    def stage_chunk(self, tasks):
+        """Store a chunk of tasks and return its index."""
+        index = int(self.conn.hget(self.key, 'n_chunks') or 0)
+        chunk_key = self.CHUNK_KEY % (self.project_id, index)
+        pipeline = self.conn.pipeline()
+        pipeline.set(chunk_key, json.dumps(tasks), ex=self.TTL)
+        pipeline.hincrby(self.key, 'n_staged', len(tasks))
+        pipeline.hincrby(self.key, 'n_chunks', 1)
+        pipeline.execute()
+        return index
+
+    def resume_staging(self):
+        pipeline = self.conn.pipeline()
+        pipeline.hset(self.key, 'state', 'staging')
+        pipeline.hdel(self.key, 'error')
+        pipeline.execute()
+
+    def finish_staging(self):
+        self.conn.hset(self.key, 'state', 'staged')
+
+    def fail(self, error):
+        self.conn.hmset(self.key, dict(state='failed', error=error))
+
+    def load_chunk(self, index):
+        """Return the tasks of a chunk or None if it has been imported."""
+        data = self.conn.get(self.CHUNK_KEY % (self.project_id, index))
+        if data is None:
+            return None
+        return json.loads(data)
+
+    def claim_chunk(self, index, timeout):
+        """Return True if no other job is importing the chunk.
+
+        The claim expires after timeout seconds, so the chunk of a job
+        killed halfway can be imported again.
+        """
+        lock_key = self.LOCK_KEY % (self.project_id, index)
+        return bool(self.conn.set(lock_key, 1, nx=True, ex=timeout))
+
+    def release_chunk(self, index):
+        self.conn.delete(self.LOCK_KEY % (self.project_id, index))
+
+    def finish_chunk(self, index, n_created):
+        """Record that the tasks of a chunk have been committed."""
+        pipeline = self.conn.pipeline()
+        pipeline.delete(self.LOCK_KEY % (self.project_id, index))
+        pipeline.sadd(self.done_key, index)
+        pipeline.expire(self.done_key, self.TTL)
+        pipeline.hincrby(self.key, 'n_created', n_created)
+        pipeline.delete(self.CHUNK_KEY % (self.project_id, index))
+        pipeline.execute()
+
+    def pending_chunks(self):
+        """Return the indexes of the staged chunks not imported yet."""
+        record = self.get()
+        if record is None:
+            return []
+        done = set(int(i) for i in self.conn.smembers(self.done_key))
+        return [i for i in range(record['n_chunks']) if i not in done]
+
+    def complete(self):
+        """Mark the import as finished once every chunk has been imported.
+
+        It returns True only to the first caller that finds the import
+        complete, so whatever has to be done at the end is done once.
+        """
+        record = self.get()
+        if (record is None or record['state'] != 'staged' or
+                record['n_done_chunks'] < record['n_chunks']):
+            return False
+        if not self.conn.hsetnx(self.key, 'finished', 1):
+            return False
+        self.conn.hset(self.key, 'state', 'finished')
+        return True
+
+    def _delete_chunks(self, pipeline):
+        n_chunks = int(self.conn.hget(self.key, 'n_chunks') or 0)
+        for index in range(n_chunks):
+            pipeline.delete(self.CHUNK_KEY % (self.project_id, index))
@@ -21,11 +21,13 @@ import math
 import requests
 from flask import current_app, render_template
 from flask.ext.mail import Message
+from flask.ext.babel import gettext
 from pybossa.core import mail, task_repo, importer, create_app
+from pybossa.importers.progress import ImportProgress
 from pybossa.model.webhook import Webhook
 from pybossa.util import with_cache_disabled, publish_channel
 import pybossa.dashboard.jobs as dashboard
-from pybossa.leaderboard.jobs import leaderboard
+from pybossa.leaderboard.jobs import leaderboard, windowed_leaderboard
 from pbsonesignal import PybossaOneSignal
 from pybossa.core import uploader
 from pybossa.exporter.json_export import JsonExporter
@@ -116,11 +118,14 @@ def get_periodic_jobs(queue):
         if queue == 'quaterly' else []
     dashboard_jobs = get_dashboard_jobs() if queue == 'low' else []
     leaderboard_jobs = get_leaderboard_jobs() if queue == 'super' else []
+    windowed_leaderboard_jobs = get_windowed_leaderboard_jobs() \
+        if queue == 'low' else []
     weekly_update_jobs = get_weekly_stats_update_projects() if queue == 'low' else []
     failed_jobs = get_maintenance_jobs() if queue == 'maintenance' else []
     _all = [zip_jobs, jobs, project_jobs, autoimport_jobs,
             engage_jobs, non_contrib_jobs, dashboard_jobs,
-            weekly_update_jobs, failed_jobs, leaderboard_jobs]
+            weekly_update_jobs, failed_jobs, leaderboard_jobs,
+            windowed_leaderboard_jobs]
     return (job for sublist in _all for job in sublist if job['queue'] == queue)
 
 
@@ -172,11 +177,13 @@ def get_export_task_jobs(queue):
 def project_export(_id):
     """Export project."""
     from pybossa.core import project_repo, json_exporter, csv_exporter
+    from pybossa.core import parquet_exporter
     app = project_repo.get(_id)
     if app is not None:
         print "Export project id %d" % _id
         json_exporter.pregenerate_zip_files(app)
         csv_exporter.pregenerate_zip_files(app)
+        parquet_exporter.pregenerate_zip_files(app)
 
 
 def get_project_jobs(queue):
@@ -216,14 +223,18 @@ def get_inactive_users_jobs(queue='quaterly'):
     from sqlalchemy.sql import text
     from pybossa.model.user import User
     from pybossa.core import db
+    from pybossa.model import timestamptz_compare_sql
     # First users that have participated once but more than 3 months ago
     sql = text('''SELECT user_id FROM task_run
                WHERE user_id IS NOT NULL
-               AND to_date(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-               >= NOW() - '12 month'::INTERVAL
-               AND to_date(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-               < NOW() - '3 month'::INTERVAL
-               GROUP BY user_id ORDER BY user_id;''')
+               AND %s AND %s
+               GROUP BY user_id ORDER BY user_id;''' % (
+        timestamptz_compare_sql(
+            'task_run', 'finish_time', 'finished_at', '>=',
+            "DATE_TRUNC('day', NOW() - '12 month'::INTERVAL) + INTERVAL '1 day'"),
+        timestamptz_compare_sql(
+            'task_run', 'finish_time', 'finished_at', '<',
+            "DATE_TRUNC('day', NOW() - '3 month'::INTERVAL) + INTERVAL '1 day'")))
     results = db.slave_session.execute(sql)
 
     timeout = current_app.config.get('TIMEOUT')
@@ -289,6 +300,17 @@ def get_leaderboard_jobs(queue='super'):  # pragma: no cover
                timeout=timeout, queue=queue)
 
 
+def get_windowed_leaderboard_jobs(queue='low'):
+    """Return a job rebuilding every loaded project and category
+    leaderboard."""
+    from pybossa.core import sentinel
+    from pybossa.leaderboard.scores import WindowedScores
+    timeout = current_app.config.get('TIMEOUT')
+    for scope, scope_id in WindowedScores(sentinel.master).loaded():
+        yield dict(name=windowed_leaderboard, args=[scope, scope_id],
+                   kwargs={}, timeout=timeout, queue=queue)
+
+
 def get_non_contributors_users_jobs(queue='quaterly'):
     """Return a list of users that have never contributed to a project."""
     from sqlalchemy.sql import text
@@ -496,6 +518,25 @@ def warn_old_project_owners():
     return True
 
 
+def compact_task_counters(project_id):
+    """Fold the counter rows of the tasks of a project into one per task."""
+    from sqlalchemy.sql import text
+    from pybossa.core import db
+    sql = text('''
+               WITH folded AS (
+               DELETE FROM counter WHERE task_id IN
+               (SELECT task_id FROM counter WHERE project_id=:project_id
+               GROUP BY task_id HAVING COUNT(*) > 1)
+               RETURNING project_id, task_id, n_task_runs)
+               INSERT INTO counter (created, project_id, task_id, n_task_runs)
+               SELECT NOW(), project_id, task_id, SUM(n_task_runs)
+               FROM folded GROUP BY project_id, task_id;
+               ''')
+    result = db.session.execute(sql, dict(project_id=project_id))
+    db.session.commit()
+    return "%s task counters compacted" % result.rowcount
+
+
 def send_mail(message_dict):
     """Send email."""
     message = Message(**message_dict)
@@ -511,7 +552,95 @@ def import_tasks(project_id, from_auto=False, **form_data):
         form_data['last_import_meta'] = report.metadata
         project.set_autoimporter(form_data)
         project_repo.save(project)
-    msg = report.message + ' to your project %s!' % project.name
+    return _send_import_report(project, report.message)
+
+
+def import_tasks_in_chunks(project_id, from_auto=False, **form_data):
+    """Import tasks for a project with one job per chunk of tasks.
+
+    The source is read once and staged in Redis in chunks, which are
+    imported in parallel by jobs in the low queue. If the last import of the
+    project was the same one and did not finish, it is resumed instead.
+    """
+    from pybossa.core import project_repo, sentinel
+    from rq import Queue
+    progress = ImportProgress(sentinel.master, project_id)
+    queue = Queue('low', connection=sentinel.master)
+    timeout = current_app.config.get('TIMEOUT')
+    record = progress.get()
+    staged = False
+    skip = 0
+    if (record is not None and record['state'] != 'finished' and
+            record['form_data'] == form_data):
+        for index in progress.pending_chunks():
+            queue.enqueue_call(func=import_task_chunk,
+                               args=(project_id, index), timeout=timeout)
+        staged = record['state'] == 'staged'
+        skip = record['n_staged']
+        if not staged:
+            progress.resume_staging()
+    else:
+        progress.start(form_data, from_auto)
+
+    def stage(chunk):
+        index = progress.stage_chunk(chunk)
+        queue.enqueue_call(func=import_task_chunk, args=(project_id, index),
+                           timeout=timeout)
+
+    if not staged:
+        try:
+            metadata = importer.stage_tasks(stage, task_repo.BULK_CHUNK,
+                                            skip=skip, **form_data)
+        except Exception as e:
+            progress.fail(str(e))
+            raise
+        if from_auto:
+            project = project_repo.get(project_id)
+            form_data['last_import_meta'] = metadata
+            project.set_autoimporter(form_data)
+            project_repo.save(project)
+        progress.finish_staging()
+    if progress.complete():
+        _send_chunked_import_report(project_id, progress)
+    return '%s chunks of tasks staged' % progress.get()['n_chunks']
+
+
+def import_task_chunk(project_id, index):
+    """Import a chunk of tasks staged by import_tasks_in_chunks."""
+    from pybossa.core import sentinel
+    progress = ImportProgress(sentinel.master, project_id)
+    if not progress.claim_chunk(index, current_app.config.get('TIMEOUT')):
+        return 'Chunk %s is already being imported' % index
+    try:
+        tasks = progress.load_chunk(index)
+        if tasks is None:
+            progress.release_chunk(index)
+            return 'Chunk %s was already imported' % index
+        n = importer.create_staged_tasks(task_repo, project_id, tasks)
+    except Exception:
+        progress.release_chunk(index)
+        raise
+    progress.finish_chunk(index, n)
+    if progress.complete():
+        _send_chunked_import_report(project_id, progress)
+    return '%s tasks imported from chunk %s' % (n, index)
+
+
+def _send_chunked_import_report(project_id, progress):
+    from pybossa.core import project_repo
+    project = project_repo.get(project_id)
+    n = progress.get()['n_created']
+    if n == 0:
+        msg = gettext('It looks like there were no new records to import')
+    elif n == 1:
+        msg = str(n) + " " + gettext('new task was imported successfully')
+    else:
+        msg = str(n) + " " + gettext('new tasks were imported successfully')
+    return _send_import_report(project, msg)
+
+
+def _send_import_report(project, message):
+    msg = message + ' to your project %s!' % project.name
     subject = 'Tasks Import to your project %s' % project.name
     body = 'Hello,\n\n' + msg + '\n\nAll the best,\nThe %s team.'\
         % current_app.config.get('BRAND')
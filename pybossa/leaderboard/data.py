@@ -16,60 +16,85 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
 """Leaderboard queries in leaderboard view."""
+from rq import Queue
 from sqlalchemy import text
-from pybossa.core import db
+from pybossa.core import db, sentinel
 from pybossa.model.user import User
+from pybossa.leaderboard.jobs import load_scores
+from pybossa.leaderboard.scores import LeaderboardScores, ViewScores
+from pybossa.leaderboard.scores import WindowedScores
 
 u = User()
+load_queue = Queue('high', connection=sentinel.master)
 
 
 def get_leaderboard(top_users=20, user_id=None, window=0, info=None):
     """Return a list of top_users and if user_id return its position."""
-    materialized_view = "users_rank_%s" % info
-    sql = text('''SELECT * from users_rank WHERE rank <= :top_users 
-               ORDER BY rank;''')
-    if info:
-        sql = text('''SELECT * from {} WHERE rank <= :top_users 
-                    ORDER BY rank;'''.format(materialized_view))
-
-    results = db.session.execute(sql, dict(top_users=top_users))
-    top_users = [format_user(user) for user in results]
-
+    scores = _scores(info)
+    ranked = scores.top(top_users, info)
     if user_id:
-        sql = text('''SELECT * from users_rank where id=:user_id;''')
-        if info:
-            sql = text('''SELECT * from {} where
-                       id=:user_id;'''.format(materialized_view))
-        results = db.session.execute(sql, dict(user_id=user_id))
-        user = None
-        for row in results:
-            user = format_user(row)
-        if user and window != 0:
-            sql = text('''SELECT * from users_rank
-                       WHERE rank >= :low AND rank <= :top order by rank;
-                       ''')
-            if info:
-                sql = text('''SELECT * from {} 
-                           WHERE rank >= :low AND rank <= :top order by rank;
-                           '''.format(materialized_view))
-            low = user['rank'] - window
-            top = user['rank'] + window
-            results = db.session.execute(sql, dict(user_id=user_id,
-                                         top=top,
-                                         low=low))
-            for row in results:
-                top_users.append(format_user(row))
+        if window != 0:
+            ranked += scores.around(user_id, window, info)
         else:
-            if user:
-                top_users.append(user)
-        return top_users
-    return top_users
+            user_rank, user_score = scores.rank(user_id, info)
+            if user_rank is not None:
+                ranked.append((user_rank, user_id, user_score))
+    return _format_ranked(ranked)
+
+
+def get_rank(user_id, info=None):
+    """Return the rank and score of user_id."""
+    rank, score = _scores(info).rank(user_id, info)
+    return dict(rank=rank, score=score)
+
+
+def get_scoped_leaderboard(scope, scope_id, window='all', top_users=20):
+    """Return the top_users of a project or category in a time window."""
+    scores = WindowedScores(sentinel.master, db.session)
+    return _format_ranked(scores.top(scope, scope_id, window, top_users))
+
+
+def get_scoped_rank(scope, scope_id, user_id, window='all'):
+    """Return user_id in the leaderboard of a project or category in a time
+    window, or None if it has not contributed to it in the window."""
+    scores = WindowedScores(sentinel.master, db.session)
+    rank, score = scores.rank(scope, scope_id, window, user_id)
+    if rank is None:
+        return None
+    users = _format_ranked([(rank, user_id, score)])
+    return users[0] if users else None
+
+
+def _format_ranked(ranked):
+    users = _get_users(set(user for rank, user, score in ranked))
+    return [format_user(users[user], rank, score)
+            for rank, user, score in ranked
+            if user in users and not users[user].restrict]
+
+
+def _scores(info):
+    scores = LeaderboardScores(sentinel.master, db.session)
+    if scores.is_loaded(info):
+        return scores
+    # The scores are loaded by a worker, the view is read meanwhile
+    if scores.queue_load(info):
+        load_queue.enqueue(load_scores, info)
+    return ViewScores(sentinel.master, db.session)
+
+
+def _get_users(user_ids):
+    if not user_ids:
+        return {}
+    sql = text('''SELECT id, name, fullname, email_addr, info, created,
+               restrict FROM "user" WHERE id IN :user_ids;''')
+    results = db.session.execute(sql, dict(user_ids=tuple(user_ids)))
+    return dict((row.id, row) for row in results)
 
 
-def format_user(user):
+def format_user(user, rank, score):
     """Return an User object."""
     user = dict(
-        rank=user.rank,
+        rank=rank,
         id=user.id,
         name=user.name,
         fullname=user.fullname,
@@ -77,6 +102,6 @@ def format_user(user):
         info=user.info,
         created=user.created,
         restrict=user.restrict,
-        score=user.score)
+        score=score)
     tmp = u.to_public_json(data=user)
     return tmp
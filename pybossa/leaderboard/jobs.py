@@ -17,20 +17,25 @@
 # along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
 """Leaderboard Jobs module for running background tasks in PYBOSSA server."""
 from sqlalchemy import text
-from pybossa.core import db
+from pybossa.core import db, sentinel
 from pybossa.util import exists_materialized_view, refresh_materialized_view
+from pybossa.leaderboard.scores import LeaderboardScores, WindowedScores
 
 
 def leaderboard(info=None):
-    """Create or update leaderboard materialized view."""
+    """Create or update leaderboard materialized view and reload its scores
+    from it."""
     materialized_view = 'users_rank'
     materialized_view_idx = 'users_rank_idx'
     if info:
         materialized_view = 'users_rank_%s' % info
         materialized_view_idx = 'users_rank_%s_idx' % info
 
+    scores = LeaderboardScores(sentinel.master, db.session)
     if exists_materialized_view(db, materialized_view):
-        return refresh_materialized_view(db, materialized_view)
+        res = refresh_materialized_view(db, materialized_view)
+        scores.load(info)
+        return res
     else:
         sql = '''
                    CREATE MATERIALIZED VIEW {} AS WITH scores AS (
@@ -54,4 +59,26 @@ def leaderboard(info=None):
               '''.format(materialized_view_idx, materialized_view)
         db.session.execute(sql)
         db.session.commit()
+        scores.load(info)
         return "Materialized view created"
+
+
+def load_scores(info=None):
+    """Load the scores of a leaderboard from its materialized view."""
+    if LeaderboardScores(sentinel.master, db.session).load(info):
+        return "Leaderboard loaded"
+    return "Leaderboard being loaded"
+
+
+def windowed_leaderboard(scope, scope_id):
+    """Rebuild the leaderboards of a project or category from the DB, or
+    drop them if it no longer exists."""
+    scores = WindowedScores(sentinel.master, db.session)
+    sql = text('SELECT EXISTS (SELECT 1 FROM %s WHERE id=:scope_id);'
+               % scope)
+    if not db.session.execute(sql, dict(scope_id=scope_id)).scalar():
+        scores.reset(scope, scope_id)
+        return "Leaderboard dropped"
+    if scores.load(scope, scope_id):
+        return "Leaderboard rebuilt"
+    return "Leaderboard being rebuilt"
@@ -0,0 +1,512 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+"""Redis backed scores of the PYBOSSA leaderboards.
+
+Every leaderboard, the global one with the number of task runs of every user
+and one per LEADERBOARDS info key, is a sorted set of user ids scored as in
+its users_rank materialized view. The sorted sets are loaded from the views
+by the leaderboard jobs, or lazily when they are missing, and then updated
+from the TaskRun and User event listeners, so the ranks are always current
+and the views are only needed to rebuild and reconcile them, and to serve
+the ranks while a sorted set is being loaded.
+
+Every project and category also has leaderboards of its contributors for
+the last day, the last week and all time. They are kept as a sorted set with
+the task runs of every user in total and a sorted set per day, which are
+added up for the longer windows. They are built from the DB the first time
+they are read and rebuilt every day by the windowed_leaderboard jobs.
+
+"""
+from datetime import datetime, timedelta
+from time import sleep
+from sqlalchemy import text
+
+from pybossa.model import timestamptz_sql, timestamptz_compare_sql
+from pybossa.redis_lock import RedisLock
+
+
+class LeaderboardScores(object):
+
+    SCORES_KEY = 'pybossa:leaderboard:%s'
+    LOADED_KEY = 'pybossa:leaderboard:%s:loaded'
+    LOADING_KEY = 'pybossa:leaderboard:%s:loading:%s'
+    LOCK_KEY = 'pybossa:leaderboard:%s:lock'
+    # Updates made while a leaderboard is loaded, replayed once it is
+    UPDATES_KEY = 'pybossa:leaderboard:%s:updates'
+    # Set while a load of the leaderboard is waiting in the queue
+    QUEUED_KEY = 'pybossa:leaderboard:%s:queued'
+    # Seconds a worker may hold the lock to load a leaderboard
+    LOCK_TIMEOUT = 10 * 60
+    BATCH = 1000
+    # KEYS: scores, loaded marker, lock and updates. ARGV: user, value, mode,
+    # which is 'set' to set the score, 'incr' to increment it, 'existing' to
+    # only increment it if the user is in the leaderboard or 'remove' to
+    # remove the user, and lock timeout. Leaderboards that are not loaded
+    # are left untouched, as they are built from the DB, and the updates
+    # made while one is loaded are also recorded to be replayed on it.
+    UPDATE_SCRIPT = """
+    local member, value, mode = ARGV[1], ARGV[2], ARGV[3]
+    if redis.call('EXISTS', KEYS[3]) == 1 then
+        redis.call('RPUSH', KEYS[4], mode, value, member)
+        redis.call('EXPIRE', KEYS[4], ARGV[4])
+    end
+    if redis.call('EXISTS', KEYS[2]) == 0 then
+        return nil
+    end
+    if mode == 'set' then
+        return redis.call('ZADD', KEYS[1], value, member)
+    end
+    if mode == 'remove' then
+        return redis.call('ZREM', KEYS[1], member)
+    end
+    if mode == 'existing' and not redis.call('ZSCORE', KEYS[1], member) then
+        return nil
+    end
+    return redis.call('ZINCRBY', KEYS[1], value, member)
+    """
+    # KEYS: scores and updates. Replays the updates recorded by
+    # UPDATE_SCRIPT on the scores and drops them.
+    REPLAY_SCRIPT = """
+    local updates = redis.call('LRANGE', KEYS[2], 0, -1)
+    for i = 1, #updates, 3 do
+        local mode, value, member = updates[i], updates[i + 1], updates[i + 2]
+        if mode == 'set' then
+            redis.call('ZADD', KEYS[1], value, member)
+        elseif mode == 'remove' then
+            redis.call('ZREM', KEYS[1], member)
+        elseif mode == 'incr' or redis.call('ZSCORE', KEYS[1], member) then
+            redis.call('ZINCRBY', KEYS[1], value, member)
+        end
+    end
+    return redis.call('DEL', KEYS[2])
+    """
+
+    def __init__(self, redis_conn, session=None):
+        self.conn = redis_conn
+        self.session = session
+
+    def board(self, info=None):
+        """Return the name of the materialized view of a leaderboard."""
+        if info:
+            return 'users_rank_%s' % info
+        return 'users_rank'
+
+    def is_loaded(self, info=None):
+        return self.conn.exists(self.LOADED_KEY % self.board(info))
+
+    def load(self, info=None):
+        """Replace the scores of a leaderboard with its materialized view.
+
+        Only one worker loads a leaderboard at a time. The rest return False
+        right away, and True is returned once the scores are loaded. The
+        updates made while the view is read are replayed on the new scores.
+        """
+        board = self.board(info)
+        lock = RedisLock(self.conn, self.LOCK_KEY % board, self.LOCK_TIMEOUT)
+        if not lock.acquire():
+            return False
+        loading_key = self.LOADING_KEY % (board, lock.token)
+        updates_key = self.UPDATES_KEY % board
+        try:
+            sql = text('SELECT id, score FROM %s;' % board)
+            rows = self.session.execute(sql.execution_options(stream=True))
+            pipeline = self.conn.pipeline()
+            n_rows = 0
+            for row in rows:
+                pipeline.zadd(loading_key, row.score, row.id)
+                n_rows += 1
+                if n_rows % self.BATCH == 0:
+                    pipeline.execute()
+            if n_rows:
+                pipeline.rename(loading_key, self.SCORES_KEY % board)
+            else:
+                pipeline.delete(self.SCORES_KEY % board)
+            script = self.conn.register_script(self.REPLAY_SCRIPT)
+            script(keys=[self.SCORES_KEY % board, updates_key],
+                   client=pipeline)
+            pipeline.set(self.LOADED_KEY % board, 1)
+            pipeline.execute()
+        finally:
+            self.conn.delete(loading_key, updates_key,
+                             self.QUEUED_KEY % board)
+            lock.release()
+        return True
+
+    def queue_load(self, info=None):
+        """Return True if no load of the leaderboard is queued, marking it
+        as queued."""
+        return bool(self.conn.set(self.QUEUED_KEY % self.board(info), 1,
+                                  nx=True, ex=self.LOCK_TIMEOUT))
+
+    def incr(self, user_id, amount=1):
+        """Add amount to the score of user_id in the global leaderboard."""
+        self.incr_many({user_id: amount})
+
+    def incr_many(self, amounts):
+        """Add to the global leaderboard score of every user id in amounts
+        its amount.
+
+        Scores are only decreased for users in the leaderboard, so
+        restricted users are not added back to it.
+        """
+        pipeline = self.conn.pipeline()
+        for user_id, amount in amounts.iteritems():
+            mode = 'incr' if amount > 0 else 'existing'
+            self._update(self.board(), user_id, amount, mode, pipeline)
+        pipeline.execute()
+
+    def update_user(self, user_id, restrict, user_info, infos, n_task_runs=0):
+        """Update the scores of a new or updated user.
+
+        Restricted users are removed from every leaderboard. Otherwise the
+        user gets the score of its user_info in the leaderboard of every info
+        key in infos and is added with n_task_runs to the global one if it
+        was not in it.
+        """
+        boards = [self.board(info) for info in infos]
+        if restrict:
+            pipeline = self.conn.pipeline()
+            for board in [self.board()] + boards:
+                self._update(board, user_id, 0, 'remove', pipeline)
+            pipeline.execute()
+            return
+        for info, board in zip(infos, boards):
+            self._update(board, user_id, self._info_score(user_info, info),
+                         'set')
+        if self.conn.zscore(self.SCORES_KEY % self.board(), user_id) is None:
+            self._update(self.board(), user_id, n_task_runs, 'incr')
+
+    def top(self, n, info=None):
+        """Return the rank, user id and score of the n first users."""
+        scores = self.conn.zrevrange(self.SCORES_KEY % self.board(info), 0,
+                                     n - 1, withscores=True)
+        return self._ranked(scores, 1)
+
+    def rank(self, user_id, info=None):
+        """Return the rank and score of user_id, or Nones if it has none."""
+        key = self.SCORES_KEY % self.board(info)
+        pipeline = self.conn.pipeline()
+        pipeline.zrevrank(key, user_id)
+        pipeline.zscore(key, user_id)
+        rank, score = pipeline.execute()
+        if rank is None or score is None:
+            return None, None
+        return rank + 1, int(score)
+
+    def around(self, user_id, window, info=None):
+        """Return the users up to window ranks above and below user_id."""
+        key = self.SCORES_KEY % self.board(info)
+        rank = self.conn.zrevrank(key, user_id)
+        if rank is None:
+            return []
+        start = max(rank - window, 0)
+        scores = self.conn.zrevrange(key, start, rank + window,
+                                     withscores=True)
+        return self._ranked(scores, start + 1)
+
+    def _ranked(self, scores, first_rank):
+        return [(first_rank + i, int(user_id), int(score))
+                for i, (user_id, score) in enumerate(scores)]
+
+    def _update(self, board, user_id, value, mode, client=None):
+        script = self.conn.register_script(self.UPDATE_SCRIPT)
+        script(keys=[self.SCORES_KEY % board, self.LOADED_KEY % board,
+                     self.LOCK_KEY % board, self.UPDATES_KEY % board],
+               args=[user_id, value, mode, self.LOCK_TIMEOUT], client=client)
+
+    def _info_score(self, user_info, info):
+        try:
+            return int((user_info or {}).get(info) or 0)
+        except (TypeError, ValueError):
+            return 0
+
+
+class ViewScores(LeaderboardScores):
+
+    """Scores read from the materialized views of the leaderboards, served
+    while their sorted sets are being loaded."""
+
+    def top(self, n, info=None):
+        sql = text('''SELECT rank, id, score FROM %s WHERE rank <= :n
+                   ORDER BY rank;''' % self.board(info))
+        results = self.session.execute(sql, dict(n=n))
+        return [(row.rank, row.id, row.score) for row in results]
+
+    def rank(self, user_id, info=None):
+        sql = text('''SELECT rank, score FROM %s
+                   WHERE id=:user_id;''' % self.board(info))
+        for row in self.session.execute(sql, dict(user_id=user_id)):
+            return row.rank, row.score
+        return None, None
+
+    def around(self, user_id, window, info=None):
+        rank, score = self.rank(user_id, info)
+        if rank is None:
+            return []
+        sql = text('''SELECT rank, id, score FROM %s
+                   WHERE rank >= :low AND rank <= :top
+                   ORDER BY rank;''' % self.board(info))
+        results = self.session.execute(sql, dict(low=rank - window,
+                                                 top=rank + window))
+        return [(row.rank, row.id, row.score) for row in results]
+
+
+class WindowedScores(object):
+
+    ALL_KEY = 'pybossa:leaderboard:%s:%s:all'
+    DAY_KEY = 'pybossa:leaderboard:%s:%s:day:%s'
+    WINDOW_KEY = 'pybossa:leaderboard:%s:%s:window:%s'
+    LOADED_KEY = 'pybossa:leaderboard:%s:%s:loaded'
+    LOCK_KEY = 'pybossa:leaderboard:%s:%s:lock'
+    # Increments made while the leaderboards are loaded, replayed once they
+    # are
+    UPDATES_KEY = 'pybossa:leaderboard:%s:%s:updates'
+    # Set with the scope:scope_id of every loaded project or category
+    LOADED_SET = 'pybossa:leaderboard:windowed'
+    LOADING_SUFFIX = ':loading:%s'
+    SCOPES = ('project', 'category')
+    # Days added up for every window, all has a sorted set of its own
+    WINDOWS = dict(day=1, week=7, all=None)
+    DAYS = 7
+    DAY_TTL = (DAYS + 1) * 24 * 60 * 60
+    # Seconds a worker may hold the lock to load a leaderboard, and seconds
+    # the rest wait for the leaderboard the first time it is loaded
+    LOCK_TIMEOUT = 10 * 60
+    LOAD_WAIT = 10
+    LOAD_POLL = 0.1
+    # Seconds the sum of the days of a window is reused
+    WINDOW_TTL = 60
+    BATCH = 1000
+    SCOPE_SQL = dict(
+        project='task_run.project_id=:scope_id',
+        category='''task_run.project_id IN
+                    (SELECT id FROM project WHERE category_id=:scope_id)''')
+    # KEYS: loaded marker, lock, updates, total scores and, optionally,
+    # scores of the day. ARGV: user, amount, TTL of the day and lock
+    # timeout. Scores are only decreased for users that have them, and the
+    # increments made while the leaderboards are loaded are also recorded
+    # to be replayed on them.
+    INCR_SCRIPT = """
+    local member, amount = ARGV[1], tonumber(ARGV[2])
+    if redis.call('EXISTS', KEYS[2]) == 1 then
+        redis.call('RPUSH', KEYS[3], amount, member, KEYS[5] or '')
+        redis.call('EXPIRE', KEYS[3], ARGV[4])
+    end
+    if redis.call('EXISTS', KEYS[1]) == 0 then
+        return nil
+    end
+    for i = 4, #KEYS do
+        if amount > 0 or redis.call('ZSCORE', KEYS[i], member) then
+            redis.call('ZINCRBY', KEYS[i], amount, member)
+        end
+    end
+    if #KEYS > 4 then
+        redis.call('EXPIRE', KEYS[5], ARGV[3])
+    end
+    return 1
+    """
+    # KEYS: total scores and updates. ARGV: TTL of the days. Replays the
+    # increments recorded by INCR_SCRIPT and drops them.
+    REPLAY_SCRIPT = """
+    local updates = redis.call('LRANGE', KEYS[2], 0, -1)
+    for i = 1, #updates, 3 do
+        local amount, member = tonumber(updates[i]), updates[i + 1]
+        local keys = {KEYS[1]}
+        if updates[i + 2] ~= '' then
+            table.insert(keys, updates[i + 2])
+        end
+        for _, key in ipairs(keys) do
+            if amount > 0 or redis.call('ZSCORE', key, member) then
+                redis.call('ZINCRBY', key, amount, member)
+            end
+        end
+        if #keys > 1 then
+            redis.call('EXPIRE', keys[2], ARGV[1])
+        end
+    end
+    return redis.call('DEL', KEYS[2])
+    """
+
+    def __init__(self, redis_conn, session=None):
+        self.conn = redis_conn
+        self.session = session
+
+    def incr(self, project_id, category_id, user_id, finish_time, amount=1):
+        """Add amount to the scores of user_id for a task run of project_id
+        finished at finish_time."""
+        day = (finish_time or '')[:10]
+        recent = day in self._days(self.DAYS)
+        pipeline = self.conn.pipeline()
+        for scope, scope_id in (('project', project_id),
+                                ('category', category_id)):
+            if scope_id is None:
+                continue
+            keys = [self.LOADED_KEY % (scope, scope_id),
+                    self.LOCK_KEY % (scope, scope_id),
+                    self.UPDATES_KEY % (scope, scope_id),
+                    self.ALL_KEY % (scope, scope_id)]
+            if recent:
+                keys.append(self.DAY_KEY % (scope, scope_id, day))
+            script = self.conn.register_script(self.INCR_SCRIPT)
+            script(keys=keys, args=[user_id, amount, self.DAY_TTL,
+                                    self.LOCK_TIMEOUT], client=pipeline)
+        pipeline.execute()
+
+    def top(self, scope, scope_id, window, n):
+        """Return the rank, user id and score of the n first users."""
+        key = self._window_key(scope, scope_id, window)
+        scores = self.conn.zrevrange(key, 0, n - 1, withscores=True)
+        return [(i + 1, int(user_id), int(score))
+                for i, (user_id, score) in enumerate(scores)]
+
+    def rank(self, scope, scope_id, window, user_id):
+        """Return the rank and score of user_id, or Nones if it has none."""
+        key = self._window_key(scope, scope_id, window)
+        pipeline = self.conn.pipeline()
+        pipeline.zrevrank(key, user_id)
+        pipeline.zscore(key, user_id)
+        rank, score = pipeline.execute()
+        if rank is None or score is None:
+            return None, None
+        return rank + 1, int(score)
+
+    def reset(self, scope, scope_id):
+        """Drop the leaderboards of a project or category so they are
+        rebuilt the next time they are read."""
+        keys = [self.LOADED_KEY % (scope, scope_id),
+                self.ALL_KEY % (scope, scope_id)]
+        keys += [self.DAY_KEY % (scope, scope_id, day)
+                 for day in self._days(self.DAYS)]
+        keys += [self.WINDOW_KEY % (scope, scope_id, window)
+                 for window in self.WINDOWS]
+        pipeline = self.conn.pipeline()
+        pipeline.delete(*keys)
+        pipeline.srem(self.LOADED_SET, '%s:%s' % (scope, scope_id))
+        pipeline.execute()
+
+    def loaded(self):
+        """Return the scope and scope id of every loaded leaderboard."""
+        boards = []
+        for member in self.conn.smembers(self.LOADED_SET):
+            scope, scope_id = member.split(':')
+            boards.append((scope, int(scope_id)))
+        return boards
+
+    def load(self, scope, scope_id):
+        """Build the leaderboards of a project or category from the DB.
+
+        Only one worker loads them at a time. The rest return False right
+        away, and True is returned once they are loaded. Until then, the
+        leaderboards loaded before are still read, and the increments made
+        meanwhile are replayed on the new ones.
+        """
+        lock = RedisLock(self.conn, self.LOCK_KEY % (scope, scope_id),
+                         self.LOCK_TIMEOUT)
+        if not lock.acquire():
+            return False
+        suffix = self.LOADING_SUFFIX % lock.token
+        keys = set()
+        try:
+            self._load(scope, scope_id, suffix, keys)
+        finally:
+            self.conn.delete(self.UPDATES_KEY % (scope, scope_id),
+                             *[key + suffix for key in keys])
+            lock.release()
+        return True
+
+    def _load(self, scope, scope_id, suffix, keys):
+        where = self.SCOPE_SQL[scope]
+        sql = text('''SELECT task_run.user_id, COUNT(task_run.id) AS score
+                   FROM task_run JOIN "user" ON "user".id=task_run.user_id
+                   AND "user".restrict=false WHERE %s
+                   GROUP BY task_run.user_id;''' % where)
+        rows = self.session.execute(sql, dict(scope_id=scope_id))
+        self._load_rows(rows, suffix, keys, lambda row: self.ALL_KEY %
+                        (scope, scope_id))
+        days = self._days(self.DAYS)
+        sql = text('''SELECT task_run.user_id, COUNT(task_run.id) AS score,
+                   DATE(%s AT TIME ZONE 'UTC') AS day
+                   FROM task_run JOIN "user" ON "user".id=task_run.user_id
+                   AND "user".restrict=false WHERE %s AND %s
+                   GROUP BY task_run.user_id, day;''' % (
+            timestamptz_sql('task_run', 'finish_time', 'finished_at'), where,
+            timestamptz_compare_sql(
+                'task_run', 'finish_time', 'finished_at', '>=',
+                "CAST(:first_day AS TIMESTAMP) AT TIME ZONE 'UTC'")))
+        rows = self.session.execute(sql, dict(scope_id=scope_id,
+                                              first_day=days[-1]))
+        self._load_rows(rows, suffix, keys, lambda row: self.DAY_KEY %
+                        (scope, scope_id, row.day.isoformat()))
+        # The leaderboards are replaced at once, in a single transaction
+        pipeline = self.conn.pipeline()
+        pipeline.delete(self.ALL_KEY % (scope, scope_id),
+                        *[self.DAY_KEY % (scope, scope_id, day)
+                          for day in days])
+        pipeline.delete(*[self.WINDOW_KEY % (scope, scope_id, window)
+                          for window in self.WINDOWS])
+        for key in keys:
+            pipeline.rename(key + suffix, key)
+            if key != self.ALL_KEY % (scope, scope_id):
+                pipeline.expire(key, self.DAY_TTL)
+        script = self.conn.register_script(self.REPLAY_SCRIPT)
+        script(keys=[self.ALL_KEY % (scope, scope_id),
+                     self.UPDATES_KEY % (scope, scope_id)],
+               args=[self.DAY_TTL], client=pipeline)
+        pipeline.set(self.LOADED_KEY % (scope, scope_id), 1)
+        pipeline.sadd(self.LOADED_SET, '%s:%s' % (scope, scope_id))
+        pipeline.execute()
+
+    def _load_rows(self, rows, suffix, keys, key_of):
+        """Add the rows to the loading sorted sets of their keys and add
+        the keys to keys."""
+        pipeline = self.conn.pipeline()
+        for n_rows, row in enumerate(rows, 1):
+            keys.add(key_of(row))
+            pipeline.zadd(key_of(row) + suffix, row.score, row.user_id)
+            if n_rows % self.BATCH == 0:
+                pipeline.execute()
+        pipeline.execute()
+
+    def _window_key(self, scope, scope_id, window):
+        loaded_key = self.LOADED_KEY % (scope, scope_id)
+        if (not self.conn.exists(loaded_key) and
+                not self.load(scope, scope_id)):
+            # Another worker is loading it for the first time
+            waited = 0
+            while waited < self.LOAD_WAIT and not self.conn.exists(loaded_key):
+                sleep(self.LOAD_POLL)
+                waited += self.LOAD_POLL
+        if window == 'all':
+            return self.ALL_KEY % (scope, scope_id)
+        days = self._days(self.WINDOWS[window])
+        if len(days) == 1:
+            return self.DAY_KEY % (scope, scope_id, days[0])
+        key = self.WINDOW_KEY % (scope, scope_id, window)
+        if not self.conn.exists(key):
+            pipeline = self.conn.pipeline()
+            pipeline.zunionstore(key, [self.DAY_KEY % (scope, scope_id, day)
+                                       for day in days])
+            pipeline.expire(key, self.WINDOW_TTL)
+            pipeline.execute()
+        return key
+
+    def _days(self, n_days):
+        """Return the last n_days days, from today backwards."""
+        today = datetime.utcnow().date()
+        return [(today - timedelta(days=x)).isoformat()
+                for x in range(n_days)]
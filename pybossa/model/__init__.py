@@ -19,7 +19,9 @@
 import datetime
 import uuid
 
+from sqlalchemy import event
 from sqlalchemy.orm import class_mapper
+from sqlalchemy.schema import DDL
 
 import logging
 
@@ -94,6 +96,77 @@ def make_timestamp():
     return now.isoformat()
 
 
+def add_timestamptz_trigger(table, columns):
+    """Keep native timestamptz copies of the text timestamps of table.
+
+    columns maps every text column written with make_timestamp to the
+    timestamptz column holding its copy. A trigger sets the copies on every
+    INSERT and on every UPDATE of the text columns, so rows written with raw
+    SQL get them too; text that is not a timestamp gives NULL.
+    """
+    name = '%s_set_timestamptz' % table.name
+    event.listen(table, 'after_create', DDL(TEXT_TO_TIMESTAMPTZ))
+    event.listen(table, 'after_create',
+                 DDL(timestamptz_trigger_function(name, columns)))
+    event.listen(table, 'after_create',
+                 DDL(timestamptz_trigger(name, table.name, columns)))
+
+
+def timestamptz_trigger_function(name, columns):
+    """Return the DDL of the function of a timestamptz trigger."""
+    assignments = ' '.join('NEW.%s := text_to_timestamptz(NEW.%s);' %
+                           (copy, column)
+                           for column, copy in sorted(columns.items()))
+    return """CREATE OR REPLACE FUNCTION %s() RETURNS TRIGGER AS $$
+              BEGIN %s RETURN NEW; END;
+              $$ LANGUAGE plpgsql;""" % (name, assignments)
+
+
+def timestamptz_trigger(name, table_name, columns):
+    """Return the DDL of a timestamptz trigger, which only fires on updates
+    of the text columns."""
+    return """CREATE TRIGGER %s BEFORE INSERT OR UPDATE OF %s ON %s
+              FOR EACH ROW EXECUTE PROCEDURE %s();""" % (
+        name, ', '.join(sorted(columns)), table_name, name)
+
+
+# Text timestamps are UTC, as they are written by make_timestamp. Text that
+# is not a timestamp is filtered out by its format instead of catching the
+# error of the cast, which would open a subtransaction for every row.
+TIMESTAMP_FORMAT = ('^[0-9]{4}-(0[1-9]|1[0-2])-(0[1-9]|[12][0-9]|3[01])'
+                    '([T ]([01][0-9]|2[0-3]):[0-5][0-9]'
+                    '(:[0-5][0-9]([.][0-9]{1,6})?)?)?$')
+TEXT_TO_TIMESTAMPTZ = """
+CREATE OR REPLACE FUNCTION text_to_timestamptz(value TEXT)
+RETURNS TIMESTAMPTZ AS $$
+    SELECT CASE WHEN value ~ '%s'
+           THEN value::TIMESTAMP AT TIME ZONE 'UTC' END;
+$$ LANGUAGE sql STABLE;""" % TIMESTAMP_FORMAT
+
+
+def timestamptz_sql(table, column, copy):
+    """Return the SQL reading the timestamptz copy of a text timestamp.
+
+    Rows written before the copies existed have none until the
+    backfill_timestamps job reaches them, so their text is read instead.
+    """
+    return 'COALESCE(%s.%s, text_to_timestamptz(%s.%s))' % (table, copy,
+                                                            table, column)
+
+
+def timestamptz_compare_sql(table, column, copy, operator, value):
+    """Return the SQL comparing a text timestamp with value.
+
+    The copy is compared as it is, so its indexes are used, and the text
+    only for rows that have no copy yet.
+    """
+    return ('(%(table)s.%(copy)s %(op)s %(value)s OR '
+            '%(table)s.%(copy)s IS NULL AND '
+            'text_to_timestamptz(%(table)s.%(column)s) %(op)s %(value)s)' %
+            dict(table=table, column=column, copy=copy, op=operator,
+                 value=value))
+
+
 def make_uuid():
     return str(uuid.uuid4())
 
@@ -16,7 +16,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
 
-from sqlalchemy import Integer
+from sqlalchemy import Integer, text
 from sqlalchemy.schema import Column, ForeignKey
 from sqlalchemy.dialects.postgresql import TIMESTAMP
 from pybossa.core import db
@@ -24,7 +24,7 @@ from pybossa.model import DomainObject, make_timestamp
 
 
 class Counter(db.Model, DomainObject):
-    '''A Counter lists the number of task runs for a given Task.'''
+    '''A Counter holds the number of task runs for a given Task.'''
 
     __tablename__ = 'counter'
 
@@ -39,6 +39,22 @@ class Counter(db.Model, DomainObject):
     #: Task.ID that this counter is associated with.
     task_id = Column(Integer, ForeignKey('task.id',
                                          ondelete='CASCADE'),
-                     nullable=False)
+                     nullable=False, unique=True)
     #: Number of task_runs for this task.
     n_task_runs = Column(Integer, default=0, nullable=False)
+
+
+# The counter rows are only upserted once the migration adding this
+# constraint has run, as ON CONFLICT (task_id) needs it. Until then the
+# task runs keep appending +1/-1 rows, as they did before.
+COMPACTED_SQL = text('''SELECT EXISTS (SELECT 1 FROM pg_constraint
+                        WHERE conname='counter_task_id_key');''')
+_compacted = False
+
+
+def counters_are_compacted(conn):
+    """Return True if the counter table has a single row per task."""
+    global _compacted
+    if not _compacted:
+        _compacted = bool(conn.scalar(COMPACTED_SQL))
+    return _compacted
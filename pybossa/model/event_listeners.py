@@ -19,7 +19,8 @@ from datetime import datetime
 from flask import current_app
 
 from rq import Queue
-from sqlalchemy import event
+from sqlalchemy import event, inspect, text
+from sqlalchemy.orm import Session, object_session
 
 from flask import url_for
 
@@ -33,17 +34,25 @@ from pybossa.model.task_run import TaskRun
 from pybossa.model.webhook import Webhook
 from pybossa.model.user import User
 from pybossa.model.result import Result
-from pybossa.model.counter import Counter
+from pybossa.model.counter import Counter, counters_are_compacted
 from pybossa.core import result_repo, db
 from pybossa.jobs import webhook, notify_blog_users
 from pybossa.jobs import push_notification
 
 from pybossa.core import sentinel
+from pybossa.contributions_guard import ContributionsGuard
+from pybossa.task_queue import TaskQueue
+from pybossa.leaderboard.scores import LeaderboardScores, WindowedScores
 
 webhook_queue = Queue('high', connection=sentinel.master)
 mail_queue = Queue('email', connection=sentinel.master)
 webpush_queue = Queue('webpush', connection=sentinel.master)
 
+# Session.info key holding the callables to run after the next commit
+AFTER_COMMIT_KEY = 'pybossa_after_commit'
+# Session.info key holding the feed objects to write after the next commit
+FEED_BUFFER_KEY = 'pybossa_feed'
+
 
 @event.listens_for(Blogpost, 'after_insert')
 def add_blog_event(mapper, conn, target):
@@ -60,7 +69,7 @@ def add_blog_event(mapper, conn, target):
         tmp['info'] = r.info
     tmp = Project().to_public_json(tmp)
     obj.update(tmp)
-    update_feed(obj)
+    buffer_feed(target, obj)
     # Notify volunteers
     if current_app.config.get('DISABLE_EMAIL_NOTIFICATIONS') is None:
         scheme = current_app.config.get('PREFERRED_URL_SCHEME', 'http')
@@ -97,7 +106,7 @@ def add_project_event(mapper, conn, target):
     obj = dict(action_updated='Project')
     tmp = Project().to_public_json(tmp)
     obj.update(tmp)
-    update_feed(obj)
+    buffer_feed(target, obj)
     # Create a clean projectstats object for it
     sql_query = """INSERT INTO project_stats 
                    (project_id, n_tasks, n_task_runs, n_results, n_volunteers,
@@ -122,7 +131,7 @@ def add_task_event(mapper, conn, target):
         tmp['info'] = r.info
     tmp = Project().to_public_json(tmp)
     obj.update(tmp)
-    update_feed(obj)
+    buffer_feed(target, obj)
 
 
 @event.listens_for(User, 'after_insert')
@@ -130,45 +139,19 @@ def add_user_event(mapper, conn, target):
     """Update PYBOSSA feed with new user."""
     obj = target.to_public_json()
     obj['action_updated'] = 'User'
-    update_feed(obj)
-
-
-def add_user_contributed_to_feed(conn, user_id, project_obj):
-    if user_id is not None:
-        sql_query = ('select fullname, name, info from "user" \
-                     where id=%s and restrict=false') % user_id
-        results = conn.execute(sql_query)
-        tmp = None
-        for r in results:
-            tmp = dict(id=user_id,
-                       name=r.name,
-                       fullname=r.fullname,
-                       info=r.info)
-            tmp = User().to_public_json(tmp)
-            tmp['project_id'] = project_obj['id']
-            tmp['project_name'] = project_obj['name']
-            tmp['project_short_name'] = project_obj['short_name']
-            tmp['category_id'] = project_obj['category_id']
-            tmp['action_updated'] = 'UserContribution'
-        if tmp:
-            update_feed(tmp)
-
-
-def is_task_completed(conn, task_id, project_id):
-    sql_query = ('select count(id) from task_run \
-                 where task_run.task_id=%s and \
-                 task_run.project_id=%s') % (task_id, project_id)
-    n_answers = conn.scalar(sql_query)
-    sql_query = ('select n_answers from task \
-                 where task.id=%s') % task_id
-    task_n_answers = conn.scalar(sql_query)
-    return (n_answers) >= task_n_answers
-
-
-def update_task_state(conn, task_id):
-    sql_query = ("UPDATE task SET state=\'completed\' \
-                 where id=%s") % task_id
-    conn.execute(sql_query)
+    buffer_feed(target, obj)
+
+
+def add_user_contributed_to_feed(target, user, project_obj):
+    """Update PYBOSSA feed with a contribution of user to project_obj."""
+    if user is not None:
+        tmp = User().to_public_json(user)
+        tmp['project_id'] = project_obj['id']
+        tmp['project_name'] = project_obj['name']
+        tmp['project_short_name'] = project_obj['short_name']
+        tmp['category_id'] = project_obj['category_id']
+        tmp['action_updated'] = 'UserContribution'
+        buffer_feed(target, tmp)
 
 
 def push_webhook(project_obj, task_id, result_id):
@@ -182,80 +165,160 @@ def push_webhook(project_obj, task_id, result_id):
         webhook_queue.enqueue(webhook, project_obj['webhook'], payload)
 
 
-def create_result(conn, project_id, task_id):
-    """Create a result for the given project and task."""
-    sql_query = ("SELECT id FROM task_run WHERE project_id=%s \
-                 AND task_id=%s") % (project_id, task_id)
-    results = conn.execute(sql_query)
-    task_run_ids = ", ".join(str(tr.id) for tr in results)
-
-    sql_query = ("""SELECT id FROM result WHERE project_id=%s \
-                   AND task_id=%s;""") % (project_id, task_id)
-
-    results = conn.execute(sql_query)
-
-    for r in results:
-        if r:
-            # Update result
-            sql_query = ("""UPDATE result SET last_version=false \
-                           WHERE id=%s;""") % (r.id)
-            conn.execute(sql_query)
-
-    sql_query = """INSERT INTO result
-                   (created, project_id, task_id, task_run_ids, last_version)
-                   VALUES ('%s', %s, %s, '{%s}', %s);""" % (make_timestamp(),
-                                                  project_id,
-                                                  task_id,
-                                                  task_run_ids,
-                                                  True)
-    conn.execute(sql_query)
-
-    sql_query = """SELECT id FROM result \
-                WHERE project_id=%s \
-                AND task_id=%s \
-                AND last_version=true""" % (project_id, task_id)
+def after_commit(target, func, *args, **kwargs):
+    """Run func once the transaction that flushed target is committed."""
+    session = object_session(target)
+    session.info.setdefault(AFTER_COMMIT_KEY, []).append((func, args, kwargs))
+
+
+def buffer_feed(target, obj):
+    """Add obj to the feed once the transaction that flushed target commits.
+
+    The objects of a transaction are written to Redis in a single batch.
+    """
+    session = object_session(target)
+    session.info.setdefault(FEED_BUFFER_KEY, []).append(obj)
+
+
+@event.listens_for(Session, 'after_commit')
+def run_after_commit_hooks(session):
+    """Run the hooks of the committed transaction.
+
+    The transaction is already committed, so a hook that fails, e.g. because
+    Redis is down, is only logged instead of failing the request.
+    """
+    feed = session.info.pop(FEED_BUFFER_KEY, None)
+    if feed:
+        _run_hook(update_feed, feed, {})
+    for func, args, kwargs in session.info.pop(AFTER_COMMIT_KEY, []):
+        _run_hook(func, args, kwargs)
+
+
+def _run_hook(func, args, kwargs):
+    try:
+        func(*args, **kwargs)
+    except Exception:
+        current_app.logger.exception('After commit hook %s failed'
+                                     % getattr(func, '__name__', func))
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_after_commit_hooks(session):
+    session.info.pop(FEED_BUFFER_KEY, None)
+    session.info.pop(AFTER_COMMIT_KEY, None)
+
+
+# Bumps the counter of the task and the project timestamp and, when the task
+# reaches its n_answers, completes it and stores a new version of its result.
+# Everything is done in one round trip and the task row is only locked when
+# the task is actually completed.
+UPSERT_COUNTER_SQL = '''
+    task_counter AS (
+        INSERT INTO counter (created, project_id, task_id, n_task_runs)
+        VALUES (:now, :project_id, :task_id, 1)
+        ON CONFLICT (task_id) DO UPDATE
+        SET n_task_runs=counter.n_task_runs + 1
+        RETURNING n_task_runs)'''
+
+# Appends a counter row instead while the counter table is not compacted.
+# The statement does not see the row it inserts, so it is added to the sum.
+APPEND_COUNTER_SQL = '''
+    new_counter AS (
+        INSERT INTO counter (created, project_id, task_id, n_task_runs)
+        VALUES (:now, :project_id, :task_id, 1)
+        RETURNING n_task_runs),
+    task_counter AS (
+        SELECT new_counter.n_task_runs + COALESCE(
+            (SELECT SUM(n_task_runs) FROM counter WHERE task_id=:task_id),
+            0) AS n_task_runs
+        FROM new_counter)'''
+
+TASKRUN_SUBMIT_SQL = '''
+    WITH %s,
+    completed_task AS (
+        UPDATE task SET state='completed'
+        FROM task_counter
+        WHERE task.id=:task_id
+        AND task_counter.n_task_runs >= task.n_answers
+        RETURNING task.id),
+    old_result AS (
+        UPDATE result SET last_version=false
+        WHERE task_id=:task_id AND last_version=true
+        AND EXISTS (SELECT 1 FROM completed_task)
+        RETURNING result.id),
+    new_result AS (
+        INSERT INTO result (created, project_id, task_id, task_run_ids,
+                            last_version)
+        SELECT :now, :project_id, :task_id,
+               ARRAY(SELECT id FROM task_run WHERE task_id=:task_id
+                     ORDER BY id), true
+        FROM completed_task
+        RETURNING result.id),
+    updated_project AS (
+        UPDATE project SET updated=:now WHERE id=:project_id
+        RETURNING id, name, short_name, info, category_id, webhook)
+    SELECT updated_project.*,
+           (SELECT id FROM completed_task) AS completed_task_id,
+           (SELECT id FROM new_result) AS result_id,
+           "user".name AS user_name, "user".fullname AS user_fullname,
+           "user".info AS user_info
+    FROM updated_project LEFT OUTER JOIN "user"
+    ON "user".id=:user_id AND "user".restrict=false;'''
+
+UPSERT_SUBMIT_SQL = text(TASKRUN_SUBMIT_SQL % UPSERT_COUNTER_SQL)
+APPEND_SUBMIT_SQL = text(TASKRUN_SUBMIT_SQL % APPEND_COUNTER_SQL)
 
-    results = conn.execute(sql_query)
-    for r in results:
-        return r.id
 
 @event.listens_for(TaskRun, 'after_insert')
 def on_taskrun_submit(mapper, conn, target):
-    """Update the task.state when n_answers condition is met."""
-    # Get project details
-    sql_query = ('select name, short_name, published, webhook, info, category_id \
-                 from project where id=%s') % target.project_id
-    results = conn.execute(sql_query)
-    tmp = dict()
-    for r in results:
-        tmp['name'] = r.name
-        tmp['short_name'] = r.short_name
-        _published = r.published
-        tmp['info'] = r.info
-        _webhook = r.webhook
-        tmp['category_id'] = r.category_id
-        tmp['id'] = target.project_id
-
+    """Update counter, task state, result and project for a new task run.
+
+    The feed, webhook and task queue are only updated once the task run
+    has been committed.
+    """
+    if counters_are_compacted(conn):
+        sql = UPSERT_SUBMIT_SQL
+    else:
+        sql = APPEND_SUBMIT_SQL
+    r = conn.execute(sql,
+                     dict(now=make_timestamp(),
+                          project_id=target.project_id,
+                          task_id=target.task_id,
+                          user_id=target.user_id)).first()
+    if r is None:
+        return
+    tmp = dict(id=r.id, name=r.name, short_name=r.short_name, info=r.info,
+               category_id=r.category_id)
     project_public = dict()
     project_public.update(Project().to_public_json(tmp))
     project_public['action_updated'] = 'TaskCompleted'
 
-    add_user_contributed_to_feed(conn, target.user_id, project_public)
-    if is_task_completed(conn, target.task_id, target.project_id):
-        update_task_state(conn, target.task_id)
-        update_feed(project_public)
-        result_id = create_result(conn, target.project_id, target.task_id)
+    user = None
+    if r.user_name is not None:
+        user = dict(id=target.user_id, name=r.user_name,
+                    fullname=r.user_fullname, info=r.user_info)
+    add_user_contributed_to_feed(target, user, project_public)
+    if user is not None:
+        after_commit(target, LeaderboardScores(sentinel.master).incr,
+                     target.user_id)
+        after_commit(target, WindowedScores(sentinel.master).incr,
+                     target.project_id, r.category_id, target.user_id,
+                     target.finish_time)
+    if r.completed_task_id is not None:
+        after_commit(target, TaskQueue(sentinel.master).remove,
+                     target.project_id, target.task_id)
+        buffer_feed(target, project_public)
         project_private = dict()
         project_private.update(project_public)
-        project_private['webhook'] = _webhook
-        push_webhook(project_private, target.task_id, result_id)
+        project_private['webhook'] = r.webhook
+        after_commit(target, push_webhook, project_private, target.task_id,
+                     r.result_id)
 
 
 @event.listens_for(Blogpost, 'after_insert')
 @event.listens_for(Blogpost, 'after_update')
 @event.listens_for(Task, 'after_insert')
 @event.listens_for(Task, 'after_update')
-@event.listens_for(TaskRun, 'after_insert')
 @event.listens_for(TaskRun, 'after_update')
 def update_project(mapper, conn, target):
     """Update project updated timestamp."""
@@ -284,6 +347,8 @@ def create_zero_counter(mapper, conn, target):
     sql_query = ("insert into counter(created, project_id, task_id, n_task_runs) \
                  VALUES (TIMESTAMP '%s', %s, %s, 0)"
                  % (make_timestamp(), target.project_id, target.id))
+    if counters_are_compacted(conn):
+        sql_query += " ON CONFLICT (task_id) DO NOTHING"
     conn.execute(sql_query)
 
 
@@ -294,17 +359,87 @@ def delete_task_counter(mapper, conn, target):
     conn.execute(sql_query)
 
 
-@event.listens_for(TaskRun, 'after_insert')
-def increase_task_counter(mapper, conn, target):
-    sql_query = ("insert into counter(created, project_id, task_id, n_task_runs) \
-                 VALUES (TIMESTAMP '%s', %s, %s, 1)"
-                 % (make_timestamp(), target.project_id, target.task_id))
+@event.listens_for(TaskRun, 'after_delete')
+def decrease_task_counter(mapper, conn, target):
+    if counters_are_compacted(conn):
+        sql_query = ("update counter set n_task_runs=n_task_runs - 1 \
+                     where task_id=%s" % target.task_id)
+    else:
+        sql_query = ("insert into counter(created, project_id, task_id, n_task_runs) \
+                     VALUES (TIMESTAMP '%s', %s, %s, -1)"
+                     % (make_timestamp(), target.project_id, target.task_id))
     conn.execute(sql_query)
 
+@event.listens_for(Task, 'after_insert')
+@event.listens_for(Task, 'after_update')
+def update_task_queue(mapper, conn, target):
+    """Keep the Redis task queue of the project in sync with the task."""
+    queue = TaskQueue(sentinel.master)
+    if target.state == 'completed':
+        after_commit(target, queue.remove, target.project_id, target.id)
+    else:
+        after_commit(target, queue.push, target.project_id, target.id,
+                     target.priority_0)
+
+
+@event.listens_for(Task, 'after_delete')
+def remove_task_from_queue(mapper, conn, target):
+    after_commit(target, TaskQueue(sentinel.master).remove,
+                 target.project_id, target.id)
+
+
+@event.listens_for(TaskRun, 'after_insert')
+def add_task_to_seen(mapper, conn, target):
+    after_commit(target, TaskQueue(sentinel.master).mark_seen,
+                 target.project_id, target.task_id, target.user_id,
+                 target.user_ip, target.external_uid)
+
+
+@event.listens_for(TaskRun, 'after_insert')
+def release_task_lease(mapper, conn, target):
+    """Release the lease of the contributor once the task run is committed,
+    so a submission that fails keeps it."""
+    user = dict(user_id=target.user_id, user_ip=target.user_ip,
+                external_uid=target.external_uid)
+    after_commit(target, ContributionsGuard(sentinel.master).release,
+                 target.task_id, user)
+
 
 @event.listens_for(TaskRun, 'after_delete')
-def decrease_task_counter(mapper, conn, target):
-    sql_query = ("insert into counter(created, project_id, task_id, n_task_runs) \
-                 VALUES (TIMESTAMP '%s', %s, %s, -1)"
-                 % (make_timestamp(), target.project_id, target.task_id))
-    conn.execute(sql_query)
+def remove_task_from_seen(mapper, conn, target):
+    after_commit(target, TaskQueue(sentinel.master).unmark_seen,
+                 target.project_id, target.task_id, target.user_id,
+                 target.user_ip, target.external_uid)
+
+
+@event.listens_for(TaskRun, 'after_delete')
+def decrease_user_score(mapper, conn, target):
+    if target.user_id is not None:
+        # Taken from the session without a query when the project is loaded
+        project = target.project
+        category_id = project.category_id if project is not None else None
+        after_commit(target, LeaderboardScores(sentinel.master).incr,
+                     target.user_id, -1)
+        after_commit(target, WindowedScores(sentinel.master).incr,
+                     target.project_id, category_id, target.user_id,
+                     target.finish_time, -1)
+
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_update')
+def update_user_scores(mapper, conn, target):
+    """Keep the leaderboard scores of the user in sync with it."""
+    n_task_runs = 0
+    if not target.restrict and inspect(target).attrs.restrict.history.deleted:
+        sql = text('SELECT COUNT(id) FROM task_run WHERE user_id=:user_id')
+        n_task_runs = conn.scalar(sql, user_id=target.id)
+    infos = current_app.config.get('LEADERBOARDS') or []
+    after_commit(target, LeaderboardScores(sentinel.master).update_user,
+                 target.id, target.restrict, target.info, infos, n_task_runs)
+
+
+@event.listens_for(User, 'after_delete')
+def remove_user_scores(mapper, conn, target):
+    infos = current_app.config.get('LEADERBOARDS') or []
+    after_commit(target, LeaderboardScores(sentinel.master).update_user,
+                 target.id, True, None, infos)
@@ -17,12 +17,13 @@
 # along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
 
 from sqlalchemy import Integer, Text, Boolean
-from sqlalchemy.schema import Column, ForeignKey
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.schema import Column, FetchedValue, ForeignKey
+from sqlalchemy.dialects.postgresql import JSONB, TIMESTAMP
 from sqlalchemy.dialects.postgresql import ARRAY
 
 from pybossa.core import db
-from pybossa.model import DomainObject, make_timestamp
+from pybossa.model import (DomainObject, make_timestamp,
+                           add_timestamptz_trigger)
 
 
 class Result(db.Model, DomainObject):
@@ -30,11 +31,17 @@ class Result(db.Model, DomainObject):
     """A result associated for a task and its task runs."""
 
     __tablename__ = 'result'
+    # Read the timestamptz column set by the trigger with RETURNING
+    __mapper_args__ = {'eager_defaults': True}
 
     #: ID of the Result
     id = Column(Integer, primary_key=True)
     #: UTC timestamp for when a Result is created.
     created = Column(Text, default=make_timestamp)
+    #: created as timestamptz, set by the DB.
+    created_at = Column(TIMESTAMP(timezone=True),
+                        server_default=FetchedValue(),
+                        server_onupdate=FetchedValue())
     #: Project.id of the project associated with this Result.
     project_id = Column(Integer, ForeignKey('project.id'), nullable=False)
     #: Task.id of the task associated with this Result.
@@ -46,3 +53,6 @@ class Result(db.Model, DomainObject):
     last_version = Column(Boolean, default=True)
     #: Value of the Result.
     info = Column(JSONB)
+
+
+add_timestamptz_trigger(Result.__table__, dict(created='created_at'))
@@ -17,12 +17,14 @@
 # along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
 
 from sqlalchemy import Integer, Boolean, Float, UnicodeText, Text
-from sqlalchemy.schema import Column, ForeignKey
+from sqlalchemy import cast, func
+from sqlalchemy.schema import Column, FetchedValue, ForeignKey, Index
 from sqlalchemy.orm import relationship, backref
-from sqlalchemy.dialects.postgresql import JSONB, ARRAY
+from sqlalchemy.dialects.postgresql import JSONB, ARRAY, TIMESTAMP
 from sqlalchemy.ext.mutable import MutableList
 from pybossa.core import db
-from pybossa.model import DomainObject, make_timestamp
+from pybossa.model import (DomainObject, make_timestamp,
+                           add_timestamptz_trigger)
 from pybossa.model.task_run import TaskRun
 
 
@@ -31,12 +33,18 @@ class Task(db.Model, DomainObject):
     associated to a project.
     '''
     __tablename__ = 'task'
+    # Read the timestamptz columns set by the trigger with RETURNING
+    __mapper_args__ = {'eager_defaults': True}
 
 
     #: Task.ID
     id = Column(Integer, primary_key=True)
     #: UTC timestamp when the task was created.
     created = Column(Text, default=make_timestamp)
+    #: created as timestamptz, set by the DB.
+    created_at = Column(TIMESTAMP(timezone=True),
+                        server_default=FetchedValue(),
+                        server_onupdate=FetchedValue())
     #: Project.ID that this task is associated with.
     project_id = Column(Integer, ForeignKey('project.id', ondelete='CASCADE'), nullable=False)
     #: Task.state: ongoing or completed.
@@ -62,3 +70,14 @@ class Task(db.Model, DomainObject):
             return float(len(self.task_runs)) / self.n_answers
         else:  # pragma: no cover
             return float(0)
+
+
+# Hash of the info of the tasks of a project, used to find duplicated tasks
+# when importing without comparing whole JSONB documents
+Index('task_project_id_info_md5_idx', Task.project_id,
+      func.md5(cast(Task.info, Text)))
+
+
+add_timestamptz_trigger(Task.__table__, dict(created='created_at'))
+# Tasks of every project created in a time window, e.g. for the dashboard
+Index('task_created_at_brin_idx', Task.created_at, postgresql_using='brin')
@@ -17,11 +17,12 @@
 # along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
 
 from sqlalchemy import Integer, Text
-from sqlalchemy.schema import Column, ForeignKey
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.schema import Column, FetchedValue, ForeignKey, Index
+from sqlalchemy.dialects.postgresql import JSONB, TIMESTAMP
 
 from pybossa.core import db
-from pybossa.model import DomainObject, make_timestamp
+from pybossa.model import (DomainObject, make_timestamp,
+                           add_timestamptz_trigger)
 
 
 
@@ -29,6 +30,8 @@ class TaskRun(db.Model, DomainObject):
     '''A run of a given task by a specific user.
     '''
     __tablename__ = 'task_run'
+    # Read the timestamptz columns set by the trigger with RETURNING
+    __mapper_args__ = {'eager_defaults': True}
 
     #: ID of the TaskRun
     id = Column(Integer, primary_key=True)
@@ -45,6 +48,14 @@ class TaskRun(db.Model, DomainObject):
     user_ip = Column(Text)
     #: UTC timestamp for when TaskRun is saved to DB.
     finish_time = Column(Text, default=make_timestamp)
+    #: created as timestamptz, set by the DB.
+    created_at = Column(TIMESTAMP(timezone=True),
+                        server_default=FetchedValue(),
+                        server_onupdate=FetchedValue())
+    #: finish_time as timestamptz, set by the DB.
+    finished_at = Column(TIMESTAMP(timezone=True),
+                         server_default=FetchedValue(),
+                         server_onupdate=FetchedValue())
     timeout = Column(Integer)
     calibration = Column(Integer)
     #: External User ID
@@ -58,3 +69,13 @@ class TaskRun(db.Model, DomainObject):
             whatever information should be recorded -- up to task presenter
         }
     '''
+
+
+add_timestamptz_trigger(TaskRun.__table__, dict(created='created_at',
+                                                finish_time='finished_at'))
+# Answers of a project in a time window, e.g. for its stats
+Index('task_run_project_id_finished_at_idx', TaskRun.project_id,
+      TaskRun.finished_at)
+# Answers of every project in a time window, e.g. for the site stats
+Index('task_run_finished_at_brin_idx', TaskRun.finished_at,
+      postgresql_using='brin')
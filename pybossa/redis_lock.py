@@ -0,0 +1,61 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+"""Redis lock held by a single worker for a limited time.
+
+The lock stores a random token, so a worker whose lock expired while it was
+still working does not release the lock another worker got meanwhile.
+
+"""
+from uuid import uuid4
+
+
+class RedisLock(object):
+
+    # KEYS: lock. ARGV: token of the worker releasing it.
+    RELEASE_SCRIPT = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('DEL', KEYS[1])
+    end
+    return 0
+    """
+
+    def __init__(self, redis_conn, key, timeout):
+        self.conn = redis_conn
+        self.key = key
+        self.timeout = timeout
+        self.token = None
+
+    def acquire(self):
+        """Return True if the lock was free and is now held by this one."""
+        token = uuid4().hex
+        if not self.conn.set(self.key, token, nx=True, ex=self.timeout):
+            return False
+        self.token = token
+        return True
+
+    def release(self):
+        """Release the lock if it is still held by this one."""
+        if self.token is None:
+            return
+        script = self.conn.register_script(self.RELEASE_SCRIPT)
+        script(keys=[self.key], args=[self.token])
+        self.token = None
+
+    def is_locked(self):
+        """Return True if some worker holds the lock."""
+        return bool(self.conn.exists(self.key))
@@ -42,13 +42,21 @@ import re
 from pybossa.model.project import Project, TaskRun, Task
 from pybossa.model.announcement import Announcement
 from pybossa.model.project_stats import ProjectStats
-from sqlalchemy.sql import and_, or_
+from sqlalchemy.sql import and_, or_, tuple_
 from sqlalchemy import cast, Text, func, desc
 from sqlalchemy.types import TIMESTAMP
 from sqlalchemy.orm.base import _entity_descriptor
 
 class Repository(object):
 
+    # Rows fetched at a time by yielded queries, whatever their limit
+    YIELD_PER = 1000
+    # Native timestamptz copies of text timestamps, used to sort by them.
+    # Rows that have no copy yet, as they predate it and were not backfilled,
+    # are sorted by their text.
+    TIMESTAMPTZ_COLUMNS = dict(created='created_at',
+                               finish_time='finished_at')
+
     def __init__(self, db, language='english'):
         self.db = db
         self.language = language
@@ -181,31 +189,75 @@ class Repository(object):
             query = query.order_by('rank DESC')
         return query
 
+    def _orderby_column(self, model, orderby):
+        """Return the expression used to sort by the orderby column."""
+        if self._timestamptz_column(model, orderby):
+            return func.coalesce(
+                getattr(model, self.TIMESTAMPTZ_COLUMNS[orderby]),
+                func.text_to_timestamptz(getattr(model, orderby)))
+        if orderby in ['created', 'updated', 'finish_time']:
+            return cast(getattr(model, orderby), TIMESTAMP)
+        return getattr(model, orderby)
+
+    def _orderby_value(self, model, orderby, value):
+        """Return the expression comparing value with the orderby column."""
+        if self._timestamptz_column(model, orderby):
+            return func.text_to_timestamptz(value)
+        if orderby in ['created', 'updated', 'finish_time']:
+            return cast(value, TIMESTAMP)
+        return value
+
+    def _timestamptz_column(self, model, orderby):
+        return hasattr(model, self.TIMESTAMPTZ_COLUMNS.get(orderby, ''))
+
+    def _keyset_clause(self, model, last_id, descending, orderby):
+        """Return the clause selecting the rows after last_id.
+
+        last_id is either the id of the last row of the previous page, when
+        sorting by ascending id, or a (value, id) pair with the orderby value
+        and the id of that row. As in PostgreSQL, NULL values sort last in
+        ascending order and first in descending order.
+        """
+        if not isinstance(last_id, (tuple, list)):
+            return model.id > last_id
+        value, row_id = last_id
+        if orderby == 'id':
+            return model.id < row_id if descending else model.id > row_id
+        column = self._orderby_column(model, orderby)
+        if value is None:
+            after_id = model.id < row_id if descending else model.id > row_id
+            same_value = and_(column == None, after_id)
+            if descending:
+                return or_(same_value, column != None)
+            return same_value
+        keys = tuple_(column, model.id)
+        last = tuple_(self._orderby_value(model, orderby, value), row_id)
+        if descending:
+            return keys < last
+        return or_(keys > last, column == None)
+
     def _set_orderby_desc(self, query, model, limit,
                           last_id, offset, descending, orderby):
         """Return an updated query with the proper orderby and desc."""
         if orderby == 'fav_user_ids':
             n_favs = func.coalesce(func.array_length(model.fav_user_ids, 1), 0).label('n_favs')
             query = query.add_column(n_favs)
-        if orderby in ['created', 'updated', 'finish_time']:
             if descending:
-                query = query.order_by(desc(
-                                            cast(getattr(model,
-                                                         orderby),
-                                                 TIMESTAMP)))
+                query = query.order_by(desc("n_favs"))
             else:
-                query = query.order_by(cast(getattr(model, orderby), TIMESTAMP))
+                query = query.order_by("n_favs")
         else:
-            if orderby != 'fav_user_ids':
-                if descending:
-                    query = query.order_by(desc(getattr(model, orderby)))
-                else:
-                    query = query.order_by(getattr(model, orderby))
+            column = self._orderby_column(model, orderby)
+            if descending:
+                query = query.order_by(desc(column))
             else:
+                query = query.order_by(column)
+            # Break ties by id, so keyset pages are stable
+            if orderby != 'id':
                 if descending:
-                    query = query.order_by(desc("n_favs"))
+                    query = query.order_by(desc(model.id))
                 else:
-                    query = query.order_by("n_favs")
+                    query = query.order_by(model.id)
         if last_id:
             query = query.limit(limit)
         else:
@@ -219,15 +271,12 @@ class Repository(object):
         """Filter by using several arguments and ordering items."""
         query = self.create_context(filters, fulltextsearch, model)
         if last_id:
-            query = query.filter(model.id > last_id)
-            query = self._set_orderby_desc(query, model, limit,
-                                           last_id, offset, desc, orderby)
-        else:
-            query = self._set_orderby_desc(query, model, limit,
-                                           last_id, offset, desc, orderby)
+            query = query.filter(self._keyset_clause(model, last_id, desc,
+                                                     orderby))
+        query = self._set_orderby_desc(query, model, limit,
+                                       last_id, offset, desc, orderby)
         if yielded:
-            limit = limit or 1
-            return query.yield_per(limit)
+            return query.yield_per(self.YIELD_PER)
         return query.all()
 
 
@@ -146,6 +146,7 @@ class ProjectRepository(Repository):
 
     def _delete_zip_files_from_store(self, project):
         from pybossa.core import json_exporter, csv_exporter
+        from pybossa.core import parquet_exporter
         global uploader
         if uploader is None:
             from pybossa.core import uploader
@@ -153,8 +154,14 @@ class ProjectRepository(Repository):
         csv_tasks_filename = csv_exporter.download_name(project, 'task')
         json_taskruns_filename = json_exporter.download_name(project, 'task_run')
         csv_taskruns_filename = csv_exporter.download_name(project, 'task_run')
+        parquet_tasks_filename = parquet_exporter.download_name(project, 'task')
+        parquet_taskruns_filename = parquet_exporter.download_name(project,
+                                                                   'task_run')
         container = "user_%s" % project.owner_id
         uploader.delete_file(json_tasks_filename, container)
         uploader.delete_file(csv_tasks_filename, container)
         uploader.delete_file(json_taskruns_filename, container)
         uploader.delete_file(csv_taskruns_filename, container)
+        uploader.delete_file(parquet_tasks_filename, container)
+        uploader.delete_file(parquet_taskruns_filename, container)
+        json_exporter.reset_spools(project.id)
@@ -45,6 +45,15 @@ class ResultRepository(Repository):
                               fulltextsearch,
                               desc, **filters)
 
+    def filter_last_versions_by_task_ids(self, task_ids):
+        """Return the last version of the results of the given tasks."""
+        if not task_ids:
+            return []
+        return self.db.session.query(Result)\
+                   .filter(Result.task_id.in_(task_ids),
+                           Result.last_version == True)\
+                   .order_by(Result.id).all()
+
     def update(self, result):
         self._validate_can_be('updated', result)
         try:
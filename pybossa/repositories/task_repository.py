@@ -16,20 +16,35 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
 
+import json
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy import cast, Date
 
 from pybossa.repositories import Repository
 from pybossa.model.task import Task
 from pybossa.model.task_run import TaskRun
+from pybossa.model.counter import Counter
+from pybossa.model.project import Project
+from pybossa.model import make_timestamp
 from pybossa.exc import WrongObjectError, DBIntegrityError
 from pybossa.cache import projects as cached_projects
-from pybossa.core import uploader
+from pybossa.core import uploader, sentinel
+from pybossa.task_queue import TaskQueue
+from pybossa.stats_rollup import StatsRollup
+from pybossa.leaderboard.scores import LeaderboardScores, WindowedScores
+from pybossa.feed import update_feed
 from sqlalchemy import text
+from itertools import islice
 
 
 class TaskRepository(Repository):
 
+    # Task attributes that can be given to bulk_save
+    BULK_COLUMNS = ('info', 'state', 'priority_0', 'n_answers', 'quorum',
+                    'calibration')
+    # Number of tasks inserted by each multi-row INSERT of bulk_save
+    BULK_CHUNK = 1000
+
     # Methods for queries on Task objects
     def get_task(self, id):
         return self.db.session.query(Task).get(id)
@@ -46,6 +61,31 @@ class TaskRepository(Repository):
         return self._filter_by(Task, limit, offset, yielded, last_id,
                               fulltextsearch, desc, **filters)
 
+    def get_tasks_by_ids(self, task_ids):
+        """Return the tasks with the given ids."""
+        if not task_ids:
+            return []
+        return self.db.session.query(Task).filter(Task.id.in_(task_ids)).all()
+
+    def find_existing_infos(self, project_id, infos):
+        """Return the positions of infos already used by tasks of project.
+
+        The infos are compared by the md5 hash of their JSONB text, which is
+        indexed, with a single query for all of them.
+        """
+        if not infos:
+            return set()
+        sql = text('''SELECT new.i - 1 AS position
+                   FROM jsonb_array_elements(CAST(:infos AS jsonb))
+                   WITH ORDINALITY AS new(info, i)
+                   WHERE EXISTS (SELECT 1 FROM task
+                   WHERE task.project_id=:project_id
+                   AND md5(task.info::text)=md5(new.info::text)
+                   AND task.info=new.info)''')
+        rows = self.db.session.execute(sql, dict(project_id=project_id,
+                                                 infos=json.dumps(infos)))
+        return set(row.position for row in rows)
+
     def count_tasks_with(self, **filters):
         query_args, _, _, _  = self.generate_query_from_keywords(Task, **filters)
         return self.db.session.query(Task).filter(*query_args).count()
@@ -90,6 +130,14 @@ class TaskRepository(Repository):
                               fulltextsearch, desc, **filters)
 
 
+    def filter_task_runs_by_task_ids(self, task_ids):
+        """Return the task runs of the given tasks sorted by id."""
+        if not task_ids:
+            return []
+        return self.db.session.query(TaskRun)\
+                   .filter(TaskRun.task_id.in_(task_ids))\
+                   .order_by(TaskRun.id).all()
+
     def count_task_runs_with(self, **filters):
         query_args, _, _, _ = self.generate_query_from_keywords(TaskRun, **filters)
         return self.db.session.query(TaskRun).filter(*query_args).count()
@@ -106,12 +154,55 @@ class TaskRepository(Repository):
             self.db.session.rollback()
             raise DBIntegrityError(e)
 
+    def bulk_save(self, project_id, tasks, chunk_size=None, progress=None):
+        """Create the tasks of a project from an iterable of dicts.
+
+        Tasks and their counters are inserted in chunks with multi-row
+        INSERTs, bypassing the per task event listeners, and committed in a
+        single transaction. Then the feed gets one event for all of them and
+        the caches and task queue of the project are refreshed once.
+        progress is called with the number of tasks inserted after each chunk.
+        Returns the number of tasks created.
+        """
+        chunk_size = chunk_size or self.BULK_CHUNK
+        tasks = iter(tasks)
+        n = 0
+        try:
+            while True:
+                chunk = list(islice(tasks, chunk_size))
+                if not chunk:
+                    break
+                self._insert_tasks(project_id, chunk)
+                n += len(chunk)
+                if progress is not None:
+                    progress(n)
+            if n:
+                sql = text('''UPDATE project SET updated=:updated
+                           WHERE id=:project_id''')
+                self.db.session.execute(sql, dict(updated=make_timestamp(),
+                                                  project_id=project_id))
+            self.db.session.commit()
+        except IntegrityError as e:
+            self.db.session.rollback()
+            raise DBIntegrityError(e)
+        except Exception:
+            self.db.session.rollback()
+            raise
+        if n:
+            self._add_bulk_task_event(project_id, n)
+            cached_projects.clean_project(project_id)
+            TaskQueue(sentinel.master).reset(project_id)
+        return n
+
     def update(self, element):
         self._validate_can_be('updated', element)
         try:
             self.db.session.merge(element)
             self.db.session.commit()
             cached_projects.clean_project(element.project_id)
+            if isinstance(element, TaskRun):
+                from pybossa.core import json_exporter
+                json_exporter.reset_spools(element.project_id)
         except IntegrityError as e:
             self.db.session.rollback()
             raise DBIntegrityError(e)
@@ -121,28 +212,51 @@ class TaskRepository(Repository):
         project = element.project
         self.db.session.commit()
         cached_projects.clean_project(element.project_id)
+        StatsRollup(sentinel.master).reset(element.project_id)
         self._delete_zip_files_from_store(project)
 
     def delete_valid_from_project(self, project):
         """Delete only tasks that have no results associated."""
-        sql = text('''
-                   DELETE FROM task WHERE task.project_id=:project_id
+        valid = '''task.project_id=:project_id
                    AND task.id NOT IN
                    (SELECT task_id FROM result
-                   WHERE result.project_id=:project_id GROUP BY result.task_id);
-                   ''')
+                   WHERE result.project_id=:project_id GROUP BY result.task_id)'''
+        sql = text('''
+                   SELECT task_run.user_id, COUNT(task_run.id) AS n_task_runs
+                   FROM task_run JOIN task ON task.id=task_run.task_id
+                   WHERE %s AND task_run.user_id IS NOT NULL
+                   GROUP BY task_run.user_id;
+                   ''' % valid)
+        scores = self.db.session.execute(sql, dict(project_id=project.id))
+        scores = dict((row.user_id, -row.n_task_runs) for row in scores)
+        sql = text('''
+                   DELETE FROM task WHERE %s;
+                   ''' % valid)
         self.db.session.execute(sql, dict(project_id=project.id))
         self.db.session.commit()
+        LeaderboardScores(sentinel.master).incr_many(scores)
+        self._reset_windowed_scores(project)
         cached_projects.clean_project(project.id)
+        TaskQueue(sentinel.master).reset(project.id)
+        StatsRollup(sentinel.master).reset(project.id)
         self._delete_zip_files_from_store(project)
 
     def delete_taskruns_from_project(self, project):
         sql = text('''
-                   DELETE FROM task_run WHERE project_id=:project_id;
+                   WITH deleted AS (
+                   DELETE FROM task_run WHERE project_id=:project_id
+                   RETURNING user_id)
+                   SELECT user_id, COUNT(*) AS n_task_runs FROM deleted
+                   WHERE user_id IS NOT NULL GROUP BY user_id;
                    ''')
-        self.db.session.execute(sql, dict(project_id=project.id))
+        scores = self.db.session.execute(sql, dict(project_id=project.id))
+        scores = dict((row.user_id, -row.n_task_runs) for row in scores)
         self.db.session.commit()
+        LeaderboardScores(sentinel.master).incr_many(scores)
+        self._reset_windowed_scores(project)
         cached_projects.clean_project(project.id)
+        TaskQueue(sentinel.master).reset(project.id, seen=True)
+        StatsRollup(sentinel.master).reset(project.id)
         self._delete_zip_files_from_store(project)
 
     def update_tasks_redundancy(self, project, n_answer):
@@ -168,6 +282,38 @@ class TaskRepository(Repository):
         self.db.session.execute(sql, dict(n_answers=n_answer, project_id=project.id))
         self.db.session.commit()
         cached_projects.clean_project(project.id)
+        TaskQueue(sentinel.master).reset(project.id)
+
+    def _insert_tasks(self, project_id, chunk):
+        columns = Task.__table__.c
+        rows = []
+        for data in chunk:
+            row = dict(project_id=project_id)
+            for name in self.BULK_COLUMNS:
+                default = columns[name].default
+                row[name] = data.get(name, default.arg if default else None)
+            rows.append(row)
+        insert = Task.__table__.insert().values(rows).returning(columns.id)
+        task_ids = [r.id for r in self.db.session.execute(insert)]
+        created = make_timestamp()
+        counters = [dict(created=created, project_id=project_id,
+                         task_id=task_id, n_task_runs=0)
+                    for task_id in task_ids]
+        self.db.session.execute(Counter.__table__.insert().values(counters))
+
+    def _add_bulk_task_event(self, project_id, n_tasks):
+        sql = text('''SELECT name, short_name, info FROM project
+                   WHERE id=:project_id''')
+        row = self.db.session.execute(sql,
+                                      dict(project_id=project_id)).first()
+        if row is None:
+            return
+        obj = Project().to_public_json(dict(id=project_id, name=row.name,
+                                            short_name=row.short_name,
+                                            info=row.info))
+        obj['action_updated'] = 'Task'
+        obj['n_tasks'] = n_tasks
+        update_feed(obj)
 
     def _validate_can_be(self, action, element):
         if not isinstance(element, Task) and not isinstance(element, TaskRun):
@@ -181,8 +327,14 @@ class TaskRepository(Repository):
         inst = self.db.session.query(table).filter(table.id==element.id).first()
         self.db.session.delete(inst)
 
+    def _reset_windowed_scores(self, project):
+        scores = WindowedScores(sentinel.master)
+        scores.reset('project', project.id)
+        scores.reset('category', project.category_id)
+
     def _delete_zip_files_from_store(self, project):
         from pybossa.core import json_exporter, csv_exporter
+        from pybossa.core import parquet_exporter
         global uploader
         if uploader is None:
             from pybossa.core import uploader
@@ -190,8 +342,14 @@ class TaskRepository(Repository):
         csv_tasks_filename = csv_exporter.download_name(project, 'task')
         json_taskruns_filename = json_exporter.download_name(project, 'task_run')
         csv_taskruns_filename = csv_exporter.download_name(project, 'task_run')
+        parquet_tasks_filename = parquet_exporter.download_name(project, 'task')
+        parquet_taskruns_filename = parquet_exporter.download_name(project,
+                                                                   'task_run')
         container = "user_%s" % project.owner_id
         uploader.delete_file(json_tasks_filename, container)
         uploader.delete_file(csv_tasks_filename, container)
         uploader.delete_file(json_taskruns_filename, container)
         uploader.delete_file(csv_taskruns_filename, container)
+        uploader.delete_file(parquet_tasks_filename, container)
+        uploader.delete_file(parquet_taskruns_filename, container)
+        json_exporter.reset_spools(project.id)
@@ -83,14 +83,21 @@ class UserRepository(Repository):
             raise DBIntegrityError(e)
 
     def fake_user_id(self, user):
+        from pybossa.core import json_exporter
         faker = Faker()
         cp = CryptoPAn(current_app.config.get('CRYPTOPAN_KEY'))
+        project_ids = [row.project_id for row in
+                       self.db.session.query(TaskRun.project_id)
+                       .filter_by(user_id=user.id).distinct()]
         task_runs = self.db.session.query(TaskRun).filter_by(user_id=user.id)
         for tr in task_runs:
             tr.user_id = None
             tr.user_ip = cp.anonymize(faker.ipv4())
             self.db.session.merge(tr)
             self.db.session.commit()
+        # The exported task runs still have the user id
+        for project_id in project_ids:
+            json_exporter.reset_spools(project_id)
 
     def delete(self, user):
         self._validate_can_be('deleted', user)
@@ -16,18 +16,28 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
 """Scheduler module for PYBOSSA tasks."""
+from flask import current_app
 from sqlalchemy.sql import func, desc
 from sqlalchemy import and_
 from pybossa.model import DomainObject
 from pybossa.model.task import Task
 from pybossa.model.task_run import TaskRun
-from pybossa.model.counter import Counter
-from pybossa.core import db
+from pybossa.model.counter import Counter, counters_are_compacted
+from pybossa.core import db, sentinel
+from pybossa.task_queue import TaskQueue
+from pybossa.contributions_guard import ContributionsGuard
 import random
 
 
 session = db.slave_session
 
+# Schedulers that only hand out tasks which still need answers, so every
+# task they return is leased to at most n_answers - n_task_runs users.
+LEASED_SCHEDULERS = ['default', 'breadth_first', 'depth_first',
+                     'incremental', 'task_queue']
+# Extra candidates fetched to replace tasks whose leases are all taken.
+LEASE_LOOKAHEAD = 10
+
 
 def new_task(project_id, sched, user_id=None, user_ip=None,
              external_uid=None, offset=0, limit=1, orderby='priority_0', desc=True):
@@ -37,9 +47,46 @@ def new_task(project_id, sched, user_id=None, user_ip=None,
         'breadth_first': get_breadth_first_task,
         'depth_first': get_depth_first_task,
         'incremental': get_incremental_task,
-        'depth_first_all': get_depth_first_all_task}
-    scheduler = sched_map.get(sched, sched_map['default'])
-    return scheduler(project_id, user_id, user_ip, external_uid, offset=offset, limit=limit, orderby=orderby, desc=desc)
+        'depth_first_all': get_depth_first_all_task,
+        'task_queue': get_task_queue_task}
+    if sched not in sched_map:
+        sched = 'default'
+    scheduler = sched_map[sched]
+    if sched not in LEASED_SCHEDULERS:
+        return scheduler(project_id, user_id, user_ip, external_uid,
+                         offset=offset, limit=limit, orderby=orderby,
+                         desc=desc)
+    tasks = scheduler(project_id, user_id, user_ip, external_uid,
+                      offset=offset, limit=limit + LEASE_LOOKAHEAD,
+                      orderby=orderby, desc=desc)
+    user = dict(user_id=user_id, user_ip=user_ip, external_uid=external_uid)
+    return reserve_tasks(tasks, user, limit)
+
+
+def reserve_tasks(tasks, user, limit):
+    """Return up to limit tasks from tasks that could be leased to user."""
+    if not tasks:
+        return tasks
+    guard = ContributionsGuard(sentinel.master,
+                               current_app.config.get('TASK_LEASE_TIMEOUT'))
+    task_ids = [task.id for task in tasks]
+    query = session.query(Counter.task_id, _counter_n_task_runs())\
+                   .filter(Counter.task_id.in_(task_ids))
+    if not counters_are_compacted(session):
+        query = query.group_by(Counter.task_id)
+    n_task_runs = dict(query.all())
+    n_available = [(task.n_answers or 0) - n_task_runs.get(task.id, 0)
+                   for task in tasks]
+    granted = guard.reserve_many(tasks, user, n_available, limit=limit)
+    return [task for task, leased in zip(tasks, granted) if leased]
+
+
+def _counter_n_task_runs():
+    """Return the number of task runs of a task in the counter table, which
+    has +1/-1 rows per task until they are compacted."""
+    if counters_are_compacted(session):
+        return Counter.n_task_runs
+    return func.sum(Counter.n_task_runs)
 
 
 def get_breadth_first_task(project_id, user_id=None, user_ip=None,
@@ -61,11 +108,13 @@ def get_breadth_first_task(project_id, user_id=None, user_ip=None,
                                                                 external_uid=external_uid)
 
     tmp = project_query.except_(subquery)
-    query = session.query(Task, func.sum(Counter.n_task_runs).label('n_task_runs'))\
+    n_task_runs = _counter_n_task_runs()
+    query = session.query(Task, n_task_runs)\
                    .filter(Task.id==Counter.task_id)\
-                   .filter(Counter.task_id.in_(tmp))\
-                   .group_by(Task.id)\
-                   .order_by('n_task_runs ASC')\
+                   .filter(Counter.task_id.in_(tmp))
+    if not counters_are_compacted(session):
+        query = query.group_by(Task.id)
+    query = query.order_by(n_task_runs.asc())
 
     query = _set_orderby_desc(query, orderby, desc)
     data = query.limit(limit).offset(offset).all()
@@ -114,8 +163,7 @@ def get_incremental_task(project_id, user_id=None, user_ip=None,
     last_task_run = q.first()
     if last_task_run:
         task.info['last_answer'] = last_task_run.info
-        # TODO: As discussed in GitHub #53
-        # it is necessary to create a lock in the task!
+    # The task is locked by new_task through a ContributionsGuard lease
     return [task]
 
 
@@ -146,10 +194,34 @@ def get_candidate_task_ids(project_id, user_id=None, user_ip=None,
     return _handle_tuples(data)
 
 
+def get_task_queue_task(project_id, user_id=None, user_ip=None,
+                        external_uid=None, offset=0, limit=1,
+                        orderby='priority_0', desc=True):
+    """Get a new task for a given project from its Redis task queue.
+
+    It returns the same tasks as the depth first scheduler, but the candidates
+    are read from a per project sorted set ordered by priority_0, so the
+    orderby and desc arguments are ignored.
+    """
+    queue = TaskQueue(sentinel.master, session)
+    task_ids = queue.get_tasks(project_id, user_id, user_ip, external_uid,
+                               limit=limit, offset=offset)
+    if not task_ids:
+        return []
+    tasks = session.query(Task).filter(Task.id.in_(task_ids),
+                                       Task.state != 'completed').all()
+    tasks = dict((task.id, task) for task in tasks)
+    for task_id in task_ids:
+        if task_id not in tasks:
+            queue.remove(project_id, task_id)
+    return [tasks[task_id] for task_id in task_ids if task_id in tasks]
+
+
 def sched_variants():
     return [('default', 'Default'), ('breadth_first', 'Breadth First'),
             ('depth_first', 'Depth First'),
             ('depth_first_all', 'Depth First All'),
+            ('task_queue', 'Task Queue'),
             ]
 
 
@@ -0,0 +1,250 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+"""Redis rollups of the answers of every project for its statistics.
+
+For every project and day it keeps:
+    * a hash with the number of answers of authenticated and anonymous
+      users, in total and per hour of the day,
+    * a sorted set per kind of user with the number of answers of each
+      user,
+    * a HyperLogLog per kind of user to count the distinct volunteers of
+      several days at once,
+and a sorted set with the day of the last answer to every task.
+
+The rollups are updated with the task runs saved since the last update, so
+the statistics of a project for the last DAYS days are assembled from a few
+keys instead of scanning the task_run table.
+
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from pybossa.redis_lock import RedisLock
+
+
+class StatsRollup(object):
+
+    DAY_KEY = 'pybossa:stats:project:%s:day:%s'
+    USERS_KEY = 'pybossa:stats:project:%s:day:%s:users:%s'
+    VOLUNTEERS_KEY = 'pybossa:stats:project:%s:day:%s:volunteers:%s'
+    LAST_DAY_KEY = 'pybossa:stats:project:%s:last_day'
+    LAST_ID_KEY = 'pybossa:stats:project:%s:last_id'
+    RECENT_KEY = 'pybossa:stats:project:%s:recent'
+    LOCK_KEY = 'pybossa:stats:project:%s:lock'
+    UNION_KEY = 'pybossa:stats:project:%s:union:%s'
+    KINDS = ('auth', 'anon')
+    # Days kept, i.e. the longest period the stats can be assembled for
+    DAYS = 60
+    TTL = (DAYS + 1) * 24 * 60 * 60
+    # Ids are assigned before the task runs are committed, so the ones up
+    # to OVERLAP below the last id read are read again in case one of them
+    # was committed after it.
+    OVERLAP = 10000
+    BATCH = 1000
+    # Seconds a worker may hold the lock to sync the rollups of a project
+    LOCK_TIMEOUT = 10 * 60
+    # Authenticated users returned by users, as every anonymous one is
+    TOP_AUTH = 5
+
+    def __init__(self, redis_conn, session=None):
+        self.conn = redis_conn
+        self.session = session
+
+    def sync(self, project_id):
+        """Add to the rollups the task runs saved since the last sync.
+
+        Only one worker syncs a project at a time, as two of them would add
+        the same task runs twice. The rest return False right away and use
+        the rollups as they are.
+        """
+        lock = RedisLock(self.conn, self.LOCK_KEY % project_id,
+                         self.LOCK_TIMEOUT)
+        if not lock.acquire():
+            return False
+        try:
+            self._sync(project_id)
+        finally:
+            lock.release()
+        return True
+
+    def _sync(self, project_id):
+        last_id = self.conn.get(self.LAST_ID_KEY % project_id)
+        if last_id is None:
+            self.reset(project_id)
+            last_id = 0
+        last_id = int(last_id)
+        first_day = self._days(self.DAYS)[-1]
+        sql = text('''SELECT id, task_id, user_id, user_ip, finish_time
+                   FROM task_run WHERE project_id=:project_id
+                   AND id>:since AND finish_time>=:first_day
+                   ORDER BY id;''').execution_options(stream=True)
+        since = max(last_id - self.OVERLAP, 0)
+        rows = self.session.execute(sql, dict(project_id=project_id,
+                                              since=since,
+                                              first_day=first_day))
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == self.BATCH:
+                last_id = self._add_batch(project_id, batch, last_id)
+                batch = []
+        if batch:
+            last_id = self._add_batch(project_id, batch, last_id)
+        pipeline = self.conn.pipeline()
+        pipeline.set(self.LAST_ID_KEY % project_id, last_id, ex=self.TTL)
+        pipeline.zremrangebyscore(self.RECENT_KEY % project_id, '-inf',
+                                  last_id - self.OVERLAP)
+        pipeline.zremrangebyscore(self.LAST_DAY_KEY % project_id, '-inf',
+                                  self._ordinal(first_day) - 1)
+        pipeline.expire(self.RECENT_KEY % project_id, self.TTL)
+        pipeline.expire(self.LAST_DAY_KEY % project_id, self.TTL)
+        pipeline.execute()
+
+    def dates(self, project_id, n_days):
+        """Return the answers per day of the last n_days days.
+
+        As pybossa.cache.project_stats.stats_dates, it returns the number of
+        tasks whose last answer was given every day, and the number of
+        anonymous and authenticated answers every day.
+        """
+        days = self._days(n_days)
+        last_day_key = self.LAST_DAY_KEY % project_id
+        pipeline = self.conn.pipeline()
+        for day in days:
+            pipeline.hmget(self.DAY_KEY % (project_id, day), *self.KINDS)
+        for day in days:
+            ordinal = self._ordinal(day)
+            pipeline.zcount(last_day_key, ordinal, ordinal)
+        results = pipeline.execute()
+        dates = dict(zip(days, results[n_days:]))
+        dates_anon = {}
+        dates_auth = {}
+        for day, (auth, anon) in zip(days, results[:n_days]):
+            dates_auth[day] = int(auth or 0)
+            dates_anon[day] = int(anon or 0)
+        return dates, dates_anon, dates_auth
+
+    def hours(self, project_id, n_days):
+        """Return the answers per hour of the day of the last n_days days,
+        with the same values as pybossa.cache.project_stats.stats_hours."""
+        pipeline = self.conn.pipeline()
+        for day in self._days(n_days):
+            pipeline.hgetall(self.DAY_KEY % (project_id, day))
+        hours = {}
+        hours_anon = {}
+        hours_auth = {}
+        for i in range(0, 24):
+            hours[str(i).zfill(2)] = 0
+            hours_anon[str(i).zfill(2)] = 0
+            hours_auth[str(i).zfill(2)] = 0
+        by_kind = dict(auth=hours_auth, anon=hours_anon)
+        for record in pipeline.execute():
+            for field, count in record.iteritems():
+                if ':' in field:
+                    kind, hour = field.split(':')
+                    by_kind[kind][hour] += int(count)
+                    hours[hour] += int(count)
+        return (hours, hours_anon, hours_auth,
+                max(hours.values()) or None,
+                max(hours_anon.values()) or None,
+                max(hours_auth.values()) or None)
+
+    def users(self, project_id, n_days):
+        """Return the volunteers of the last n_days days, with the same
+        values as pybossa.cache.project_stats.stats_users.
+
+        The number of distinct volunteers is estimated with HyperLogLog.
+        """
+        days = self._days(n_days)
+        pipeline = self.conn.pipeline()
+        for kind in self.KINDS:
+            union_key = self.UNION_KEY % (project_id, kind)
+            pipeline.zunionstore(union_key,
+                                 [self.USERS_KEY % (project_id, day, kind)
+                                  for day in days])
+            end = self.TOP_AUTH - 1 if kind == 'auth' else -1
+            pipeline.zrevrange(union_key, 0, end, withscores=True)
+            pipeline.delete(union_key)
+            pipeline.execute_command('PFCOUNT', *[
+                self.VOLUNTEERS_KEY % (project_id, day, kind)
+                for day in days])
+        results = pipeline.execute()
+        auth_users = [[int(user_id), int(n_tasks)]
+                      for user_id, n_tasks in results[1]]
+        anon_users = [[user_ip, int(n_tasks)]
+                      for user_ip, n_tasks in results[5]]
+        users = dict(n_auth=results[3], n_anon=results[7])
+        return users, anon_users, auth_users
+
+    def reset(self, project_id):
+        """Drop the rollups of a project so they are rebuilt on the next
+        sync."""
+        keys = [self.LAST_ID_KEY % project_id, self.RECENT_KEY % project_id,
+                self.LAST_DAY_KEY % project_id]
+        for day in self._days(self.DAYS):
+            keys.append(self.DAY_KEY % (project_id, day))
+            for kind in self.KINDS:
+                keys.append(self.USERS_KEY % (project_id, day, kind))
+                keys.append(self.VOLUNTEERS_KEY % (project_id, day, kind))
+        self.conn.delete(*keys)
+
+    def _add_batch(self, project_id, rows, last_id):
+        recent_key = self.RECENT_KEY % project_id
+        old = [row for row in rows if row.id <= last_id]
+        if old:
+            pipeline = self.conn.pipeline()
+            for row in old:
+                pipeline.zscore(recent_key, row.id)
+            added = set(row.id for row, score in
+                        zip(old, pipeline.execute()) if score is not None)
+            rows = [row for row in rows if row.id not in added]
+        pipeline = self.conn.pipeline()
+        keys = set()
+        for row in rows:
+            day = row.finish_time[:10]
+            hour = row.finish_time[11:13] or '00'
+            kind = 'auth' if row.user_ip is None else 'anon'
+            user = row.user_id if kind == 'auth' else row.user_ip
+            day_key = self.DAY_KEY % (project_id, day)
+            pipeline.hincrby(day_key, kind, 1)
+            pipeline.hincrby(day_key, '%s:%s' % (kind, hour), 1)
+            keys.add(day_key)
+            if user is not None:
+                users_key = self.USERS_KEY % (project_id, day, kind)
+                volunteers_key = self.VOLUNTEERS_KEY % (project_id, day, kind)
+                pipeline.zincrby(users_key, user, 1)
+                pipeline.execute_command('PFADD', volunteers_key, user)
+                keys.update([users_key, volunteers_key])
+            pipeline.zadd(self.LAST_DAY_KEY % project_id,
+                          self._ordinal(day), row.task_id)
+            pipeline.zadd(recent_key, row.id, row.id)
+            last_id = max(last_id, row.id)
+        for key in keys:
+            pipeline.expire(key, self.TTL)
+        pipeline.execute()
+        return last_id
+
+    def _days(self, n_days):
+        """Return the last n_days days, from today backwards."""
+        today = datetime.utcnow().date()
+        return [(today - timedelta(days=x)).isoformat()
+                for x in range(n_days)]
+
+    def _ordinal(self, day):
+        return datetime.strptime(day, '%Y-%m-%d').toordinal()
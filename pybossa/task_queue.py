@@ -0,0 +1,205 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2017 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+"""Redis backed task queue for the PYBOSSA scheduler.
+
+For every project it keeps:
+    * a sorted set with the ids of the open tasks scored by priority_0,
+    * a set per user with the ids of the tasks the user has already
+      contributed to.
+
+Both structures are built lazily from the DB the first time they are needed
+and then updated incrementally from the Task and TaskRun event listeners, so
+handing out a task never has to scan the task_run table.
+
+"""
+from sqlalchemy import text
+
+
+class TaskQueue(object):
+
+    QUEUE_KEY = 'pybossa:sched:project:%s:tasks'
+    LOADED_KEY = 'pybossa:sched:project:%s:loaded'
+    SEEN_KEY = 'pybossa:sched:project:%s:seen:%s:%s'
+    # Bumped to discard every seen set of a project at once
+    GENERATION_KEY = 'pybossa:sched:project:%s:generation'
+    # Member added to a seen set once it has been loaded from the DB
+    SEEN_LOADED = 'loaded'
+    QUEUE_TTL = 7 * 24 * 60 * 60
+    SEEN_TTL = 24 * 60 * 60
+    # Queue entries checked by every call of SCAN_SCRIPT, which keeps Redis
+    # from being blocked for long by users that have seen many tasks
+    SCAN = 1000
+    BATCH = 1000
+
+    # KEYS: queue, seen set. ARGV: number of tasks wanted, first rank and
+    # number of ranks to check. Returns the next rank to check, or -1 once
+    # the queue is exhausted, followed by the unseen task ids found.
+    SCAN_SCRIPT = """
+    local wanted = tonumber(ARGV[1])
+    local start = tonumber(ARGV[2])
+    local window = redis.call('ZREVRANGE', KEYS[1], start,
+                              start + tonumber(ARGV[3]) - 1)
+    local result = {-1}
+    for i, task_id in ipairs(window) do
+        if redis.call('SISMEMBER', KEYS[2], task_id) == 0 then
+            table.insert(result, task_id)
+            if #result > wanted then
+                result[1] = start + i
+                return result
+            end
+        end
+    end
+    if #window == tonumber(ARGV[3]) then
+        result[1] = start + #window
+    end
+    return result
+    """
+
+    def __init__(self, redis_conn, session=None):
+        self.conn = redis_conn
+        self.session = session
+
+    def get_tasks(self, project_id, user_id=None, user_ip=None,
+                  external_uid=None, limit=1, offset=0):
+        """Return the ids of the highest priority tasks not seen by user.
+
+        The queue is walked in priority order on the Redis side, so the cost
+        grows with the tasks the user has already seen among the highest
+        priority ones, not with the size of the queue.
+        """
+        self._ensure_queue(project_id)
+        seen_key = self._ensure_seen(project_id, user_id, user_ip,
+                                     external_uid)
+        script = self.conn.register_script(self.SCAN_SCRIPT)
+        keys = [self.QUEUE_KEY % project_id, seen_key]
+        wanted = limit + offset
+        task_ids = []
+        start = 0
+        while start >= 0 and len(task_ids) < wanted:
+            result = script(keys=keys, args=[wanted - len(task_ids), start,
+                                             self.SCAN])
+            start = int(result[0])
+            task_ids.extend(int(task_id) for task_id in result[1:])
+        return task_ids[offset:wanted]
+
+    def push(self, project_id, task_id, priority_0):
+        """Add or re-score a task in its project queue."""
+        if self.is_loaded(project_id):
+            self.conn.zadd(self.QUEUE_KEY % project_id, priority_0 or 0,
+                           task_id)
+
+    def remove(self, project_id, task_id):
+        """Remove a task from its project queue."""
+        if self.is_loaded(project_id):
+            self.conn.zrem(self.QUEUE_KEY % project_id, task_id)
+
+    def mark_seen(self, project_id, task_id, user_id=None, user_ip=None,
+                  external_uid=None):
+        """Register that a contributor has seen a task."""
+        key = self._seen_key(project_id, user_id, user_ip, external_uid)
+        if self.conn.exists(key):
+            self.conn.sadd(key, task_id)
+
+    def unmark_seen(self, project_id, task_id, user_id=None, user_ip=None,
+                    external_uid=None):
+        """Forget that a contributor has seen a task."""
+        key = self._seen_key(project_id, user_id, user_ip, external_uid)
+        self.conn.srem(key, task_id)
+
+    def is_loaded(self, project_id):
+        return self.conn.exists(self.LOADED_KEY % project_id)
+
+    def reset(self, project_id, seen=False):
+        """Drop the project queue so it is rebuilt on the next request.
+
+        When seen is True the seen sets of the project are discarded too.
+        """
+        pipeline = self.conn.pipeline()
+        pipeline.delete(self.LOADED_KEY % project_id,
+                        self.QUEUE_KEY % project_id)
+        if seen:
+            pipeline.incr(self.GENERATION_KEY % project_id)
+        pipeline.execute()
+
+    def _ensure_queue(self, project_id):
+        queue_key = self.QUEUE_KEY % project_id
+        loaded_key = self.LOADED_KEY % project_id
+        if not self.conn.exists(loaded_key):
+            sql = text('''SELECT id, priority_0 FROM task
+                       WHERE project_id=:project_id
+                       AND state!='completed';''')
+            rows = self.session.execute(sql, dict(project_id=project_id))
+            pipeline = self.conn.pipeline()
+            pipeline.delete(queue_key)
+            self._zadd_rows(pipeline, queue_key, rows)
+            pipeline.set(loaded_key, 1)
+            pipeline.execute()
+        pipeline = self.conn.pipeline()
+        pipeline.expire(queue_key, self.QUEUE_TTL)
+        pipeline.expire(loaded_key, self.QUEUE_TTL)
+        pipeline.execute()
+
+    def _ensure_seen(self, project_id, user_id, user_ip, external_uid):
+        key = self._seen_key(project_id, user_id, user_ip, external_uid)
+        if not self.conn.sismember(key, self.SEEN_LOADED):
+            column, value = self._contributor(user_id, user_ip, external_uid)
+            sql = text('''SELECT task_id FROM task_run
+                       WHERE project_id=:project_id
+                       AND %s=:value;''' % column)
+            rows = self.session.execute(sql, dict(project_id=project_id,
+                                                  value=value))
+            pipeline = self.conn.pipeline()
+            pipeline.sadd(key, self.SEEN_LOADED)
+            task_ids = []
+            for row in rows:
+                task_ids.append(row.task_id)
+                if len(task_ids) == self.BATCH:
+                    pipeline.sadd(key, *task_ids)
+                    task_ids = []
+            if task_ids:
+                pipeline.sadd(key, *task_ids)
+            pipeline.execute()
+        self.conn.expire(key, self.SEEN_TTL)
+        return key
+
+    def _zadd_rows(self, pipeline, key, rows):
+        args = []
+        for row in rows:
+            args.extend([row.priority_0 or 0, row.id])
+            if len(args) == 2 * self.BATCH:
+                pipeline.zadd(key, *args)
+                args = []
+        if args:
+            pipeline.zadd(key, *args)
+
+    def _seen_key(self, project_id, user_id, user_ip, external_uid):
+        column, value = self._contributor(user_id, user_ip, external_uid)
+        generation = self.conn.get(self.GENERATION_KEY % project_id) or 0
+        return self.SEEN_KEY % (project_id, generation,
+                                '%s:%s' % (column, value))
+
+    def _contributor(self, user_id, user_ip, external_uid):
+        """Return the task_run column and value identifying a contributor.
+
+        It follows the same precedence as pybossa.sched.get_candidate_task_ids.
+        """
+        if user_id and not user_ip and not external_uid:
+            return 'user_id', user_id
+        if external_uid:
+            return 'external_uid', external_uid
+        return 'user_ip', user_ip or '127.0.0.1'
@@ -285,6 +285,26 @@ def unicode_csv_reader(unicode_csv_data, dialect=csv.excel, **kwargs):
         yield [unicode(cell, 'utf-8') for cell in row]
 
 
+def iter_decoded_lines(chunks, encoding='utf-8'):
+    """Decode an iterable of byte chunks and yield its lines one by one.
+
+    Chunks may split lines and multi-byte characters anywhere. Lines end
+    with '\\n' only, as when iterating over a file, so they can be fed to a
+    CSV reader without holding the whole content in memory.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    pending = u''
+    for chunk in chunks:
+        pending += decoder.decode(chunk)
+        lines = pending.split(u'\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + u'\n'
+    pending += decoder.decode('', final=True)
+    if pending:
+        yield pending
+
+
 def utf_8_encoder(unicode_csv_data):
     """UTF8 encoder for CSV data."""
     # This code is taken from http://docs.python.org/library/csv.html#examples
@@ -35,7 +35,8 @@ from rq import Queue
 import pybossa.sched as sched
 
 from pybossa.core import (uploader, signer, sentinel, json_exporter,
-                          csv_exporter, importer, sentinel, db, anonymizer)
+                          csv_exporter, parquet_exporter, importer, sentinel,
+                          db, anonymizer)
 from pybossa.model import make_uuid
 from pybossa.model.project import Project
 from pybossa.model.category import Category
@@ -58,10 +59,11 @@ from pybossa.ckan import Ckan
 from pybossa.extensions import misaka
 from pybossa.cookies import CookieHandler
 from pybossa.password_manager import ProjectPasswdManager
-from pybossa.jobs import import_tasks, webhook
+from pybossa.jobs import import_tasks_in_chunks, webhook
 from pybossa.forms.projects_view_forms import *
 from pybossa.forms.admin_view_forms import SearchForm
 from pybossa.importers import BulkImportException
+from pybossa.importers.progress import ImportProgress
 from pybossa.pro_features import ProFeatureHandler
 
 from pybossa.core import (project_repo, user_repo, task_repo, blog_repo,
@@ -700,13 +702,44 @@ def _import_tasks(project, **form_data):
         report = importer.create_tasks(task_repo, project.id, **form_data)
         flash(report.message)
     else:
-        importer_queue.enqueue(import_tasks, project.id, **form_data)
+        importer_queue.enqueue(import_tasks_in_chunks, project.id, **form_data)
         flash(gettext("You're trying to import a large amount of tasks, so please be patient.\
             You will receive an email when the tasks are ready."))
     return redirect_content_type(url_for('.tasks',
                                          short_name=project.short_name))
 
 
+@blueprint.route('/<short_name>/tasks/import/progress')
+@login_required
+def import_progress(short_name):
+    """Return the progress of the last background import of tasks."""
+    project, owner, ps = project_by_shortname(short_name)
+    ensure_authorized_to('update', project)
+    record = ImportProgress(sentinel.master, project.id).get()
+    if record is None:
+        return abort(404)
+    # The import parameters may hold credentials of the source
+    record.pop('form_data')
+    return Response(json.dumps(record), mimetype='application/json')
+
+
+@blueprint.route('/<short_name>/tasks/import/resume', methods=['POST'])
+@login_required
+def resume_import(short_name):
+    """Resume the last background import of tasks if it did not finish."""
+    project, owner, ps = project_by_shortname(short_name)
+    ensure_authorized_to('update', project)
+    record = ImportProgress(sentinel.master, project.id).get()
+    if record is None or record['state'] == 'finished':
+        return abort(404)
+    importer_queue.enqueue(import_tasks_in_chunks, project.id,
+                           from_auto=record['from_auto'],
+                           **record['form_data'])
+    flash(gettext("The import of your tasks has been resumed."))
+    return redirect_content_type(url_for('.tasks',
+                                         short_name=project.short_name))
+
+
 @blueprint.route('/<short_name>/tasks/autoimporter', methods=['GET', 'POST'])
 @login_required
 def setup_autoimporter(short_name):
@@ -1124,6 +1157,12 @@ def export_to(short_name):
         res = csv_exporter.response_zip(project, ty)
         return res
 
+    def respond_parquet(ty):
+        if ty not in supported_tables:
+            return abort(404)
+        res = parquet_exporter.response_zip(project, ty)
+        return res
+
     def create_ckan_datastore(ckan, table, package_id, records):
         new_resource = ckan.resource_create(name=table,
                                             package_id=package_id)
@@ -1189,7 +1228,7 @@ def export_to(short_name):
         finally:
             return respond()
 
-    export_formats = ["json", "csv"]
+    export_formats = ["json", "csv", "parquet"]
     if current_user.is_authenticated():
         if current_user.ckan_api:
             export_formats.append('ckan')
@@ -1215,7 +1254,7 @@ def export_to(short_name):
             ensure_authorized_to('read', task_run)
 
     return {"json": respond_json, "csv": respond_csv,
-            'ckan': respond_ckan}[fmt](ty)
+            "parquet": respond_parquet, 'ckan': respond_ckan}[fmt](ty)
 
 
 @blueprint.route('/<short_name>/stats')
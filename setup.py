@@ -56,6 +56,7 @@ requirements = [
     "readability-lxml>=0.6.2, <1.0",
     "pybossa-onesignal",
     "pandas>=0.20.2, <0.20.3",
+    "pyarrow>=0.9.0, <0.17",
     "flatten-json",
     "otpauth>=1.0.1, <1.0.2",
     "Flask-SimpleLDAP >=1.1.2, <1.1.3",
@@ -74,11 +74,14 @@ def delete_indexes():
 
 def delete_materialized_views():
     """Delete materialized views."""
-    sql = text('''SELECT relname
-               FROM pg_class WHERE relname LIKE '%dashboard%';''')
-    results = db.session.execute(sql)
+    kinds = dict(m='materialized view', v='view', r='table')
+    sql = text('''SELECT relname, relkind
+               FROM pg_class WHERE relname LIKE '%dashboard%'
+               AND relkind IN ('m', 'v', 'r');''')
+    results = db.session.execute(sql).fetchall()
     for row in results:
-        sql = 'drop materialized view if exists %s cascade' % row.relname
+        sql = 'drop %s if exists %s cascade' % (kinds[row.relkind],
+                                                row.relname)
         db.session.execute(sql)
         db.session.commit()
     sql = text('''SELECT relname
@@ -106,6 +109,7 @@ class Test(object):
         with self.flask_app.app_context():
             rebuild_db()
             reset_all_pk_sequences()
+            sentinel.master.flushall()
             leaderboard()
 
     def app_get_json(self, url, follow_redirects=False, headers=None):
@@ -474,6 +478,11 @@ class FakeResponse(object):
     def __init__(self, **kwargs):
         self.__dict__.update(**kwargs)
 
+    def iter_content(self, chunk_size=1, decode_unicode=False):
+        content = self.text.encode(self.encoding)
+        for i in range(0, len(content), chunk_size):
+            yield content[i:i + chunk_size]
+
 
 def mock_contributions_guard(stamped=True, timestamp='2015-11-18T16:29:25.496327'):
     fake_guard_instance = MagicMock()
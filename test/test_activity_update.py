@@ -15,7 +15,12 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+import json
+import cPickle as pickle
 from default import Test, with_context
+from mock import patch
+from pybossa.core import sentinel
+from pybossa import feed
 from pybossa.view.account import get_update_feed
 
 from factories import ProjectFactory, TaskFactory, TaskRunFactory, UserFactory, BlogpostFactory
@@ -113,3 +118,31 @@ class TestActivityFeed(Test):
         update_feed = get_update_feed()
         err_msg = "There should be at max 100 updates."
         assert len(update_feed) == 100, err_msg
+
+    @with_context
+    @patch('pybossa.feed.FEED_MAX_SIZE', 3)
+    def test_feed_is_trimmed(self):
+        """Test ACTIVITY FEED keeps only the most recent updates."""
+        feed.update_feed(*[dict(id=i, action_updated='Project') for i in range(5)])
+
+        updates = get_update_feed()
+        assert [u['id'] for u in updates] == [4, 3, 2], updates
+        assert sentinel.master.zcard(feed.FEED_KEY) == 3
+
+    @with_context
+    def test_feed_is_stored_as_json(self):
+        """Test ACTIVITY FEED stores compact JSON."""
+        feed.update_feed(dict(id=1, action_updated='Project'))
+
+        data = sentinel.master.zrange(feed.FEED_KEY, 0, -1)
+        assert json.loads(data[0]) == dict(id=1, action_updated='Project')
+
+    @with_context
+    def test_feed_reads_pickled_updates(self):
+        """Test ACTIVITY FEED reads updates stored before JSON."""
+        obj = dict(id=1, action_updated='Project')
+        sentinel.master.zadd(feed.FEED_KEY, 1, pickle.dumps(obj))
+
+        updates = get_update_feed()
+        assert updates[0]['id'] == 1, updates
+        assert updates[0]['action_updated'] == 'Project', updates
@@ -0,0 +1,116 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+import json
+from datetime import datetime, timedelta
+from default import with_context
+from test_api import TestAPI
+
+from factories import (ProjectFactory, TaskFactory, TaskRunFactory,
+                       UserFactory, CategoryFactory)
+
+
+class TestLeaderboardAPI(TestAPI):
+
+    @with_context
+    def test_project_leaderboard(self):
+        """Test API project leaderboard returns its top contributors"""
+        project = ProjectFactory.create()
+        task = TaskFactory.create(project=project)
+        leader, second = UserFactory.create_batch(2)
+        TaskRunFactory.create_batch(2, task=task, user=leader)
+        TaskRunFactory.create(task=task, user=second)
+        TaskRunFactory.create_batch(3, user=second)
+
+        url = '/api/project/%s/leaderboard' % project.id
+        data = json.loads(self.app.get(url).data)
+
+        assert data['window'] == 'all', data
+        assert data['user'] is None, data
+        assert [u['name'] for u in data['top_users']] == [leader.name,
+                                                           second.name]
+        assert [u['score'] for u in data['top_users']] == [2, 1], data
+        assert [u['rank'] for u in data['top_users']] == [1, 2], data
+
+    @with_context
+    def test_project_leaderboard_windows(self):
+        """Test API project leaderboard counts only the window task runs"""
+        project = ProjectFactory.create()
+        task = TaskFactory.create(project=project)
+        user = UserFactory.create()
+        for days in (0, 3, 10):
+            finish_time = datetime.utcnow() - timedelta(days=days)
+            TaskRunFactory.create(task=task, user=user,
+                                  finish_time=finish_time.isoformat())
+
+        scores = {}
+        for window in ('day', 'week', 'all'):
+            url = '/api/project/%s/leaderboard?window=%s&api_key=%s' % (
+                project.id, window, user.api_key)
+            data = json.loads(self.app.get(url).data)
+            scores[window] = data['user']['score']
+
+        assert scores == dict(day=1, week=2, all=3), scores
+
+    @with_context
+    def test_category_leaderboard(self):
+        """Test API category leaderboard adds up its projects"""
+        category = CategoryFactory.create()
+        projects = ProjectFactory.create_batch(2, category=category)
+        user = UserFactory.create()
+        for project in projects:
+            task = TaskFactory.create(project=project)
+            TaskRunFactory.create(task=task, user=user)
+        TaskRunFactory.create(user=user)
+
+        url = '/api/category/%s/leaderboard?limit=1' % category.id
+        data = json.loads(self.app.get(url).data)
+
+        assert len(data['top_users']) == 1, data
+        assert data['top_users'][0]['score'] == 2, data
+
+    @with_context
+    def test_leaderboard_limit_is_clamped(self):
+        """Test API leaderboard limit is kept from 1 to 100"""
+        project = ProjectFactory.create()
+        task = TaskFactory.create(project=project)
+        TaskRunFactory.create_batch(2, task=task)
+
+        for limit, n_users in (('0', 1), ('-5', 1), ('500', 2)):
+            url = '/api/project/%s/leaderboard?limit=%s' % (project.id, limit)
+            data = json.loads(self.app.get(url).data)
+            assert len(data['top_users']) == n_users, (limit, data)
+
+    @with_context
+    def test_leaderboard_errors(self):
+        """Test API leaderboard errors"""
+        project = ProjectFactory.create()
+
+        res = self.app.get('/api/project/%s/leaderboard?window=year'
+                           % project.id)
+        err = json.loads(res.data)
+        assert res.status_code == 400, res.status_code
+        assert err['exception_cls'] == 'BadRequest', err
+
+        res = self.app.get('/api/project/%s/leaderboard?limit=ten'
+                           % project.id)
+        err = json.loads(res.data)
+        assert res.status_code == 400, res.status_code
+        assert err['exception_cls'] == 'BadRequest', err
+
+        res = self.app.get('/api/category/9999/leaderboard')
+        assert res.status_code == 404, res.status_code
@@ -911,7 +911,9 @@ class TestProjectAPI(TestAPI):
         expected = [call('1_project1_task_json.zip', 'user_1'),
                     call('1_project1_task_csv.zip', 'user_1'),
                     call('1_project1_task_run_json.zip', 'user_1'),
-                    call('1_project1_task_run_csv.zip', 'user_1')]
+                    call('1_project1_task_run_csv.zip', 'user_1'),
+                    call('1_project1_task_parquet.zip', 'user_1'),
+                    call('1_project1_task_run_parquet.zip', 'user_1')]
         assert uploader.delete_file.call_args_list == expected
 
     @with_context
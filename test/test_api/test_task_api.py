@@ -431,6 +431,32 @@ class TestTaskAPI(TestAPI):
         assert len(data) == 1, data
         assert 'stats' not in data[0].keys()
 
+    @with_context
+    def test_task_query_related_loads_relations_in_batch(self):
+        """Test API Task query related loads task runs and results at once"""
+        from pybossa.core import task_repo as core_task_repo
+        project = ProjectFactory.create()
+        tasks = TaskFactory.create_batch(3, project=project, n_answers=2)
+        TaskRunFactory.create_batch(2, project=project, task=tasks[0])
+        TaskRunFactory.create(project=project, task=tasks[1])
+
+        with patch.object(core_task_repo, 'filter_task_runs_by_task_ids',
+                          wraps=core_task_repo.filter_task_runs_by_task_ids) as batch:
+            with patch.object(core_task_repo, 'filter_task_runs_by') as single:
+                res = self.app.get('/api/task?project_id=%s&related=True'
+                                   % project.id)
+        data = dict((t['id'], t) for t in json.loads(res.data))
+
+        assert batch.call_count == 1, batch.call_count
+        assert not single.called
+        assert len(data[tasks[0].id]['task_runs']) == 2, data
+        assert data[tasks[0].id]['result']['task_id'] == tasks[0].id, data
+        assert len(data[tasks[1].id]['task_runs']) == 1, data
+        assert data[tasks[1].id]['result'] is None, data
+        assert data[tasks[2].id]['task_runs'] == [], data
+        runs = data[tasks[0].id]['task_runs']
+        assert runs[0]['id'] < runs[1]['id'], runs
+
     @with_context
     def test_task_query_without_params_with_context(self):
         """ Test API Task query with context"""
@@ -616,6 +642,48 @@ class TestTaskAPI(TestAPI):
             assert item['project_id'] == project_oc.id, item
 
 
+    @with_context
+    def test_task_bulk_post(self):
+        """Test API Task bulk creation from JSON and NDJSON"""
+        owner, non_owner = UserFactory.create_batch(2)
+        project = ProjectFactory.create(owner=owner)
+        url = '/api/project/%s/tasks/bulk?api_key=%s'
+        tasks = [dict(info=dict(n=i), n_answers=3) for i in range(3)]
+
+        res = self.app.post(url % (project.id, non_owner.api_key),
+                            data=json.dumps(tasks))
+        assert res.status_code == 403, res.data
+
+        res = self.app.post(url % (project.id, owner.api_key),
+                            data=json.dumps(tasks))
+        data = json.loads(res.data)
+        assert data['created'] == 3, data
+
+        lines = '\n'.join(json.dumps(dict(info=dict(n=i))) for i in range(2))
+        res = self.app.post(url % (project.id, owner.api_key), data=lines,
+                            content_type='application/x-ndjson')
+        data = json.loads(res.data)
+        assert data['created'] == 2, data
+
+        saved = task_repo.filter_tasks_by(project_id=project.id)
+        assert len(saved) == 5, saved
+
+    @with_context
+    def test_task_bulk_post_rejects_reserved_keys(self):
+        """Test API Task bulk creation does not create any task on bad input"""
+        owner = UserFactory.create()
+        project = ProjectFactory.create(owner=owner)
+        tasks = [dict(info=dict(n=1)), dict(info=dict(n=2), state='completed')]
+
+        res = self.app.post('/api/project/%s/tasks/bulk?api_key=%s'
+                            % (project.id, owner.api_key),
+                            data=json.dumps(tasks))
+        err = json.loads(res.data)
+
+        assert res.status_code == 400, err
+        assert err['exception_cls'] == 'BadRequest', err
+        assert task_repo.filter_tasks_by(project_id=project.id) == []
+
     @with_context
     def test_task_post(self):
         """Test API Task creation"""
@@ -917,7 +985,9 @@ class TestTaskAPI(TestAPI):
         expected = [call('1_project1_task_json.zip', 'user_1'),
                     call('1_project1_task_csv.zip', 'user_1'),
                     call('1_project1_task_run_json.zip', 'user_1'),
-                    call('1_project1_task_run_csv.zip', 'user_1')]
+                    call('1_project1_task_run_csv.zip', 'user_1'),
+                    call('1_project1_task_parquet.zip', 'user_1'),
+                    call('1_project1_task_run_parquet.zip', 'user_1')]
         assert uploader.delete_file.call_args_list == expected
 
     @with_context
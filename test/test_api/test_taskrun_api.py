@@ -250,6 +250,89 @@ class TestTaskrunAPI(TestAPI):
         assert data[0]['id'] == task_runs[5].id, data[0]['id']
 
 
+    def _next_link(self, res):
+        link = res.headers.get('Link')
+        if link is None:
+            return None
+        return link.split(';')[0].strip('<>')
+
+    @with_context
+    def test_query_taskrun_cursor_pagination(self):
+        """Test API query for taskrun follows next cursors in any order."""
+        project = ProjectFactory.create()
+        task_runs = TaskRunFactory.create_batch(7, project=project)
+        # Ties in created are broken by id
+        for task_run in task_runs[2:4]:
+            task_run.created = task_runs[2].created
+        task_repo.update(task_runs[2])
+        task_repo.update(task_runs[3])
+
+        for orderby, desc in [('id', 'false'), ('id', 'true'),
+                              ('created', 'true'), ('finish_time', 'false')]:
+            url = ('/api/taskrun?project_id=%s&limit=3&orderby=%s&desc=%s'
+                   % (project.id, orderby, desc))
+            ids = []
+            while url:
+                res = self.app.get(url)
+                data = json.loads(res.data)
+                ids.extend(item['id'] for item in data)
+                url = self._next_link(res)
+                if url:
+                    assert 'cursor=' in url and 'offset' not in url, url
+            assert sorted(ids) == [tr.id for tr in task_runs], ids
+            if orderby == 'id':
+                assert ids == sorted(ids, reverse=desc == 'true'), ids
+
+    @with_context
+    def test_query_taskrun_streamed_as_json(self):
+        """Test API query for taskrun can be streamed as a JSON array."""
+        project = ProjectFactory.create()
+        task_runs = TaskRunFactory.create_batch(3, project=project)
+
+        res = self.app.get('/api/taskrun?project_id=%s&stream=1&limit=200'
+                           % project.id)
+        data = json.loads(res.data)
+
+        assert res.mimetype == 'application/json', res.mimetype
+        assert [item['id'] for item in data] == [tr.id for tr in task_runs]
+        assert data[0]['links'], data[0]
+
+    @with_context
+    def test_query_taskrun_streamed_as_ndjson(self):
+        """Test API query for taskrun can be streamed as NDJSON."""
+        project = ProjectFactory.create()
+        task_runs = TaskRunFactory.create_batch(120, project=project)
+
+        res = self.app.get('/api/taskrun?project_id=%s&limit=200' % project.id,
+                           headers={'Accept': 'application/x-ndjson'})
+        lines = res.data.splitlines()
+
+        assert res.mimetype == 'application/x-ndjson', res.mimetype
+        assert len(lines) == 120, len(lines)
+        assert json.loads(lines[0])['id'] == task_runs[0].id
+
+    @with_context
+    def test_query_taskrun_authorizes_once_per_project(self):
+        """Test API query for taskrun checks read access once per project."""
+        project = ProjectFactory.create()
+        TaskRunFactory.create_batch(5, project=project)
+
+        with patch('pybossa.api.api_base.ensure_authorized_to') as auth:
+            res = self.app.get('/api/taskrun?project_id=%s' % project.id)
+
+        assert len(json.loads(res.data)) == 5, res.data
+        # Once for the TaskRun class and once for the project
+        assert auth.call_count == 2, auth.call_args_list
+
+    @with_context
+    def test_query_taskrun_invalid_cursor(self):
+        """Test API query for taskrun with an invalid cursor returns 400."""
+        res = self.app.get('/api/taskrun?cursor=notacursor')
+        error = json.loads(res.data)
+
+        assert res.status_code == 400, res.status_code
+        assert error['exception_cls'] == 'BadRequest', error
+
     @with_context
     def test_query_taskrun_with_context(self):
         """Test API query for taskrun with params works with context."""
@@ -19,7 +19,9 @@
 import hashlib
 from mock import patch
 from pybossa.cache import (get_key_to_hash, get_hash_key, cache, memoize,
-                           delete_cached, delete_memoized)
+                           delete_cached, delete_memoized, LocalCache,
+                           memoize_many, get_index_key, invalidate_local,
+                           delete_all_memoized)
 from pybossa.sentinel import Sentinel
 from settings_test import REDIS_SENTINEL, REDIS_KEYPREFIX
 
@@ -246,7 +248,7 @@ class TestCacheMemoizeFunctions(object):
         def my_func(*args, **kwargs):
             return [args, kwargs]
         my_func('arg', kwarg='kwarg')
-        assert len(test_sentinel.master.keys()) == 1
+        assert len(test_sentinel.master.keys('*_args:*')) == 1
 
         delete_succedeed = delete_memoized(my_func, 'arg', kwarg='kwarg')
         assert delete_succedeed is True, delete_succedeed
@@ -260,11 +262,11 @@ class TestCacheMemoizeFunctions(object):
         def my_func(*args, **kwargs):
             return [args, kwargs]
         my_func('arg', kwarg='kwarg')
-        assert len(test_sentinel.master.keys()) == 1
+        assert len(test_sentinel.master.keys('*_args:*')) == 1
 
         delete_succedeed = delete_memoized(my_func, 'badarg', kwarg='barkwarg')
         assert delete_succedeed is False, delete_succedeed
-        assert len(test_sentinel.master.keys()) == 1, 'Key was unexpectedly deleted'
+        assert len(test_sentinel.master.keys('*_args:*')) == 1, 'Key was unexpectedly deleted'
 
 
     def test_delete_memoized_deletes_only_requested(self):
@@ -276,11 +278,11 @@ class TestCacheMemoizeFunctions(object):
             return [args, kwargs]
         my_func('arg', kwarg='kwarg')
         my_func('other', kwarg='other')
-        assert len(test_sentinel.master.keys()) == 2
+        assert len(test_sentinel.master.keys('*_args:*')) == 2
 
         delete_succedeed = delete_memoized(my_func, 'arg', kwarg='kwarg')
         assert delete_succedeed is True, delete_succedeed
-        assert len(test_sentinel.master.keys()) == 1, 'Everything was deleted!'
+        assert len(test_sentinel.master.keys('*_args:*')) == 1, 'Everything was deleted!'
 
 
     def test_delete_memoized_deletes_all_function_calls(self):
@@ -296,8 +298,249 @@ class TestCacheMemoizeFunctions(object):
         my_func('arg', kwarg='kwarg')
         my_func('other', kwarg='other')
         my_other_func('arg', kwarg='kwarg')
-        assert len(test_sentinel.master.keys()) == 3
+        assert len(test_sentinel.master.keys('*_args:*')) == 3
 
         delete_succedeed = delete_memoized(my_func)
         assert delete_succedeed is True, delete_succedeed
-        assert len(test_sentinel.master.keys()) == 1
+        assert len(test_sentinel.master.keys('*_args:*')) == 1
+
+
+    def test_delete_memoized_uses_function_index(self):
+        """Test CACHE delete_memoized deletes the keys indexed for the function
+        without scanning the keyspace"""
+
+        @memoize()
+        def my_func(*args, **kwargs):
+            return [args, kwargs]
+        my_func('arg')
+        my_func('other')
+        index = get_index_key(my_func.__name__)
+        assert test_sentinel.master.scard(index) == 2
+
+        with patch.object(test_sentinel.slave, 'keys') as keys:
+            assert delete_memoized(my_func) is True
+            assert not keys.called
+        assert test_sentinel.master.keys() == []
+        assert delete_memoized(my_func) is False
+
+
+    def test_delete_all_memoized_deletes_unindexed_keys(self):
+        """Test CACHE delete_all_memoized deletes the values memoized before
+        their keys were indexed"""
+
+        @memoize()
+        def my_func(*args, **kwargs):
+            return [args, kwargs]
+        my_func('arg')
+        test_sentinel.master.delete(get_index_key(my_func.__name__))
+
+        assert delete_all_memoized() == 1
+        assert test_sentinel.master.keys('*_args:*') == []
+
+
+    def test_memoize_with_grace_serves_stale_value_while_locked(self):
+        """Test CACHE memoize with grace serves the expired value while
+        another worker recomputes it"""
+
+        @memoize(timeout=10, grace=100)
+        def my_func(arg, call_count=[]):
+            call_count.append(1)
+            return len(call_count)
+        key = get_hash_key("%s:%s_args:" % (REDIS_KEYPREFIX, my_func.__name__),
+                           get_key_to_hash('arg'))
+        assert my_func('arg') == 1
+        test_sentinel.master.expire(key, 50)
+        test_sentinel.master.set(key + ':lock', 1)
+
+        assert my_func('arg') == 1
+
+        test_sentinel.master.delete(key + ':lock')
+        assert my_func('arg') == 2
+        assert test_sentinel.master.ttl(key) > 100
+        assert not test_sentinel.master.exists(key + ':lock')
+
+    @patch('pybossa.cache.LOCK_WAIT', 0)
+    def test_memoize_with_grace_computes_when_lock_is_not_released(self):
+        """Test CACHE memoize with grace computes the value if the worker
+        holding the lock does not store it in time"""
+
+        @memoize(timeout=10, grace=100)
+        def my_func(arg):
+            return arg
+        key = get_hash_key("%s:%s_args:" % (REDIS_KEYPREFIX, my_func.__name__),
+                           get_key_to_hash('arg'))
+        test_sentinel.master.set(key + ':lock', 1)
+
+        assert my_func('arg') == 'arg'
+        assert test_sentinel.master.exists(key)
+
+    def test_memoize_with_grace_keeps_the_lock_of_the_next_worker(self):
+        """Test CACHE memoize with grace does not release the lock another
+        worker got after its own lock expired"""
+
+        @memoize(timeout=10, grace=100)
+        def my_func(arg):
+            # The lock expires and another worker gets it meanwhile
+            test_sentinel.master.set(key + ':lock', 'other')
+            return arg
+        key = get_hash_key("%s:%s_args:" % (REDIS_KEYPREFIX, my_func.__name__),
+                           get_key_to_hash('arg'))
+
+        assert my_func('arg') == 'arg'
+        assert test_sentinel.master.get(key + ':lock') == 'other'
+
+    @patch('pybossa.cache.EARLY_EXPIRATION_BETA', 1e9)
+    def test_memoize_with_grace_refreshes_early(self):
+        """Test CACHE memoize with grace may recompute values before they
+        expire"""
+        import time
+
+        @memoize(timeout=10, grace=100)
+        def my_func(arg, call_count=[]):
+            call_count.append(1)
+            time.sleep(0.01)
+            return len(call_count)
+
+        assert my_func('arg') == 1
+        assert my_func('arg') == 2
+
+
+    def test_memoize_many_shares_keys_with_memoize(self):
+        """Test CACHE memoize_many reads and writes the keys of the memoized
+        function and only computes the misses"""
+
+        @memoize()
+        def my_func(arg):
+            return 'single %s' % arg
+        computed = []
+        @memoize_many(my_func)
+        def my_func_many(args):
+            computed.extend(args)
+            return dict((arg, 'many %s' % arg) for arg in args)
+        my_func(1)
+
+        values = my_func_many([1, 2, 2])
+
+        assert values == {1: 'single 1', 2: 'many 2'}, values
+        assert computed == [2], computed
+        assert my_func(2) == 'many 2'
+        assert delete_memoized(my_func, 2) is True
+        assert my_func_many([2]) == {2: 'many 2'}
+        assert computed == [2, 2], computed
+        delete_memoized(my_func)
+        assert test_sentinel.master.keys() == []
+
+    def test_memoize_many_only_extends_the_index_timeout(self):
+        """Test CACHE memoize_many and memoize keep the longest timeout of
+        the index of the memoized function"""
+
+        @memoize(timeout=100)
+        def my_func(arg):
+            return arg
+        @memoize_many(my_func, timeout=1000)
+        def my_func_many(args):
+            return dict((arg, arg) for arg in args)
+        index = get_index_key('my_func')
+
+        my_func_many([1])
+        my_func(2)
+        assert test_sentinel.master.ttl(index) > 100
+
+        my_func_many([3])
+        assert test_sentinel.master.ttl(index) > 100
+
+
+class TestLocalCache(object):
+
+    def test_get_returns_stored_value(self):
+        """Test CACHE LocalCache returns the stored values"""
+        local = LocalCache(max_size=2, timeout=60)
+        local.set('key', 'value', 300)
+
+        assert local.get('key') == 'value'
+        assert local.get('other') is None
+
+    def test_evicts_least_recently_used(self):
+        """Test CACHE LocalCache evicts the least recently used value"""
+        local = LocalCache(max_size=2, timeout=60)
+        local.set('a', 1, 300)
+        local.set('b', 2, 300)
+        local.get('a')
+        local.set('c', 3, 300)
+
+        assert local.get('b') is None
+        assert local.get('a') == 1
+        assert local.get('c') == 3
+
+    @patch('pybossa.cache.time')
+    def test_values_expire(self, mock_time):
+        """Test CACHE LocalCache honours the shortest timeout"""
+        mock_time.return_value = 100
+        local = LocalCache(max_size=2, timeout=60)
+        local.set('short', 1, 10)
+        local.set('long', 2, 300)
+
+        mock_time.return_value = 111
+        assert local.get('short') is None
+        assert local.get('long') == 2
+        mock_time.return_value = 161
+        assert local.get('long') is None
+
+    def test_set_is_skipped_after_a_deletion(self):
+        """Test CACHE LocalCache does not store a value read before a
+        deletion"""
+        local = LocalCache(max_size=10, timeout=60)
+        generation = local.generation
+
+        local.delete('key')
+        local.set('key', 'stale', 300, generation)
+
+        assert local.get('key') is None
+        local.set('key', 'value', 300, local.generation)
+        assert local.get('key') == 'value'
+
+    def test_invalidate_local(self):
+        """Test CACHE invalidate_local removes a key or a prefix"""
+        local = LocalCache(max_size=10, timeout=60)
+        local.set('f_args:1', 1, 300)
+        local.set('f_args:2', 2, 300)
+        local.set('g_args:1', 3, 300)
+
+        invalidate_local(local, 'g_args:1')
+        assert local.get('g_args:1') is None
+        invalidate_local(local, 'f_args:*')
+        assert local.get('f_args:1') is None
+        assert local.get('f_args:2') is None
+
+
+@patch('pybossa.cache.settings.CACHE_LOCAL_SIZE', 10, create=True)
+@patch.dict('pybossa.cache._local', {'pid': None, 'cache': None})
+class TestCacheMemoizeWithLocalCache(TestCacheMemoizeFunctions):
+
+    def test_memoize_reads_from_local_cache(self):
+        """Test CACHE memoize does not hit Redis for values held in memory"""
+
+        @memoize()
+        def my_func(arg, call_count=[]):
+            call_count.append(1)
+            return len(call_count)
+        my_func('arg')
+        test_sentinel.master.flushall()
+
+        assert my_func('arg') == 1
+
+    def test_delete_memoized_clears_local_cache(self):
+        """Test CACHE delete_memoized removes values held in memory"""
+
+        @memoize()
+        def my_func(arg, call_count=[]):
+            call_count.append(1)
+            return len(call_count)
+        my_func('arg')
+        my_func('other')
+
+        delete_memoized(my_func, 'arg')
+        assert my_func('arg') == 2
+        assert my_func('other') == 1
+        delete_memoized(my_func)
+        assert my_func('other') == 3
@@ -341,6 +341,32 @@ class TestProjectsCache(Test):
         assert total_volunteers == 5, err_msg
 
 
+    @with_context
+    def test_many_counters_match_single_counters(self):
+        """Test CACHE PROJECTS batch counters return the same values as the
+        single project ones"""
+
+        project = self.create_project_with_contributors(anonymous=2,
+                                                        registered=3,
+                                                        two_tasks=True)
+        empty = ProjectFactory.create()
+        project_ids = [project.id, empty.id]
+
+        for many, single in [
+                (cached_projects.n_tasks_many, cached_projects.n_tasks),
+                (cached_projects.n_completed_tasks_many,
+                 cached_projects.n_completed_tasks),
+                (cached_projects.n_volunteers_many,
+                 cached_projects.n_volunteers),
+                (cached_projects.overall_progress_many,
+                 cached_projects.overall_progress),
+                (cached_projects.last_activity_many,
+                 cached_projects.last_activity)]:
+            expected = dict((project_id, single(project_id))
+                            for project_id in project_ids)
+            assert many(project_ids) == expected, many.__name__
+
+
     @with_context
     def test_n_draft_no_drafts(self):
         """Test CACHE PROJECTS _n_draft returns 0 if there are no draft projects"""
@@ -88,3 +88,78 @@ class TestContributionsGuard(object):
         self.guard.stamp(self.task, self.auth_user)
 
         assert self.guard.retrieve_timestamp(self.task, self.auth_user) == 'now'
+
+    def test_reserve_grants_lease_while_answers_are_available(self):
+        granted = self.guard.reserve_many([self.task], self.auth_user, [1])
+
+        assert granted == [True], granted
+        key = self.guard.LEASE_KEY_PREFIX % self.task.id
+        assert self.connection.zcard(key) == 1
+
+    def test_reserve_refuses_lease_when_all_answers_are_leased(self):
+        self.guard.reserve_many([self.task], self.anon_user, [1])
+
+        granted = self.guard.reserve_many([self.task], self.auth_user, [1])
+
+        assert granted == [False], granted
+
+    def test_reserve_renews_lease_for_user_already_holding_it(self):
+        self.guard.reserve_many([self.task], self.auth_user, [1])
+
+        granted = self.guard.reserve_many([self.task], self.auth_user, [1])
+
+        assert granted == [True], granted
+        key = self.guard.LEASE_KEY_PREFIX % self.task.id
+        assert self.connection.zcard(key) == 1
+
+    def test_reserve_ignores_expired_leases(self):
+        guard = ContributionsGuard(self.connection, lease_ttl=-1)
+        guard.reserve_many([self.task], self.anon_user, [1])
+
+        granted = self.guard.reserve_many([self.task], self.auth_user, [1])
+
+        assert granted == [True], granted
+
+    def test_release_frees_the_lease(self):
+        self.guard.reserve_many([self.task], self.anon_user, [1])
+
+        self.guard.release(self.task.id, self.anon_user)
+
+        granted = self.guard.reserve_many([self.task], self.auth_user, [1])
+
+        assert granted == [True], granted
+
+    def test_reserve_many_stops_after_limit_leases(self):
+        tasks = [Task(id=1), Task(id=2), Task(id=3)]
+
+        granted = self.guard.reserve_many(tasks, self.auth_user, [1, 1, 1],
+                                          limit=2)
+
+        assert granted == [True, True, False], granted
+
+    def test_reserve_many_skips_fully_leased_tasks(self):
+        tasks = [Task(id=1), Task(id=2)]
+        self.guard.reserve_many([tasks[0]], self.anon_user, [1])
+
+        granted = self.guard.reserve_many(tasks, self.auth_user, [1, 1])
+
+        assert granted == [False, True], granted
+
+    def test_stamp_many_stamps_every_task(self):
+        tasks = [Task(id=1), Task(id=2)]
+
+        self.guard.stamp_many(tasks, self.auth_user)
+
+        for task in tasks:
+            assert self.guard.check_task_stamped(task, self.auth_user)
+
+    @patch('pybossa.contributions_guard.time')
+    def test_stamp_many_returns_lease_or_stamp_expiration(self, time):
+        time.return_value = 1000
+        leased, stamped = Task(id=1), Task(id=2)
+        self.guard.reserve_many([leased], self.auth_user, [1])
+
+        expirations = self.guard.stamp_many([leased, stamped], self.auth_user)
+
+        assert expirations == [1000 + self.guard.LEASE_TTL,
+                               1000 + self.guard.STAMP_TTL], expirations
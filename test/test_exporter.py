@@ -0,0 +1,194 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+import json
+import tempfile
+from StringIO import StringIO
+from types import GeneratorType
+
+from default import Test, with_context
+from factories import ProjectFactory, TaskFactory, TaskRunFactory
+from factories import UserFactory
+from mock import patch
+from pybossa.core import task_repo, user_repo
+from pybossa.exporter.csv_export import CsvExporter
+from pybossa.exporter.json_export import JsonExporter
+from pybossa.exporter.parquet_export import ParquetExporter
+from pybossa.util import unicode_csv_reader
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+class TestStreamingExporter(Test):
+
+    @with_context
+    def test_iter_data_yields_rows_without_changing_them(self):
+        project = ProjectFactory.create()
+        task = TaskFactory.create(project=project, info={'a': 1})
+
+        rows = CsvExporter()._iter_data('task', project.id, flat=True,
+                                        info_only=True)
+
+        assert isinstance(rows, GeneratorType), rows
+        assert list(rows) == [{'a': 1, 'task_id': task.id}]
+        assert task.info == {'a': 1}, task.info
+
+    def test_write_csv_uses_the_union_of_the_keys_as_header(self):
+        out = StringIO()
+        rows = iter([{'a': 1, 'b': None}, {u'c': u'M\xfcnchen', 'a': 2}])
+
+        CsvExporter()._write_csv(out, rows)
+        out.seek(0)
+        lines = list(unicode_csv_reader(out.read().decode('utf-8')
+                                        .splitlines()))
+
+        assert lines == [[u'a', u'b', u'c'],
+                         [u'1', u'', u''],
+                         [u'2', u'', u'M\xfcnchen']], lines
+
+    def test_write_json_writes_an_array(self):
+        out = StringIO()
+
+        JsonExporter()._write_json(out, (dict(id=i) for i in range(3)))
+
+        assert json.loads(out.getvalue()) == [dict(id=0), dict(id=1),
+                                              dict(id=2)]
+
+
+class TestIncrementalExporter(Test):
+
+    @with_context
+    def test_sync_spool_reads_only_rows_after_the_last_one(self):
+        project = ProjectFactory.create()
+        first = TaskRunFactory.create(project=project)
+        exporter = CsvExporter()
+        exporter._sync_spool(project, 'task_run')
+        second = TaskRunFactory.create(project=project)
+
+        with patch('pybossa.exporter.spool.ExportSpool.OVERLAP', 0):
+            with patch.object(exporter, '_iter_rows',
+                              wraps=exporter._iter_rows) as iter_rows:
+                spool = exporter._sync_spool(project, 'task_run')
+
+        iter_rows.assert_called_once_with('task_run', project.id, first.id)
+        assert [row['id'] for row in spool.rows()] == [first.id, second.id]
+        assert spool.manifest['n_rows'] == 2, spool.manifest
+
+    @with_context
+    def test_sync_spool_skips_rows_read_again_in_the_overlap(self):
+        project = ProjectFactory.create()
+        runs = TaskRunFactory.create_batch(2, project=project)
+        exporter = CsvExporter()
+        exporter._sync_spool(project, 'task_run')
+
+        spool = exporter._sync_spool(project, 'task_run')
+
+        assert [row['id'] for row in spool.rows()] == [r.id for r in runs]
+
+    @with_context
+    def test_spool_of_another_worker_is_rebuilt(self):
+        project = ProjectFactory.create()
+        task_run = TaskRunFactory.create(project=project)
+        exporter = CsvExporter()
+        spool = exporter._sync_spool(project, 'task_run')
+        with open(spool.path, 'rb') as spool_file:
+            content = spool_file.read()
+        # A file of the same size written by another worker
+        with open(spool.path, 'wb') as spool_file:
+            spool_file.write(' ' * (len(content) - 1) + '\n')
+
+        spool = exporter._sync_spool(project, 'task_run')
+
+        assert [row['id'] for row in spool.rows()] == [task_run.id]
+
+    @with_context
+    def test_deleting_task_runs_rebuilds_the_spool(self):
+        project = ProjectFactory.create()
+        deleted, kept = TaskRunFactory.create_batch(2, project=project)
+        exporter = CsvExporter()
+        exporter._sync_spool(project, 'task_run')
+
+        task_repo.delete(deleted)
+        spool = exporter._sync_spool(project, 'task_run')
+
+        assert [row['id'] for row in spool.rows()] == [kept.id]
+
+    @with_context
+    def test_deleting_a_user_rebuilds_the_spool(self):
+        project = ProjectFactory.create()
+        user = UserFactory.create()
+        TaskRunFactory.create(project=project, user=user)
+        exporter = CsvExporter()
+        exporter._sync_spool(project, 'task_run')
+
+        user_repo.delete(user)
+        spool = exporter._sync_spool(project, 'task_run')
+
+        assert [row['user_id'] for row in spool.rows()] == [None]
+
+    @with_context
+    @patch('pybossa.exporter.csv_export.uploader')
+    @patch('pybossa.exporter.uploader')
+    def test_make_zip_is_skipped_without_new_rows(self, uploader,
+                                                  csv_uploader):
+        uploader.file_exists.return_value = True
+        project = ProjectFactory.create()
+        TaskRunFactory.create(project=project)
+        exporter = CsvExporter()
+
+        exporter._make_zip(project, 'task_run')
+        exporter._make_zip(project, 'task_run')
+        assert csv_uploader.upload_file.call_count == 1
+
+        TaskRunFactory.create(project=project)
+        exporter._make_zip(project, 'task_run')
+        assert csv_uploader.upload_file.call_count == 2
+
+
+class TestParquetExporter(Test):
+
+    def test_write_parquet_keeps_the_types_of_the_columns(self):
+        rows = iter([dict(id=1, n=1, ok=True, x=1, tags=[1]),
+                     dict(id=2, n=None, ok=False, x=1.5, text=u'M\xfcnchen')])
+        datafile = tempfile.NamedTemporaryFile()
+
+        with patch.object(ParquetExporter, 'ROW_GROUP', 1):
+            ParquetExporter()._write_parquet(datafile.name, rows)
+        table = pq.read_table(datafile.name)
+
+        assert table.schema.field_by_name('id').type == pa.int64()
+        assert table.schema.field_by_name('ok').type == pa.bool_()
+        assert table.schema.field_by_name('x').type == pa.float64()
+        assert table.to_pydict() == dict(id=[1, 2], n=[1, None],
+                                         ok=[True, False], x=[1.0, 1.5],
+                                         tags=[u'[1]', None],
+                                         text=[None, u'M\xfcnchen'])
+
+    @with_context
+    def test_iter_data_rows_are_written_as_parquet(self):
+        project = ProjectFactory.create()
+        task = TaskFactory.create(project=project, info={'a': 1})
+        datafile = tempfile.NamedTemporaryFile()
+        exporter = ParquetExporter()
+
+        exporter._write_parquet(datafile.name,
+                                exporter._iter_data('task', project.id,
+                                                    flat=True))
+        table = pq.read_table(datafile.name).to_pydict()
+
+        assert table['id'] == [task.id], table
+        assert table['info_a'] == [1], table
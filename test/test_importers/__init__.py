@@ -79,6 +79,22 @@ class TestImporterPublicMethods(Test):
         assert result.message == 'It looks like there were no new records to import', result
         importer_factory.assert_called_with(**form_data)
 
+    @with_context
+    def test_create_tasks_not_creates_tasks_repeated_in_import(self, importer_factory):
+        mock_importer = Mock()
+        mock_importer.tasks.return_value = [{'info': {'a': 1, 'b': 2}},
+                                            {'info': {'b': 2, 'a': 1}},
+                                            {'info': {'a': 2}}]
+        importer_factory.return_value = mock_importer
+        project = ProjectFactory.create()
+        form_data = dict(type='csv', csv_url='http://fakecsv.com')
+
+        result = self.importer.create_tasks(task_repo, project.id, **form_data)
+        tasks = task_repo.filter_tasks_by(project_id=project.id)
+
+        assert len(tasks) == 2, len(tasks)
+        assert result.total == 2, result.total
+
     @with_context
     def test_create_tasks_returns_task_report(self, importer_factory):
         mock_importer = Mock()
@@ -199,3 +199,18 @@ class TestBulkTaskCSVImport(object):
         task = tasks.next()
 
         assert csv_file.encoding == 'utf-8'
+
+    def test_tasks_streams_the_file_in_chunks(self, request):
+        csv_file = FakeResponse(text=u'Foo,Bar\n"multi\nline",M\xfcnchen\n',
+                                status_code=200,
+                                headers={'content-type': 'text/plain'},
+                                encoding='utf-8')
+        request.return_value = csv_file
+        self.importer.chunk_size = 4
+
+        tasks = list(self.importer.tasks())
+
+        assert tasks == [{'info': {u'Foo': u'multi\nline',
+                                   u'Bar': u'M\xfcnchen'}}], tasks
+        assert self.importer.count_tasks() == 1
+        request.assert_called_with('http://myfakecsvurl.com', stream=True)
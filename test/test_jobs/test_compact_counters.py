@@ -0,0 +1,37 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+
+from default import Test, with_context, db
+from factories import TaskFactory, TaskRunFactory
+from pybossa.jobs import compact_task_counters
+from pybossa.model.counter import Counter
+
+
+class TestCompactTaskCounters(Test):
+
+    @with_context
+    def test_compact_task_counters_keeps_one_row_per_task(self):
+        """Test JOB compact_task_counters keeps the task run counts."""
+        task = TaskFactory.create()
+        TaskRunFactory.create_batch(3, task=task)
+
+        compact_task_counters(task.project_id)
+
+        counters = db.session.query(Counter).filter_by(task_id=task.id).all()
+        assert len(counters) == 1, counters
+        assert counters[0].n_task_runs == 3, counters[0]
@@ -29,27 +29,27 @@ class TestDashBoardActiveAnon(Test):
 
     @with_context
     @patch('pybossa.dashboard.jobs.db')
-    def test_materialized_view_refreshed(self, db_mock):
-        """Test JOB dashboard materialized view is refreshed."""
+    def test_rollup_updated(self, db_mock):
+        """Test JOB dashboard rollup is updated."""
         result = MagicMock()
         result.exists = True
         results = [result]
         db_mock.slave_session.execute.return_value = results
         res = active_anon_week()
         assert db_mock.session.execute.called
-        assert res == 'Materialized view refreshed'
+        assert res == 'Rollup updated'
 
     @with_context
     @patch('pybossa.dashboard.jobs.db')
-    def test_materialized_view_created(self, db_mock):
-        """Test JOB dashboard materialized view is created."""
+    def test_rollup_view_created(self, db_mock):
+        """Test JOB dashboard rollup view is created."""
         result = MagicMock()
         result.exists = False
         results = [result]
         db_mock.slave_session.execute.return_value = results
         res = active_anon_week()
         assert db_mock.session.commit.called
-        assert res == 'Materialized view created'
+        assert res == 'Rollup view created'
 
     @with_context
     def test_anon_week(self):
@@ -57,6 +57,32 @@ class TestDashBoardDraftProject(Test):
         assert db_mock.session.commit.called
         assert res == 'Materialized view created'
 
+    @with_context
+    @patch('pybossa.dashboard.jobs.db')
+    def test_materialized_view_refreshed_concurrently(self, db_mock):
+        """Test JOB dashboard materialized view with a unique index is
+        refreshed concurrently."""
+        result = MagicMock()
+        result.exists = True
+        db_mock.slave_session.execute.return_value = [result]
+        draft_projects_week()
+        sql = db_mock.session.execute.call_args[0][0]
+        assert 'CONCURRENTLY' in str(sql), sql
+
+    @with_context
+    def test_materialized_view_created_with_unique_index(self):
+        """Test JOB dashboard materialized view is created with the unique
+        index it needs to be refreshed concurrently."""
+        ProjectFactory.create(published=False)
+        draft_projects_week()
+        res = draft_projects_week()
+        sql = """SELECT indexname FROM pg_indexes
+                 WHERE tablename='dashboard_week_project_draft'"""
+        indexes = [row.indexname for row in db.session.execute(sql)]
+
+        assert res == 'Materialized view refreshed', res
+        assert indexes == ['dashboard_week_project_draft_key_idx'], indexes
+
     @with_context
     def test_format_new_projects(self):
         """Test format draft_projects_week works."""
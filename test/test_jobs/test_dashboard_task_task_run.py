@@ -30,27 +30,27 @@ class TestDashBoardNewTask(Test):
 
     @with_context
     @patch('pybossa.dashboard.jobs.db')
-    def test_materialized_view_refreshed(self, db_mock):
-        """Test JOB dashboard materialized view is refreshed."""
+    def test_rollup_updated(self, db_mock):
+        """Test JOB dashboard rollup is updated."""
         result = MagicMock()
         result.exists = True
         results = [result]
         db_mock.slave_session.execute.return_value = results
         res = new_tasks_week()
         assert db_mock.session.execute.called
-        assert res == 'Materialized view refreshed'
+        assert res == 'Rollup updated'
 
     @with_context
     @patch('pybossa.dashboard.jobs.db')
-    def test_materialized_view_created(self, db_mock):
-        """Test JOB dashboard materialized view is created."""
+    def test_rollup_view_created(self, db_mock):
+        """Test JOB dashboard rollup view is created."""
         result = MagicMock()
         result.exists = False
         results = [result]
         db_mock.slave_session.execute.return_value = results
         res = new_tasks_week()
         assert db_mock.session.commit.called
-        assert res == 'Materialized view created'
+        assert res == 'Rollup view created'
 
     @with_context
     def test_new_tasks(self):
@@ -91,27 +91,27 @@ class TestDashBoardNewTaskRuns(Test):
 
     @with_context
     @patch('pybossa.dashboard.jobs.db')
-    def test_materialized_view_refreshed(self, db_mock):
-        """Test JOB dashboard materialized view is refreshed."""
+    def test_rollup_updated(self, db_mock):
+        """Test JOB dashboard rollup is updated."""
         result = MagicMock()
         result.exists = True
         results = [result]
         db_mock.slave_session.execute.return_value = results
         res = new_task_runs_week()
         assert db_mock.session.execute.called
-        assert res == 'Materialized view refreshed'
+        assert res == 'Rollup updated'
 
     @with_context
     @patch('pybossa.dashboard.jobs.db')
-    def test_materialized_view_created(self, db_mock):
-        """Test JOB dashboard materialized view is created."""
+    def test_rollup_view_created(self, db_mock):
+        """Test JOB dashboard rollup view is created."""
         result = MagicMock()
         result.exists = False
         results = [result]
         db_mock.slave_session.execute.return_value = results
         res = new_task_runs_week()
         assert db_mock.session.commit.called
-        assert res == 'Materialized view created'
+        assert res == 'Rollup view created'
 
     @with_context
     def test_new_task_runs(self):
@@ -126,6 +126,28 @@ class TestDashBoardNewTaskRuns(Test):
 
         assert results[0].day_task_runs == 1, results[0].day_task_runs
 
+    @with_context
+    def test_new_task_runs_rollup_reads_from_last_day(self):
+        """Test JOB dashboard rolls up task runs from its last day on."""
+        closed = datetime.utcnow() - timedelta(days=3)
+        TaskRunFactory.create(finish_time=closed.isoformat())
+        new_task_runs_week()
+        sql = """UPDATE dashboard_day_task_runs SET n_task_runs=5
+                 WHERE day=:day"""
+        db.session.execute(sql, dict(day=closed.date()))
+        db.session.commit()
+        TaskRunFactory.create()
+        TaskRunFactory.create()
+
+        new_task_runs_week()
+        sql = "select * from dashboard_week_new_task_run;"
+        results = db.session.execute(sql).fetchall()
+
+        assert len(results) == 2, results
+        assert results[0].day == closed.date(), results
+        assert results[0].day_task_runs == 5, results
+        assert results[1].day_task_runs == 2, results
+
     @with_context
     @patch('pybossa.dashboard.data.db')
     def test_format_new_task_runs_emtpy(self, db_mock):
@@ -18,10 +18,13 @@
 
 from default import Test, with_context, flask_app
 from pybossa.jobs import import_tasks, task_repo, get_autoimport_jobs
+from pybossa.jobs import import_tasks_in_chunks, import_task_chunk
+from pybossa.core import sentinel
+from pybossa.importers.progress import ImportProgress
 from pybossa.model.task import Task
 from pybossa.importers import ImportReport
 from factories import ProjectFactory, TaskFactory, UserFactory
-from mock import patch
+from mock import patch, Mock
 
 class TestImportTasksJob(Test):
 
@@ -86,6 +89,92 @@ class TestImportTasksJob(Test):
         assert autoimporter.get('last_import_meta') == None, autoimporter
 
 
+@patch.object(task_repo, 'BULK_CHUNK', 2)
+@patch('pybossa.jobs.send_mail')
+@patch('rq.Queue')
+@patch('pybossa.jobs.importer._create_importer_for')
+class TestImportTasksInChunksJob(Test):
+
+    def run_chunk_jobs(self, queue):
+        for call in queue.return_value.enqueue_call.call_args_list:
+            import_task_chunk(*call[1]['args'])
+        queue.return_value.enqueue_call.reset_mock()
+
+    def source(self, infos, fail_after=None):
+        def tasks():
+            for i, info in enumerate(infos):
+                if i == fail_after:
+                    raise IOError('connection lost')
+                yield dict(info=info)
+        mock_importer = Mock()
+        mock_importer.tasks.side_effect = tasks
+        mock_importer.import_metadata.return_value = None
+        return mock_importer
+
+    @with_context
+    def test_it_imports_every_chunk_in_its_own_job(self, create, queue,
+                                                   send_mail):
+        project = ProjectFactory.create()
+        TaskFactory.create(project=project, info={'n': 0})
+        create.return_value = self.source([{'n': 0}, {'n': 1}, {'n': 1},
+                                           {'n': 2}, {'n': 3}])
+        form_data = {'type': 'csv', 'csv_url': 'http://google.es'}
+
+        import_tasks_in_chunks(project.id, **form_data)
+        calls = queue.return_value.enqueue_call.call_args_list
+        assert [c[1]['args'] for c in calls] == [(project.id, 0),
+                                                 (project.id, 1)], calls
+        self.run_chunk_jobs(queue)
+        progress = ImportProgress(sentinel.master, project.id).get()
+        tasks = task_repo.filter_tasks_by(project_id=project.id)
+
+        assert len(tasks) == 4, tasks
+        assert progress['state'] == 'finished', progress
+        assert progress['n_created'] == 3, progress
+        assert send_mail.call_count == 1, send_mail.call_args_list
+        assert '3 new tasks were imported' in send_mail.call_args[0][0]['body']
+
+    @with_context
+    def test_it_resumes_an_interrupted_import(self, create, queue, send_mail):
+        project = ProjectFactory.create()
+        infos = [{'n': i} for i in range(5)]
+        form_data = {'type': 'csv', 'csv_url': 'http://google.es'}
+        create.return_value = self.source(infos, fail_after=3)
+
+        try:
+            import_tasks_in_chunks(project.id, **form_data)
+        except IOError:
+            pass
+        progress = ImportProgress(sentinel.master, project.id)
+        assert progress.get()['state'] == 'failed', progress.get()
+        assert progress.get()['n_staged'] == 2, progress.get()
+
+        create.return_value = self.source(infos)
+        import_tasks_in_chunks(project.id, **form_data)
+        calls = queue.return_value.enqueue_call.call_args_list
+        # The chunk staged before the failure is enqueued again
+        assert [c[1]['args'][1] for c in calls] == [0, 0, 1, 2], calls
+        self.run_chunk_jobs(queue)
+        tasks = task_repo.filter_tasks_by(project_id=project.id)
+
+        assert sorted(t.info['n'] for t in tasks) == range(5), tasks
+        assert progress.get()['state'] == 'finished', progress.get()
+        assert send_mail.call_count == 1, send_mail.call_args_list
+
+    @with_context
+    def test_chunk_is_not_imported_twice(self, create, queue, send_mail):
+        project = ProjectFactory.create()
+        create.return_value = self.source([{'n': 1}, {'n': 2}])
+        form_data = {'type': 'csv', 'csv_url': 'http://google.es'}
+
+        import_tasks_in_chunks(project.id, **form_data)
+        import_task_chunk(project.id, 0)
+        msg = import_task_chunk(project.id, 0)
+
+        assert msg == 'Chunk 0 was already imported', msg
+        assert len(task_repo.filter_tasks_by(project_id=project.id)) == 2
+
+
 class TestAutoimportJobs(Test):
     @with_context
     def test_autoimport_jobs_no_autoimporter(self):
@@ -52,9 +52,11 @@ class TestLeaderboard(Test):
         assert res == 'Materialized view refreshed concurrently'
 
     @with_context
+    @patch('pybossa.leaderboard.jobs.LeaderboardScores')
     @patch('pybossa.leaderboard.jobs.exists_materialized_view')
     @patch('pybossa.leaderboard.jobs.db')
-    def test_materialized_view_refreshed(self, db_mock, exists_mock):
+    def test_materialized_view_refreshed(self, db_mock, exists_mock,
+                                         scores_mock):
         """Test JOB leaderboard materialized view is refreshed."""
         result = MagicMock()
         result.exists = True
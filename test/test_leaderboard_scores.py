@@ -0,0 +1,255 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+
+from default import Test, db, with_context
+from factories import ProjectFactory, TaskFactory, TaskRunFactory
+from factories import UserFactory
+from mock import patch
+from pybossa.core import sentinel, task_repo, user_repo
+from pybossa.leaderboard.data import get_leaderboard, get_rank
+from pybossa.leaderboard.jobs import leaderboard, windowed_leaderboard
+from pybossa.leaderboard.jobs import load_scores
+from pybossa.leaderboard.scores import LeaderboardScores, WindowedScores
+
+
+class TestLeaderboardScores(Test):
+
+    def setUp(self):
+        super(TestLeaderboardScores, self).setUp()
+        self.scores = LeaderboardScores(sentinel.master, db.session)
+
+    @with_context
+    def test_task_runs_update_scores_in_real_time(self):
+        user = UserFactory.create()
+        leaderboard()
+        TaskRunFactory.create_batch(2, user=user)
+
+        rank = get_rank(user.id)
+        top_users = get_leaderboard(top_users=1)
+
+        assert rank == dict(rank=1, score=2), rank
+        assert top_users[0]['name'] == user.name, top_users
+        assert top_users[0]['score'] == 2, top_users
+
+    @with_context
+    def test_deleted_task_run_decreases_score(self):
+        user = UserFactory.create()
+        leaderboard()
+        task_run = TaskRunFactory.create(user=user)
+        TaskRunFactory.create(user=user)
+
+        db.session.delete(task_run)
+        db.session.commit()
+
+        assert get_rank(user.id)['score'] == 1
+
+    @with_context
+    def test_deleted_task_runs_of_project_decrease_scores(self):
+        user = UserFactory.create()
+        project = ProjectFactory.create()
+        task = TaskFactory.create(project=project)
+        leaderboard()
+        TaskRunFactory.create(user=user, task=task)
+        TaskRunFactory.create(user=user)
+
+        task_repo.delete_taskruns_from_project(project)
+
+        assert get_rank(user.id)['score'] == 1
+
+    @with_context
+    def test_restricted_user_is_removed(self):
+        user = UserFactory.create()
+        leaderboard()
+        TaskRunFactory.create(user=user)
+
+        user.restrict = True
+        user_repo.update(user)
+        restricted = get_rank(user.id)
+        user.restrict = False
+        user_repo.update(user)
+
+        assert restricted == dict(rank=None, score=None), restricted
+        assert get_rank(user.id)['score'] == 1
+
+    @with_context
+    def test_user_info_updates_info_leaderboard(self):
+        with patch.dict(self.flask_app.config, {'LEADERBOARDS': ['n']}):
+            user = UserFactory.create(info=dict(n=1))
+            leaderboard(info='n')
+            UserFactory.create(info=dict(n=3))
+
+            user.info = dict(n=5)
+            user_repo.update(user)
+            top_users = get_leaderboard(info='n')
+
+            assert [u['score'] for u in top_users][:2] == [5, 3], top_users
+            assert top_users[0]['name'] == user.name, top_users
+
+    @with_context
+    @patch('pybossa.leaderboard.data.load_queue')
+    def test_scores_are_loaded_from_the_view(self, load_queue):
+        user = UserFactory.create()
+        TaskRunFactory.create(user=user)
+        leaderboard()
+        sentinel.master.flushall()
+
+        assert get_rank(user.id)['score'] == 1
+        assert get_rank(user.id)['score'] == 1
+        load_queue.enqueue.assert_called_once_with(load_scores, None)
+
+        assert load_scores() == 'Leaderboard loaded'
+        assert self.scores.is_loaded()
+        assert get_rank(user.id)['score'] == 1
+
+    @with_context
+    def test_updates_made_while_loading_are_replayed(self):
+        user = UserFactory.create()
+        TaskRunFactory.create(user=user)
+        leaderboard()
+        lock_key = LeaderboardScores.LOCK_KEY % 'users_rank'
+        sentinel.master.set(lock_key, 1)
+        self.scores.incr(user.id)
+        sentinel.master.delete(lock_key)
+
+        self.scores.load()
+
+        assert self.scores.rank(user.id) == (1, 2), self.scores.rank(user.id)
+
+    @with_context
+    def test_view_is_read_while_scores_are_loaded(self):
+        user = UserFactory.create()
+        TaskRunFactory.create(user=user)
+        leaderboard()
+        sentinel.master.flushall()
+        sentinel.master.set(LeaderboardScores.LOCK_KEY % 'users_rank', 1)
+
+        rank = get_rank(user.id)
+        top_users = get_leaderboard(top_users=1)
+
+        assert rank == dict(rank=1, score=1), rank
+        assert top_users[0]['name'] == user.name, top_users
+        assert not self.scores.is_loaded()
+
+    @with_context
+    def test_window_around_user(self):
+        users = UserFactory.create_batch(5)
+        for n_task_runs, user in enumerate(users):
+            TaskRunFactory.create_batch(n_task_runs, user=user)
+        leaderboard()
+
+        top_users = get_leaderboard(top_users=1, user_id=users[2].id,
+                                    window=1)
+
+        assert [u['name'] for u in top_users] == [
+            users[4].name, users[3].name, users[2].name, users[1].name]
+        assert [u['rank'] for u in top_users] == [1, 2, 3, 4], top_users
+
+
+class TestWindowedScores(Test):
+
+    def setUp(self):
+        super(TestWindowedScores, self).setUp()
+        self.scores = WindowedScores(sentinel.master, db.session)
+
+    @with_context
+    def test_task_runs_update_loaded_leaderboards(self):
+        project = ProjectFactory.create()
+        task = TaskFactory.create(project=project)
+        user = UserFactory.create()
+        TaskRunFactory.create(task=task, user=user)
+        assert self.scores.rank('project', project.id, 'all', user.id) == \
+            (1, 1)
+
+        TaskRunFactory.create(task=task, user=user)
+
+        assert ('project', project.id) in self.scores.loaded()
+        assert self.scores.rank('project', project.id, 'day', user.id) == \
+            (1, 2)
+        assert self.scores.rank('category', project.category_id, 'all',
+                                user.id) == (1, 2)
+
+    @with_context
+    def test_deleted_task_runs_reset_leaderboards(self):
+        project = ProjectFactory.create()
+        task = TaskFactory.create(project=project)
+        user = UserFactory.create()
+        TaskRunFactory.create(task=task, user=user)
+        self.scores.top('project', project.id, 'all', 10)
+
+        task_repo.delete_taskruns_from_project(project)
+
+        assert not self.scores.conn.exists(
+            WindowedScores.LOADED_KEY % ('project', project.id))
+        assert self.scores.top('project', project.id, 'all', 10) == []
+
+    @with_context
+    def test_leaderboard_being_loaded_is_not_loaded_again(self):
+        project = ProjectFactory.create()
+        TaskRunFactory.create(project=project)
+        self.scores.conn.set(
+            WindowedScores.LOCK_KEY % ('project', project.id), 1)
+
+        with patch.object(WindowedScores, 'LOAD_WAIT', 0):
+            top = self.scores.top('project', project.id, 'all', 10)
+
+        assert top == [], top
+        assert not self.scores.conn.exists(
+            WindowedScores.LOADED_KEY % ('project', project.id))
+
+    @with_context
+    def test_windowed_leaderboard_job_rebuilds_leaderboards(self):
+        project = ProjectFactory.create()
+        task = TaskFactory.create(project=project)
+        user = UserFactory.create()
+        TaskRunFactory.create(task=task, user=user)
+        self.scores.top('project', project.id, 'all', 10)
+        self.scores.conn.zadd(
+            WindowedScores.ALL_KEY % ('project', project.id), 5, user.id)
+
+        res = windowed_leaderboard('project', project.id)
+
+        assert res == 'Leaderboard rebuilt', res
+        assert self.scores.rank('project', project.id, 'all', user.id) == \
+            (1, 1)
+
+    @with_context
+    def test_increments_made_while_loading_are_replayed(self):
+        project = ProjectFactory.create()
+        task = TaskFactory.create(project=project)
+        user = UserFactory.create()
+        task_run = TaskRunFactory.create(task=task, user=user)
+        lock_key = WindowedScores.LOCK_KEY % ('project', project.id)
+        self.scores.conn.set(lock_key, 1)
+        self.scores.incr(project.id, project.category_id, user.id,
+                         task_run.finish_time)
+        self.scores.conn.delete(lock_key)
+
+        self.scores.load('project', project.id)
+
+        assert self.scores.rank('project', project.id, 'day', user.id) == \
+            (1, 2)
+
+    @with_context
+    def test_windowed_leaderboard_job_drops_deleted_projects(self):
+        self.scores.conn.set(WindowedScores.LOADED_KEY % ('project', 999), 1)
+        self.scores.conn.sadd(WindowedScores.LOADED_SET, 'project:999')
+
+        res = windowed_leaderboard('project', 999)
+
+        assert res == 'Leaderboard dropped', res
+        assert self.scores.loaded() == []
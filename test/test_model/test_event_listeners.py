@@ -18,12 +18,14 @@
 
 from default import Test, with_context
 from factories import TaskFactory, TaskRunFactory
+from factories import ProjectFactory, UserFactory
 from mock import patch, MagicMock
 from pybossa.core import db, task_repo, result_repo
 from pybossa.model.counter import Counter
+from pybossa.model.task_run import TaskRun
 from pybossa.model.event_listeners import *
 from pybossa.jobs import notify_blog_users
-from sqlalchemy import func
+from redis.exceptions import ConnectionError
 
 
 """Tests for model event listeners."""
@@ -34,9 +36,9 @@ class TestModelEventListeners(Test):
 
     @with_context
     @patch('pybossa.model.event_listeners.webpush_queue.enqueue')
-    @patch('pybossa.model.event_listeners.update_feed')
+    @patch('pybossa.model.event_listeners.buffer_feed')
     @patch('pybossa.model.event_listeners.mail_queue')
-    def test_add_blog_event(self, mock_queue, mock_update_feed, mock_webpush):
+    def test_add_blog_event(self, mock_queue, mock_buffer_feed, mock_webpush):
         """Test add_blog_event is called."""
         conn = MagicMock()
         target = MagicMock()
@@ -49,17 +51,17 @@ class TestModelEventListeners(Test):
         mock_queue.enqueue.assert_called_with(notify_blog_users,
                                               blog_id=target.id,
                                               project_id=target.project_id)
-        assert mock_update_feed.called
+        assert mock_buffer_feed.called
         obj = tmp.to_public_json()
         obj['action_updated'] = 'Blog'
-        mock_update_feed.assert_called_with(obj)
+        mock_buffer_feed.assert_called_with(target, obj)
         assert mock_webpush.called
 
     @with_context
     @patch('pybossa.model.event_listeners.webpush_queue.enqueue')
-    @patch('pybossa.model.event_listeners.update_feed')
+    @patch('pybossa.model.event_listeners.buffer_feed')
     @patch('pybossa.model.event_listeners.mail_queue')
-    def test_add_blog_event_disabled(self, mock_queue, mock_update_feed, mock_webpush):
+    def test_add_blog_event_disabled(self, mock_queue, mock_buffer_feed, mock_webpush):
         """Test add_blog_event is not called when disabled is enabled."""
         conn = MagicMock()
         target = MagicMock()
@@ -72,16 +74,16 @@ class TestModelEventListeners(Test):
         with patch.dict(self.flask_app.config, {'DISABLE_EMAIL_NOTIFICATIONS': True}):
             add_blog_event(None, conn, target)
             assert mock_queue.enqueue.called is False
-            assert mock_update_feed.called
+            assert mock_buffer_feed.called
             obj = tmp.to_public_json()
             obj['action_updated'] = 'Blog'
-            mock_update_feed.assert_called_with(obj)
+            mock_buffer_feed.assert_called_with(target, obj)
             assert mock_webpush.called is False
 
 
     @with_context
-    @patch('pybossa.model.event_listeners.update_feed')
-    def test_add_project_event(self, mock_update_feed):
+    @patch('pybossa.model.event_listeners.buffer_feed')
+    def test_add_project_event(self, mock_buffer_feed):
         """Test add_project_event is called."""
         conn = MagicMock()
         target = MagicMock()
@@ -95,16 +97,16 @@ class TestModelEventListeners(Test):
 
         conn.execute.return_value = [tmp]
         add_project_event(None, conn, target)
-        assert mock_update_feed.called
+        assert mock_buffer_feed.called
         obj = tmp.to_public_json()
         obj['action_updated'] = 'Project'
-        mock_update_feed.assert_called_with(obj)
+        mock_buffer_feed.assert_called_with(target, obj)
 
-        mock_update_feed.assert_called_with(obj)
+        mock_buffer_feed.assert_called_with(target, obj)
 
     @with_context
-    @patch('pybossa.model.event_listeners.update_feed')
-    def test_add_task_event(self, mock_update_feed):
+    @patch('pybossa.model.event_listeners.buffer_feed')
+    def test_add_task_event(self, mock_buffer_feed):
         """Test add_task_event is called."""
         conn = MagicMock()
         target = MagicMock()
@@ -114,90 +116,93 @@ class TestModelEventListeners(Test):
                       info=dict(container=1, thumbnail="avatar.png"))
         conn.execute.return_value = [tmp]
         add_task_event(None, conn, target)
-        assert mock_update_feed.called
+        assert mock_buffer_feed.called
         obj = tmp.to_public_json()
         obj['action_updated'] = 'Task'
-        mock_update_feed.assert_called_with(obj)
+        mock_buffer_feed.assert_called_with(target, obj)
 
     @with_context
     @patch('pybossa.model.event_listeners.push_webhook')
-    @patch('pybossa.model.event_listeners.create_result', return_value=1)
-    @patch('pybossa.model.event_listeners.update_task_state')
-    @patch('pybossa.model.event_listeners.is_task_completed', return_value=True)
-    @patch('pybossa.model.event_listeners.add_user_contributed_to_feed')
     @patch('pybossa.model.event_listeners.update_feed')
-    def test_on_taskrun_submit_event(self, mock_update_feed,
-                                     mock_add_user,
-                                     mock_is_task,
-                                     mock_update_task,
-                                     mock_create_result,
-                                     mock_push):
-        """Test on_taskrun_submit is called."""
-        conn = MagicMock()
-        target = MagicMock()
-        target.id = 1
-        target.project_id = 1
-        target.task_id = 2
-        target.user_id = 3
-        tmp = Project(id=1, name='name', short_name='short_name',
-                      info=dict(container=1, thumbnail="avatar.png"),
-                      published=True,
-                      webhook='http://localhost.com')
-        conn.execute.return_value = [tmp]
-        on_taskrun_submit(None, conn, target)
-        obj = tmp.to_public_json()
+    def test_on_taskrun_submit_event(self, mock_update_feed, mock_push):
+        """Test on_taskrun_submit completes the task after commit."""
+        project = ProjectFactory.create(webhook='http://localhost.com')
+        user = UserFactory.create()
+        task = TaskFactory.create(project=project, n_answers=1)
+        TaskRunFactory.create(task=task, user=user)
+
+        task = task_repo.get_task(task.id)
+        result = result_repo.get_by(task_id=task.id, last_version=True)
+        assert task.state == 'completed', task.state
+        assert result is not None
+
+        tmp = dict(id=project.id, name=project.name,
+                   short_name=project.short_name, info=project.info,
+                   category_id=project.category_id)
+        obj = Project().to_public_json(tmp)
         obj['action_updated'] = 'TaskCompleted'
-        mock_add_user.assert_called_with(conn, target.user_id, obj)
-        mock_update_task.assert_called_with(conn, target.task_id)
-        mock_update_feed.assert_called_once_with(obj)
-        obj_with_webhook = tmp.to_public_json()
-        obj_with_webhook['webhook'] = tmp.webhook
-        obj_with_webhook['action_updated'] = 'TaskCompleted'
-        mock_push.assert_called_with(obj_with_webhook, target.task_id, 1)
-
+        contribution = User().to_public_json(dict(name=user.name,
+                                                  fullname=user.fullname,
+                                                  info=user.info))
+        contribution.update(project_id=project.id,
+                            project_name=project.name,
+                            project_short_name=project.short_name,
+                            category_id=project.category_id,
+                            action_updated='UserContribution')
+        mock_update_feed.assert_called_once_with(contribution, obj)
+        obj_with_webhook = dict(obj)
+        obj_with_webhook['webhook'] = project.webhook
+        mock_push.assert_called_with(obj_with_webhook, task.id, result.id)
 
     @with_context
+    @patch('pybossa.model.event_listeners.push_webhook')
     @patch('pybossa.model.event_listeners.update_feed')
-    def test_add_user_event(self, mock_update_feed):
+    def test_on_taskrun_submit_side_effects_wait_for_commit(self,
+                                                            mock_update_feed,
+                                                            mock_push):
+        """Test on_taskrun_submit side effects are dropped on rollback."""
+        task = TaskFactory.create(n_answers=1)
+        user = UserFactory.create()
+        task_run = TaskRun(project_id=task.project_id, task_id=task.id,
+                           user_id=user.id, info='yes')
+        db.session.add(task_run)
+        db.session.flush()
+
+        assert not mock_update_feed.called
+        assert not mock_push.called
+
+        db.session.rollback()
+        db.session.commit()
+
+        assert not mock_update_feed.called
+        assert not mock_push.called
+
+    @with_context
+    @patch('pybossa.model.event_listeners.buffer_feed')
+    def test_add_user_event(self, mock_buffer_feed):
         """Test add_user_event is called."""
         conn = MagicMock()
         user = User(name="John", fullname="John")
         add_user_event(None, conn, user)
-        assert mock_update_feed.called
+        assert mock_buffer_feed.called
         obj = user.to_public_json()
         obj['action_updated'] = 'User'
-        mock_update_feed.assert_called_with(obj)
+        mock_buffer_feed.assert_called_with(user, obj)
 
     @with_context
-    @patch('pybossa.model.event_listeners.create_result')
-    def test_create_result_event(self, mock_create_result):
-        """Test create_result is called."""
-        from pybossa.core import db
+    def test_on_taskrun_submit_versions_results(self):
+        """Test on_taskrun_submit keeps only one last_version result."""
         task = TaskFactory.create(n_answers=1)
         TaskRunFactory.create(task=task)
-        conn = db.engine.connect()
-        result_id = create_result(conn, task.project_id, task.id)
-        result = result_repo.filter_by(project_id=task.project_id,
-                                       task_id=task.id,
-                                       last_version=True)[0]
-
-        assert mock_create_result.called
-        err_msg = "The result should ID should be the same"
-        assert result_id == result.id, err_msg
-
-        task.n_answers = 2
-        task_repo.update(task)
+        first = result_repo.get_by(task_id=task.id, last_version=True)
+
         TaskRunFactory.create(task=task)
 
-        result_id = create_result(conn, task.project_id, task.id)
-        assert mock_create_result.called
-        result = result_repo.filter_by(project_id=task.project_id,
-                                       task_id=task.id,
-                                       last_version=True)
-        assert len(result) == 1, len(result)
-        result = result[0]
-        err_msg = "The result should ID should be the same"
-        assert result_id == result.id, err_msg
+        results = result_repo.filter_by(task_id=task.id, last_version=True)
+        assert len(results) == 1, len(results)
+        result = results[0]
+        assert result.id != first.id, result
+        assert len(result.task_run_ids) == 2, result.task_run_ids
 
     @with_context
     def test_counter_works_default(self):
@@ -216,69 +221,74 @@ class TestModelEventListeners(Test):
         
     @with_context
     def test_counter_works_add_counter(self):
-        """Test event listener when adding a task run adds a counter."""
+        """Test event listener when adding a task run increases the counter."""
 
         task_run = TaskRunFactory.create()
 
         counters = db.session.query(Counter).filter_by(project_id=task_run.project.id,
                                                        task_id=task_run.task.id)\
-                     .order_by(Counter.id).all()
-
-        assert len(counters) == 2, counters
-        for c in counters:
-            assert c.task_id == task_run.task.id, c
-            assert c.project_id == task_run.project.id, c
-
-        counters = db.session.query(Counter.project_id, Counter.task_id, func.sum(Counter.n_task_runs))\
-                     .filter_by(project_id=task_run.project.id,
-                                task_id=task_run.task.id)\
-                     .group_by(Counter.project_id, Counter.task_id).all()
+                     .all()
 
         assert len(counters) == 1, counters
         counter = counters[0]
-        assert counter[1] == 1, counter
+        assert counter.task_id == task_run.task.id, counter
+        assert counter.project_id == task_run.project.id, counter
+        assert counter.n_task_runs == 1, counter
 
     @with_context
-    def test_delete_taskrun_adds_counter(self):
-        """Delete event for task run adds a counter."""
+    def test_delete_taskrun_decreases_counter(self):
+        """Delete event for task run decreases the counter."""
         task_run = TaskRunFactory.create()
+        TaskRunFactory.create(task=task_run.task)
 
-        counters = db.session.query(Counter).filter_by(project_id=task_run.project.id,
-                                                       task_id=task_run.task.id)\
-                     .order_by(Counter.id).all()
+        counter = db.session.query(Counter).filter_by(task_id=task_run.task.id)\
+                    .one()
+        assert counter.n_task_runs == 2, counter
 
-        assert len(counters) == 2, counters
-        for c in counters:
-            assert c.task_id == task_run.task.id, c
-            assert c.project_id == task_run.project.id, c
+        db.session.delete(task_run)
+        db.session.commit()
 
-        counters = db.session.query(Counter.project_id, Counter.task_id, func.sum(Counter.n_task_runs))\
-                     .filter_by(project_id=task_run.project.id,
-                                task_id=task_run.task.id)\
-                     .group_by(Counter.project_id, Counter.task_id).all()
+        counters = db.session.query(Counter).filter_by(project_id=task_run.project.id,
+                                                       task_id=task_run.task.id)\
+                     .all()
 
         assert len(counters) == 1, counters
         counter = counters[0]
-        assert counter[2] == 1, counter
+        assert counter.task_id == task_run.task.id, counter
+        assert counter.project_id == task_run.project.id, counter
+        assert counter.n_task_runs == 1, counter
 
-        db.session.delete(task_run)
-        db.session.commit()
+    @with_context
+    @patch('pybossa.model.event_listeners.LeaderboardScores.incr')
+    def test_failed_after_commit_hook_does_not_fail_commit(self, mock_incr):
+        """Test a failing after commit hook is logged and the task run is
+        still saved."""
+        mock_incr.side_effect = ConnectionError('Redis is down')
+        user = UserFactory.create()
 
-        counters = db.session.query(Counter).filter_by(project_id=task_run.project.id,
-                                                       task_id=task_run.task.id)\
-                     .order_by(Counter.id).all()
+        with patch.object(self.flask_app.logger, 'exception') as exception:
+            task_run = TaskRunFactory.create(user=user)
+
+        assert mock_incr.called
+        assert exception.called
+        assert db.session.query(TaskRun).get(task_run.id) is not None
 
-        assert len(counters) == 3, counters
-        for c in counters:
-            assert c.task_id == task_run.task.id, c
-            assert c.project_id == task_run.project.id, c
+    @with_context
+    @patch('pybossa.model.event_listeners.ContributionsGuard.release')
+    def test_task_lease_is_released_after_commit(self, mock_release):
+        """Test the lease of a task is only released once its task run is
+        committed."""
+        task = TaskFactory.create()
+        user = UserFactory.create()
+        task_run = TaskRun(project_id=task.project_id, task_id=task.id,
+                           user_id=user.id, info='yes')
+        db.session.add(task_run)
+        db.session.flush()
 
+        assert not mock_release.called
 
-        counters = db.session.query(Counter.project_id, Counter.task_id, func.sum(Counter.n_task_runs))\
-                     .filter_by(project_id=task_run.project.id,
-                                task_id=task_run.task.id)\
-                     .group_by(Counter.project_id, Counter.task_id).all()
+        db.session.commit()
 
-        assert len(counters) == 1, counters
-        counter = counters[0]
-        assert counter[2] == 0, counter
+        mock_release.assert_called_with(task.id, dict(user_id=user.id,
+                                                      user_ip=None,
+                                                      external_uid=None))
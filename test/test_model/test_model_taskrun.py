@@ -59,3 +59,43 @@ class TestModelTaskRun(Test):
         db.session.add(task_run)
         assert_raises(IntegrityError, db.session.commit)
         db.session.rollback()
+
+    @with_context
+    def test_task_run_timestamptz_columns(self):
+        """Test TASK_RUN copies its timestamps to the timestamptz columns."""
+        user = User(
+            email_addr="john.doe@example.com",
+            name="johndoe",
+            fullname="John Doe",
+            locale="en")
+        category = Category(name=u'cat', short_name=u'cat', description=u'cat')
+        project = Project(name='Application', short_name='app', description='desc',
+                  owner=user, category=category)
+        task = Task(project=project)
+        db.session.add_all([user, project, task])
+        db.session.commit()
+
+        task_run = TaskRun(project_id=project.id, task_id=task.id,
+                           user_id=user.id,
+                           created='2018-06-25T10:12:40.512337',
+                           finish_time='2018-06-25T10:14:00.000000')
+        db.session.add(task_run)
+        db.session.commit()
+
+        created_at = task_run.created_at.utctimetuple()
+        finished_at = task_run.finished_at.utctimetuple()
+        assert created_at[:6] == (2018, 6, 25, 10, 12, 40), created_at
+        assert finished_at[:6] == (2018, 6, 25, 10, 14, 0), finished_at
+
+        task_run.finish_time = '2018-06-26T08:00:00.000000'
+        db.session.commit()
+        db.session.refresh(task_run)
+        finished_at = task_run.finished_at.utctimetuple()
+
+        assert finished_at[:6] == (2018, 6, 26, 8, 0, 0), finished_at
+
+        task_run.finish_time = 'not a timestamp'
+        db.session.commit()
+        db.session.refresh(task_run)
+
+        assert task_run.finished_at is None, task_run.finished_at
@@ -0,0 +1,53 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+
+from pybossa.redis_lock import RedisLock
+import settings_test
+from redis.sentinel import Sentinel
+
+
+class TestRedisLock(object):
+
+    def setUp(self):
+        sentinel = Sentinel(settings_test.REDIS_SENTINEL)
+        db = getattr(settings_test, 'REDIS_DB', 0)
+        self.conn = sentinel.master_for('mymaster', db=db)
+        self.conn.flushall()
+
+    def test_lock_is_held_by_one_worker(self):
+        lock = RedisLock(self.conn, 'test:lock', 10)
+        other = RedisLock(self.conn, 'test:lock', 10)
+
+        assert lock.acquire()
+        assert not other.acquire()
+        assert other.is_locked()
+
+        lock.release()
+        assert not lock.is_locked()
+        assert other.acquire()
+
+    def test_expired_lock_does_not_release_the_next_one(self):
+        lock = RedisLock(self.conn, 'test:lock', 10)
+        other = RedisLock(self.conn, 'test:lock', 10)
+        lock.acquire()
+        self.conn.delete('test:lock')
+        other.acquire()
+
+        lock.release()
+
+        assert other.is_locked()
@@ -67,6 +67,22 @@ class TestTaskRepositoryForTaskQueries(Test):
                                               project_id=project.id)[0][0]
         assert task == task2, (task.fav_user_ids, task2.fav_user_ids)
 
+    @with_context
+    def test_orderby_created_not_backfilled(self):
+        """Test orderby created sorts tasks without created_at by created."""
+        project = ProjectFactory.create()
+        TaskFactory.create(project=project,
+                           created='2018-01-01T10:00:00.000000')
+        task2 = TaskFactory.create(project=project,
+                                   created='2018-01-02T10:00:00.000000')
+        db.session.execute('UPDATE task SET created_at = NULL WHERE id = :id',
+                           dict(id=task2.id))
+        db.session.commit()
+
+        task = self.task_repo.filter_tasks_by(orderby='created', desc=True,
+                                              project_id=project.id)[0]
+        assert task == task2, (task.id, task2.id)
+
     @with_context
     def test_handle_info_json_plain_text(self):
         """Test handle info in JSON as plain text works."""
@@ -309,6 +325,19 @@ class TestTaskRepositoryForTaskQueries(Test):
         assert last_two == all_tasks[2:]
 
 
+    @with_context
+    def test_find_existing_infos(self):
+        """Test find_existing_infos returns the positions of known infos"""
+        project = ProjectFactory.create()
+        TaskFactory.create(project=project, info={'a': 1, 'b': 2})
+        TaskFactory.create(info={'a': 3})
+
+        existing = self.task_repo.find_existing_infos(
+            project.id, [{'a': 3}, {'b': 2, 'a': 1}, 'other'])
+
+        assert existing == set([1]), existing
+
+
     @with_context
     def test_count_tasks_with_no_matches(self):
         """Test count_tasks_with returns 0 if no tasks match the query"""
@@ -502,6 +531,16 @@ class TestTaskRepositoryForTaskrunQueries(Test):
         for taskrun in yielded_task_runs:
             assert taskrun in task_runs
 
+    @with_context
+    def test_filter_task_runs_yield_option_fetches_in_batches(self):
+        """Test that filter_task_runs_by with the yielded=True option
+        fetches YIELD_PER rows at a time whatever the limit"""
+
+        yielded_task_runs = self.task_repo.filter_task_runs_by(limit=10000,
+                                                               yielded=True)
+
+        assert yielded_task_runs._yield_per == self.task_repo.YIELD_PER
+
 
     @with_context
     def test_filter_tasks_runs_limit_offset(self):
@@ -608,6 +647,58 @@ class TestTaskRepositorySaveDeleteUpdate(Test):
         assert_raises(WrongObjectError, self.task_repo.save, bad_object)
 
 
+    @with_context
+    def test_bulk_save_creates_tasks_and_counters(self):
+        """Test bulk_save inserts the tasks in chunks with their counters"""
+        from pybossa.model.counter import Counter
+        project = ProjectFactory.create()
+        tasks = [dict(info=dict(n=i), n_answers=2) for i in range(5)]
+        progress = []
+
+        created = self.task_repo.bulk_save(project.id, tasks, chunk_size=2,
+                                           progress=progress.append)
+        saved = self.task_repo.filter_tasks_by(project_id=project.id)
+        counters = db.session.query(Counter).filter_by(project_id=project.id)
+
+        assert created == 5, created
+        assert progress == [2, 4, 5], progress
+        assert sorted(t.info['n'] for t in saved) == range(5), saved
+        assert all(t.n_answers == 2 for t in saved), saved
+        assert all(t.state == 'ongoing' for t in saved), saved
+        assert all(t.created is not None for t in saved), saved
+        assert sorted(c.task_id for c in counters) == sorted(t.id for t in saved)
+
+
+    @with_context
+    def test_bulk_save_adds_one_feed_event(self):
+        """Test bulk_save adds a single feed event for all the tasks"""
+        from pybossa.feed import get_update_feed
+        project = ProjectFactory.create()
+
+        self.task_repo.bulk_save(project.id,
+                                 [dict(info=dict(n=i)) for i in range(3)])
+        events = [e for e in get_update_feed()
+                  if e['action_updated'] == 'Task']
+
+        assert len(events) == 1, events
+        assert events[0]['n_tasks'] == 3, events
+        assert events[0]['short_name'] == project.short_name, events
+
+
+    @with_context
+    def test_bulk_save_rolls_back_on_error(self):
+        """Test bulk_save does not keep any task if the input fails"""
+        project = ProjectFactory.create()
+
+        def tasks():
+            yield dict(info=dict(n=1))
+            raise ValueError('broken input')
+
+        assert_raises(ValueError, self.task_repo.bulk_save, project.id,
+                      tasks(), chunk_size=1)
+        assert self.task_repo.filter_tasks_by(project_id=project.id) == []
+
+
     @with_context
     def test_update_task(self):
         """Test update persists the changes made to Task instances"""
@@ -453,6 +453,23 @@ class TestSched(sched.Helper):
         assert data['id'] == task2.id, data
         assert data['fav_user_ids'] == task2.fav_user_ids, data
 
+    @with_context
+    @patch('pybossa.sched.counters_are_compacted', return_value=False)
+    def test_newtask_breadth_counters_not_compacted(self, compacted):
+        """Test SCHED breadth first adds up the counter rows of a task until
+        they are compacted."""
+        project = ProjectFactory.create(info=dict(sched="breadth_first"))
+        task1 = TaskFactory.create(project=project, n_answers=2)
+        task2 = TaskFactory.create(project=project, n_answers=2)
+        TaskRunFactory.create(task=task1)
+
+        url = "/api/project/%s/newtask" % project.id
+        res = self.app.get(url)
+        data = json.loads(res.data)
+
+        assert data['id'] == task2.id, data
+        assert compacted.called
+
 
     @with_context
     def test_newtask_default_orderby(self):
@@ -1445,3 +1462,52 @@ class TestBreadthFirst(Test):
         res = self.app.get(url)
         task_four = json.loads(res.data)
         assert task_four == {}, task_four
+
+    @with_context
+    def test_leased_task_is_not_handed_out_twice(self):
+        """Test SCHED does not give a fully leased task to another user."""
+        owner = UserFactory.create(id=500)
+        user = UserFactory.create(id=501)
+        project = ProjectFactory.create(owner=owner)
+        TaskFactory.create_batch(2, project=project, n_answers=1)
+
+        url = '/api/project/%s/newtask?api_key=%s'
+        res = self.app.get(url % (project.id, owner.api_key))
+        task_one = json.loads(res.data)
+        res = self.app.get(url % (project.id, user.api_key))
+        task_two = json.loads(res.data)
+
+        assert task_one['id'] != task_two['id'], (task_one, task_two)
+
+        res = self.app.get(url % (project.id, owner.api_key))
+        task_three = json.loads(res.data)
+        assert task_three['id'] == task_one['id'], task_three
+
+    @with_context
+    def test_prefetch_returns_leased_tasks(self):
+        """Test SCHED prefetch returns a batch of tasks with their leases."""
+        project = ProjectFactory.create()
+        TaskFactory.create_batch(30, project=project)
+
+        res = self.app.get('api/project/%s/newtask/prefetch' % project.id)
+        data = json.loads(res.data)
+
+        assert len(data) == 20, len(data)
+        for task in data:
+            assert task['lease_expires'], task
+            taskrun = dict(project_id=project.id, task_id=task['id'],
+                           info='hola')
+            res = self.app.post('api/taskrun', data=json.dumps(taskrun))
+            assert res.status_code == 200, res.data
+
+    @with_context
+    def test_prefetch_respects_limit(self):
+        """Test SCHED prefetch returns at most limit tasks."""
+        project = ProjectFactory.create()
+        TaskFactory.create_batch(10, project=project)
+
+        url = 'api/project/%s/newtask/prefetch?limit=5' % project.id
+        res = self.app.get(url)
+        data = json.loads(res.data)
+
+        assert len(data) == 5, len(data)
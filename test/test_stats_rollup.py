@@ -0,0 +1,131 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+
+from datetime import datetime, timedelta
+
+from default import Test, db, with_context
+from factories import ProjectFactory, TaskFactory, TaskRunFactory
+from factories import AnonymousTaskRunFactory
+from pybossa.cache.project_stats import update_stats
+from pybossa.core import sentinel, task_repo
+from pybossa.model.project_stats import ProjectStats
+from pybossa.stats_rollup import StatsRollup
+
+
+class TestStatsRollup(Test):
+
+    def setUp(self):
+        super(TestStatsRollup, self).setUp()
+        self.rollup = StatsRollup(sentinel.master, db.session)
+
+    @with_context
+    def test_sync_adds_answers_per_day_and_hour(self):
+        project = ProjectFactory.create()
+        now = datetime.utcnow()
+        TaskRunFactory.create(project=project, finish_time=now.isoformat())
+        AnonymousTaskRunFactory.create(project=project,
+                                       finish_time=now.isoformat())
+
+        self.rollup.sync(project.id)
+        dates, dates_anon, dates_auth = self.rollup.dates(project.id, 7)
+        hours, hours_anon, hours_auth, max_hours, max_hours_anon, \
+            max_hours_auth = self.rollup.hours(project.id, 7)
+
+        today = now.strftime('%Y-%m-%d')
+        hour = now.strftime('%H')
+        assert len(dates) == 7, dates
+        assert dates[today] == 2, dates
+        assert dates_anon[today] == 1, dates_anon
+        assert dates_auth[today] == 1, dates_auth
+        assert hours[hour] == 2, hours
+        assert hours_anon[hour] == 1, hours_anon
+        assert hours_auth[hour] == 1, hours_auth
+        assert (max_hours, max_hours_anon, max_hours_auth) == (2, 1, 1)
+
+    @with_context
+    def test_sync_adds_only_new_task_runs(self):
+        project = ProjectFactory.create()
+        task = TaskFactory.create(project=project)
+        run = TaskRunFactory.create(project=project, task=task)
+        self.rollup.sync(project.id)
+        TaskRunFactory.create(project=project, task=task, user=run.user)
+
+        self.rollup.sync(project.id)
+        users, anon_users, auth_users = self.rollup.users(project.id, 7)
+        dates, dates_anon, dates_auth = self.rollup.dates(project.id, 7)
+
+        assert users == dict(n_auth=1, n_anon=0), users
+        assert auth_users == [[run.user.id, 2]], auth_users
+        assert anon_users == [], anon_users
+        assert sum(dates_auth.values()) == 2, dates_auth
+        assert sum(dates.values()) == 1, dates
+
+    @with_context
+    def test_answers_older_than_the_period_are_left_out(self):
+        project = ProjectFactory.create()
+        old = (datetime.utcnow() - timedelta(days=16)).isoformat()
+        AnonymousTaskRunFactory.create(project=project, finish_time=old)
+
+        self.rollup.sync(project.id)
+        users, anon_users, auth_users = self.rollup.users(project.id, 7)
+        hours = self.rollup.hours(project.id, 7)
+
+        assert users == dict(n_auth=0, n_anon=0), users
+        assert anon_users == [], anon_users
+        assert hours[3] is None, hours
+
+    @with_context
+    def test_deleting_task_runs_resets_the_rollups(self):
+        project = ProjectFactory.create()
+        TaskRunFactory.create(project=project)
+        self.rollup.sync(project.id)
+
+        task_repo.delete_taskruns_from_project(project)
+        self.rollup.sync(project.id)
+        users, anon_users, auth_users = self.rollup.users(project.id, 7)
+
+        assert users == dict(n_auth=0, n_anon=0), users
+        assert auth_users == [], auth_users
+
+    @with_context
+    def test_sync_is_skipped_while_another_worker_syncs(self):
+        project = ProjectFactory.create()
+        TaskRunFactory.create(project=project)
+        self.rollup.conn.set(StatsRollup.LOCK_KEY % project.id, 'other')
+
+        synced = self.rollup.sync(project.id)
+        dates, dates_anon, dates_auth = self.rollup.dates(project.id, 7)
+
+        assert synced is False
+        assert sum(dates_auth.values()) == 0, dates_auth
+        assert self.rollup.conn.get(
+            StatsRollup.LOCK_KEY % project.id) == 'other'
+
+    @with_context
+    def test_update_stats_uses_the_rollups(self):
+        project = ProjectFactory.create()
+        TaskRunFactory.create(project=project)
+        AnonymousTaskRunFactory.create(project=project)
+
+        update_stats(project.id)
+        ps = db.session.query(ProjectStats).filter_by(
+            project_id=project.id).first()
+
+        assert self.rollup.conn.exists(StatsRollup.LAST_ID_KEY % project.id)
+        assert ps.info['users_stats']['n_auth'] == 1, ps.info
+        assert ps.info['users_stats']['n_anon'] == 1, ps.info
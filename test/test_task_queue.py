@@ -0,0 +1,136 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2017 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+
+from default import Test, db, with_context
+from factories import ProjectFactory, TaskFactory, TaskRunFactory
+from factories import UserFactory, AnonymousTaskRunFactory
+from pybossa.core import sentinel, task_repo
+from pybossa.sched import get_task_queue_task
+from pybossa.task_queue import TaskQueue
+
+
+class TestTaskQueue(Test):
+
+    def setUp(self):
+        super(TestTaskQueue, self).setUp()
+        self.queue = TaskQueue(sentinel.master, db.session)
+
+    @with_context
+    def test_get_tasks_returns_tasks_sorted_by_priority(self):
+        project = ProjectFactory.create()
+        low = TaskFactory.create(project=project, priority_0=0.1)
+        high = TaskFactory.create(project=project, priority_0=0.9)
+
+        task_ids = self.queue.get_tasks(project.id, user_id=1, limit=2)
+
+        assert task_ids == [high.id, low.id], task_ids
+
+    @with_context
+    def test_get_tasks_skips_tasks_seen_by_user(self):
+        project = ProjectFactory.create()
+        user = UserFactory.create()
+        seen = TaskFactory.create(project=project, priority_0=0.9)
+        other = TaskFactory.create(project=project, priority_0=0.1)
+        TaskRunFactory.create(task=seen, user=user)
+
+        task_ids = self.queue.get_tasks(project.id, user_id=user.id)
+
+        assert task_ids == [other.id], task_ids
+
+    @with_context
+    def test_get_tasks_scans_past_seen_tasks(self):
+        project = ProjectFactory.create()
+        user = UserFactory.create()
+        tasks = [TaskFactory.create(project=project, priority_0=0.1 * i)
+                 for i in range(1, 6)]
+        for task in tasks[2:]:
+            TaskRunFactory.create(task=task, user=user)
+        self.queue.SCAN = 2
+
+        task_ids = self.queue.get_tasks(project.id, user_id=user.id, limit=3)
+
+        assert task_ids == [tasks[1].id, tasks[0].id], task_ids
+
+    @with_context
+    def test_get_tasks_skips_completed_tasks(self):
+        project = ProjectFactory.create()
+        TaskFactory.create(project=project, state='completed')
+        ongoing = TaskFactory.create(project=project)
+
+        task_ids = self.queue.get_tasks(project.id, user_ip='127.0.0.1',
+                                        limit=10)
+
+        assert task_ids == [ongoing.id], task_ids
+
+    @with_context
+    def test_queue_is_updated_by_listeners(self):
+        project = ProjectFactory.create()
+        self.queue.get_tasks(project.id, user_id=1)
+        task = TaskFactory.create(project=project, priority_0=0.5)
+
+        assert self.queue.get_tasks(project.id, user_id=1) == [task.id]
+
+        task.state = 'completed'
+        task_repo.update(task)
+
+        assert self.queue.get_tasks(project.id, user_id=1) == []
+
+    @with_context
+    def test_seen_set_is_updated_by_listeners(self):
+        project = ProjectFactory.create()
+        task = TaskFactory.create(project=project)
+        ip = '127.0.0.1'
+        assert self.queue.get_tasks(project.id, user_ip=ip) == [task.id]
+
+        AnonymousTaskRunFactory.create(task=task, user_ip=ip)
+
+        assert self.queue.get_tasks(project.id, user_ip=ip) == []
+
+    @with_context
+    def test_reset_seen_discards_seen_sets(self):
+        project = ProjectFactory.create()
+        user = UserFactory.create()
+        task = TaskFactory.create(project=project)
+        TaskRunFactory.create(task=task, user=user)
+        assert self.queue.get_tasks(project.id, user_id=user.id) == []
+
+        task_repo.delete_taskruns_from_project(project)
+        task_ids = self.queue.get_tasks(project.id, user_id=user.id)
+
+        assert task_ids == [task.id], task_ids
+
+    @with_context
+    def test_get_task_queue_task_returns_tasks(self):
+        project = ProjectFactory.create()
+        tasks = TaskFactory.create_batch(3, project=project)
+
+        res = get_task_queue_task(project.id, user_id=1, limit=3)
+
+        assert sorted(t.id for t in res) == sorted(t.id for t in tasks)
+
+    @with_context
+    def test_newtask_uses_task_queue_scheduler(self):
+        project = ProjectFactory.create(info=dict(sched='task_queue'))
+        task = TaskFactory.create(project=project, info='hola')
+
+        res = self.app.get('api/project/%s/newtask' % project.id)
+        data = json.loads(res.data)
+
+        assert data['id'] == task.id, data
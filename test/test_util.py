@@ -524,6 +524,17 @@ class TestPybossaUtil(Test):
             for item in row:
                 assert isinstance(item, unicode), err_msg
 
+    def test_iter_decoded_lines(self):
+        """Test iter_decoded_lines joins lines and characters split in chunks."""
+        content = u'a,b\r\n"M\xfcn\nchen",2\nlast'.encode('utf-8')
+        chunks = [content[i:i + 3] for i in range(0, len(content), 3)]
+
+        lines = list(util.iter_decoded_lines(chunks))
+
+        assert lines == [u'a,b\r\n', u'"M\xfcn\n', u'chen",2\n', u'last'], lines
+        rows = list(util.unicode_csv_reader(lines))
+        assert rows[1] == [u'M\xfcn\nchen', u'2'], rows
+
     def test_UnicodeWriter(self):
         """Test UnicodeWriter class works."""
         tmp = tempfile.NamedTemporaryFile()
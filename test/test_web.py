@@ -40,7 +40,7 @@ from pybossa.model.result import Result
 from pybossa.messages import *
 from pybossa.leaderboard.jobs import leaderboard as update_leaderboard
 from pybossa.core import user_repo, project_repo, result_repo, signer
-from pybossa.jobs import send_mail, import_tasks
+from pybossa.jobs import send_mail, import_tasks_in_chunks
 from pybossa.importers import ImportReport
 from pybossa.cache.project_stats import update_stats
 from factories import AnnouncementFactory, ProjectFactory, CategoryFactory, TaskFactory, TaskRunFactory, UserFactory
@@ -2530,7 +2530,9 @@ class TestWeb(web.Helper):
         expected = [call('1_test-app_task_json.zip', 'user_2'),
                     call('1_test-app_task_csv.zip', 'user_2'),
                     call('1_test-app_task_run_json.zip', 'user_2'),
-                    call('1_test-app_task_run_csv.zip', 'user_2')]
+                    call('1_test-app_task_run_csv.zip', 'user_2'),
+                    call('1_test-app_task_parquet.zip', 'user_2'),
+                    call('1_test-app_task_run_parquet.zip', 'user_2')]
         assert uploader.delete_file.call_args_list == expected
 
     @with_context
@@ -5810,7 +5812,8 @@ class TestWeb(web.Helper):
 
         assert tasks == [], "Tasks should not be immediately added"
         data = {'type': 'csv', 'csv_url': 'http://myfakecsvurl.com'}
-        queue.enqueue.assert_called_once_with(import_tasks, project.id, **data)
+        queue.enqueue.assert_called_once_with(import_tasks_in_chunks,
+                                              project.id, **data)
         msg = "You&#39;re trying to import a large amount of tasks, so please be patient.\
             You will receive an email when the tasks are ready."
         assert msg in res.data
@@ -6236,7 +6239,9 @@ class TestWeb(web.Helper):
         expected = [call('1_test-app_task_json.zip', 'user_2'),
                     call('1_test-app_task_csv.zip', 'user_2'),
                     call('1_test-app_task_run_json.zip', 'user_2'),
-                    call('1_test-app_task_run_csv.zip', 'user_2')]
+                    call('1_test-app_task_run_csv.zip', 'user_2'),
+                    call('1_test-app_task_parquet.zip', 'user_2'),
+                    call('1_test-app_task_run_parquet.zip', 'user_2')]
         assert uploader.delete_file.call_args_list == expected
 
     @with_context